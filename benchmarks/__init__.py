@@ -0,0 +1,5 @@
+# Jason B. Hill (jason@jasonbhill.com)
+#
+# Benchmarks for tweetwatch. See throughput.py (end to end, through a mock
+# streaming endpoint), micro.py (meters, matching and aggregation) and
+# corpus.py (the synthetic tweets they run on).
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+# Jason B. Hill (jason@jasonbhill.com)
+#
+# Parallel analysis benchmark: writes capture files of synthetic tweets from
+# corpus.py, then runs the per-time-zone, per-minute-of-day count of the
+# timezone-GMT examples through tweetwatch.analysis.run with processes=1 and
+# with each of --processes, and prints one line of JSON per run (processes,
+# lines, best time over the repeats, lines/sec, speedup over processes=1).
+#
+# Usage: python benchmarks/analysis.py [options]
+#        python benchmarks/analysis.py --tweets 1000000 --processes 2 4 8 \
+#            --output results.jsonl
+#
+# The speedup is bounded by the number of cores (reported as "cpus") and by
+# how fast the files can be read; use --keep and a second run for a warm page
+# cache.
+
+import os
+import sys
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import multiprocessing
+from timeit import default_timer
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+# run from a checkout without installing tweetwatch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tweetwatch.analysis
+from tweetwatch.snowflake import snowflake2time, time2minute
+from benchmarks.corpus import Corpus
+
+
+def minutesByZone(tweet, acc):
+    zone = tweet['user']['time_zone']
+    counts = acc.get(zone)
+    if counts is None:
+        counts = acc[zone] = [0] * 1440
+    counts[time2minute(snowflake2time(tweet['id']))] += 1
+
+
+def combine(a, b):
+    for zone, counts in b.iteritems():
+        total = a.get(zone)
+        if total is None:
+            a[zone] = counts
+        else:
+            for i, n in enumerate(counts):
+                total[i] += n
+    return a
+
+
+def timed(paths, processes, chunk_size, repeat):
+    best = None
+    for i in range(repeat):
+        counts = {}
+        t0 = default_timer()
+        result = tweetwatch.analysis.run(paths, minutesByZone, combine=combine,
+                processes=processes, chunk_size=chunk_size, counts=counts)
+        elapsed = default_timer() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    total = sum(sum(c) for c in result.itervalues())
+    return best, counts, total
+
+
+def run(options):
+    workdir = options.workdir or tempfile.mkdtemp(prefix='tweetwatch-bench-')
+    paths = []
+    for i in range(options.files):
+        path = os.path.join(workdir, 'tweets-%d' % i)
+        if not os.path.exists(path):
+            Corpus(seed=2014 + i).write(path, options.tweets // options.files)
+        paths.append(path)
+
+    results = []
+    try:
+        baseline = None
+        expected = None
+        for processes in [1] + [p for p in options.processes if p != 1]:
+            seconds, counts, total = timed(paths, processes, options.chunk_size,
+                    options.repeat)
+            if baseline is None:
+                baseline = seconds
+                expected = total
+            elif total != expected:
+                raise RuntimeError('processes=%d counted %d tweets, not %d'
+                        % (processes, total, expected))
+            results.append({
+                'benchmark': 'analysis',
+                'timestamp': int(time.time()),
+                'python': platform.python_version(),
+                'tweetwatch': tweetwatch.analysis.__version__,
+                'cpus': multiprocessing.cpu_count(),
+                'files': len(paths),
+                'bytes': sum(os.path.getsize(p) for p in paths),
+                'chunk_size': options.chunk_size,
+                'processes': processes,
+                'lines': counts['lines'],
+                'skipped': counts['skipped'],
+                'seconds': round(seconds, 3),
+                'lines_per_sec': round(counts['lines'] / seconds, 1),
+                'speedup': round(baseline / seconds, 2)
+            })
+    finally:
+        if not options.keep and not options.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='tweetwatch.analysis.run, processes=1 vs N')
+    parser.add_argument('--tweets', type=int, default=200000, help='tweets in total')
+    parser.add_argument('--files', type=int, default=4, help='capture files to spread them over')
+    parser.add_argument('--processes', type=int, nargs='+',
+            default=[multiprocessing.cpu_count()], help='process counts to compare with 1')
+    parser.add_argument('--chunk-size', type=int, default=4194304, help='bytes per job')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per process count')
+    parser.add_argument('--workdir', help='keep capture files here and reuse them')
+    parser.add_argument('--keep', action='store_true', help='leave the temporary capture files')
+    parser.add_argument('--output', help='append the results as JSON lines to this file')
+    options = parser.parse_args()
+
+    for result in run(options):
+        line = json.dumps(result, sort_keys=True)
+        print line
+        if options.output:
+            with open(options.output, 'a') as f:
+                f.write(line + '\n')
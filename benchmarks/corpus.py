@@ -0,0 +1,172 @@
+#!/usr/bin/python
+
+# Jason B. Hill (jason@jasonbhill.com)
+#
+# Deterministic synthetic tweets for benchmarks: snowflake IDs that advance
+# like a real stream, text drawn from a vocabulary with Zipfian word
+# frequencies (plus search terms and, optionally, words from a word list),
+# and authors spread over time zones roughly as in the 2014 captures. The same
+# seed always gives the same tweets.
+#
+# Usage: python benchmarks/corpus.py output-file [number-of-tweets [seed]]
+
+import os
+import sys
+import time
+import random
+from collections import OrderedDict
+from bisect import bisect_right
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+# run from a checkout without installing tweetwatch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tweetwatch.snowflake import TWEPOCH
+
+
+# (time zone, UTC offset in seconds, relative weight); None is an author who
+# never set one, which is most of them
+TIME_ZONES = [
+    (None, None, 30),
+    ('Eastern Time (US & Canada)', -18000, 12),
+    ('Central Time (US & Canada)', -21600, 8),
+    ('Pacific Time (US & Canada)', -28800, 7),
+    ('London', 0, 6),
+    ('Moscow', 14400, 6),
+    ('Amsterdam', 3600, 4),
+    ('Quito', -18000, 4),
+    ('Brasilia', -7200, 3),
+    ('Tokyo', 32400, 3),
+    ('Athens', 7200, 2),
+    ('Madrid', 3600, 2),
+    ('Atlantic Time (Canada)', -10800, 2),
+    ('Mountain Time (US & Canada)', -25200, 2),
+    ('Hawaii', -36000, 1),
+    ('Jakarta', 25200, 1)
+]
+
+LANGS = [('en', 55), ('ru', 12), ('es', 10), ('ja', 6), ('de', 4), ('fr', 4), ('pt', 4), ('und', 5)]
+
+_SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'po', 'da', 'gu',
+              'an', 'el', 'ir', 'os', 'ut', 'ba', 'fe', 'hi']
+
+
+def _cumulative(weights):
+    """
+    Returns running totals of weights, for sampling with bisect.
+    """
+    total = 0
+    out = []
+    for w in weights:
+        total += w
+        out.append(total)
+    return out
+
+
+class Corpus:
+    def __init__(self, seed=2014, start=1391990400, rate=50.0, vocabulary=5000, zipf=1.1,
+            terms=('sochi', 'olympics', 'sochi2014'), term_rate=0.6, words=None, word_rate=0.02):
+        """
+        seed (int) - Seed of the random number generator.
+        start (int) - Unix time of the first tweet (default: 2014-02-10 GMT).
+        rate (float) - Mean tweets per second; gaps are exponential.
+        vocabulary (int) - Number of distinct filler words.
+        zipf (float) - Exponent of the word frequency distribution.
+        terms (list) - Search terms; a tweet mentions one (sometimes as a
+            hashtag) with probability term_rate.
+        words (list) - Extra words (e.g. a word list to match against); a
+            tweet contains one with probability word_rate.
+        """
+        self.seed = seed
+        self.start = start
+        self.rate = rate
+        self.terms = list(terms)
+        self.term_rate = term_rate
+        self.words = list(words or [])
+        self.word_rate = word_rate
+
+        # made-up words, shortest (and most frequent) first: word r spells out
+        # r in bijective base len(_SYLLABLES), one syllable per digit
+        self.vocabulary = []
+        for r in range(1, vocabulary + 1):
+            w = ''
+            while r:
+                r, d = divmod(r - 1, len(_SYLLABLES))
+                w = _SYLLABLES[d] + w
+            self.vocabulary.append(w)
+        self._wordWeights = _cumulative([1.0 / (r + 1) ** zipf for r in range(vocabulary)])
+        self._zoneWeights = _cumulative([z[2] for z in TIME_ZONES])
+        self._langWeights = _cumulative([l[1] for l in LANGS])
+
+    def _pick(self, rng, items, weights):
+        return items[bisect_right(weights, rng.random() * weights[-1])]
+
+    def tweets(self, n):
+        """
+        Yields n tweets as (ordered) dictionaries, in ID order.
+        """
+        rng = random.Random(self.seed)
+        t = float(self.start)
+        for i in xrange(n):
+            t += rng.expovariate(self.rate)
+            ms = int(t * 1000)
+            snowflake = ((ms - TWEPOCH) << 22) | rng.randrange(1 << 22)
+
+            tokens = [self._pick(rng, self.vocabulary, self._wordWeights)
+                      for j in range(rng.randint(5, 18))]
+            if self.terms and rng.random() < self.term_rate:
+                term = rng.choice(self.terms)
+                if rng.random() < 0.3:
+                    term = '#' + term
+                tokens.insert(rng.randrange(len(tokens) + 1), term)
+            if self.words and rng.random() < self.word_rate:
+                tokens.insert(rng.randrange(len(tokens) + 1), rng.choice(self.words))
+
+            zone, offset, weight = self._pick(rng, TIME_ZONES, self._zoneWeights)
+            user = 10000 + int(rng.paretovariate(1.2) * 1000) % 5000000
+            # fields in the order Twitter sends them; tweetwatch.message
+            # relies on it
+            yield OrderedDict([
+                ('created_at', time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(ms // 1000))),
+                ('id', snowflake),
+                ('id_str', str(snowflake)),
+                ('text', ' '.join(tokens)),
+                ('user', OrderedDict([
+                    ('id', user),
+                    ('screen_name', 'user%d' % user),
+                    ('utc_offset', offset),
+                    ('time_zone', zone)
+                ])),
+                ('lang', self._pick(rng, LANGS, self._langWeights)[0])
+            ])
+
+    def lines(self, n):
+        """
+        Yields n tweets as JSON strings ending in '\\r\\n', as captured.
+        """
+        for tweet in self.tweets(n):
+            yield json.dumps(tweet, separators=(',', ':')) + '\r\n'
+
+    def write(self, path, n):
+        """
+        Write n tweets to a JSON-lines capture file.
+        """
+        with open(path, 'wb') as f:
+            for line in self.lines(n):
+                f.write(line)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print >> sys.stderr, 'usage: python benchmarks/corpus.py output-file [number-of-tweets [seed]]'
+        sys.exit(1)
+    n = 100000
+    seed = 2014
+    if len(sys.argv) > 2:
+        n = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        seed = int(sys.argv[3])
+    Corpus(seed=seed).write(sys.argv[1], n)
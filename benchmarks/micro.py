@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+# Jason B. Hill (jason@jasonbhill.com)
+#
+# Microbenchmarks for the meters, word matching and the per-minute /
+# per-time-zone aggregation done by the analysis examples, run on the
+# synthetic tweets of corpus.py. Every scenario prints one line of JSON
+# (scenario, parameters, operations, best time over the repeats, operations
+# per second), so runs can be saved and compared.
+#
+# Usage: python benchmarks/micro.py [--quick] [--only NAME] [--output FILE]
+
+import os
+import sys
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+from timeit import default_timer
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+try: import numpy
+except ImportError:
+    numpy = None
+
+# run from a checkout without installing tweetwatch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tweetwatch.meters
+import tweetwatch.match
+import tweetwatch.columns
+from tweetwatch.message import Message
+from tweetwatch.snowflake import snowflake2time, time2minute, batchMinuteOfDay
+from benchmarks.corpus import Corpus
+
+
+BADWORDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+        'examples', 'superbowl2014', 'badwords')
+
+
+def timed(scenario, params, ops, function, repeat):
+    """
+    Run function repeat times and return a result dictionary for the fastest
+    run. function performs ops operations per call.
+    """
+    best = None
+    for i in range(repeat):
+        t = default_timer()
+        function()
+        t = default_timer() - t
+        if best is None or t < best:
+            best = t
+    return {
+        'scenario': scenario,
+        'params': params,
+        'ops': ops,
+        'seconds': round(best, 6),
+        'ops_per_sec': round(ops / best, 1),
+        'ns_per_op': round(best * 1e9 / ops, 1)
+    }
+
+
+###############################################################################
+# Scenarios; each yields result dictionaries                                  #
+###############################################################################
+def tpmScenarios(n, repeat):
+    # record n tweets arriving at a steady rate into meters of several sizes,
+    # starting from now so that none are too old for the meter
+    for rate in [10, 100, 1000]:
+        now = int(time.time())
+        timestamps = [now + i // rate for i in xrange(n)]
+        for maxLen in [60, 900, 3600]:
+            def run():
+                tpm = tweetwatch.meters.TPM(maxLen)
+                for t in timestamps:
+                    tpm.record(1, t)
+            yield timed('tpm_record', {'rate': rate, 'max_len': maxLen}, n, run, repeat)
+
+    # read the meter back while it is live
+    for maxLen in [60, 3600]:
+        tpm = tweetwatch.meters.TPM(maxLen)
+        for i in range(1000):
+            tpm.record(1)
+        def run():
+            for i in xrange(n):
+                tpm.get()
+        yield timed('tpm_get', {'max_len': maxLen}, n, run, repeat)
+
+
+def matchScenarios(n, repeat):
+    with open(BADWORDS) as f:
+        words = [line.strip() for line in f if line.strip()]
+    texts = [t['text'] for t in Corpus(words=words, word_rate=0.05).tweets(n)]
+    params = {'words': len(words)}
+
+    # the straightforward way: look for every word in every text
+    def naive():
+        for text in texts:
+            lowered = text.lower()
+            [w for w in words if w in lowered]
+    yield timed('match_naive', params, n, naive, repeat)
+
+    matcher = tweetwatch.match.Matcher(words)
+    def compiled():
+        for text in texts:
+            matcher.match(text)
+    yield timed('match_compiled', params, n, compiled, repeat)
+
+    tracker = tweetwatch.match.TrackMatcher('sochi, olympics, sochi2014')
+    def track():
+        for text in texts:
+            tracker.matchText(text)
+    yield timed('match_track_terms', {'terms': 3}, n, track, repeat)
+
+
+def aggregateScenarios(n, repeat):
+    lines = list(Corpus().lines(n))
+
+    # as the timezone-GMT examples did: decode everything
+    def decoded():
+        zones = {}
+        for line in lines:
+            tweet = json.loads(line)
+            zone = tweet['user']['time_zone']
+            minute = time2minute(snowflake2time(tweet['id']))
+            counts = zones.get(zone)
+            if counts is None:
+                counts = zones[zone] = [0] * 1440
+            counts[minute] += 1
+    yield timed('aggregate_json', {}, n, decoded, repeat)
+
+    # picking out only the fields needed
+    def lazy():
+        zones = {}
+        for line in lines:
+            tweet = Message(line)
+            zone = tweet.time_zone
+            minute = time2minute(snowflake2time(tweet.id))
+            counts = zones.get(zone)
+            if counts is None:
+                counts = zones[zone] = [0] * 1440
+            counts[minute] += 1
+    yield timed('aggregate_message', {}, n, lazy, repeat)
+
+    # whole columns at once
+    if numpy is not None:
+        directory = tempfile.mkdtemp(prefix='tweetwatch-bench-')
+        try:
+            w = tweetwatch.columns.ColumnWriter(directory, fields=('id', 'time_zone'))
+            for line in lines:
+                w.write(line)
+            w.close()
+            columns = tweetwatch.columns.ColumnReader(directory)
+            def columnar():
+                minutes = batchMinuteOfDay(columns.column('id'))
+                codes = numpy.array(columns.column('time_zone'))
+                codes[codes == tweetwatch.columns.NULL_INT32] = len(columns.dictionary('time_zone'))
+                numpy.bincount(codes * 1440 + minutes)
+            yield timed('aggregate_columns', {}, n, columnar, repeat)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+SCENARIOS = [
+    ('tpm', tpmScenarios),
+    ('match', matchScenarios),
+    ('aggregate', aggregateScenarios)
+]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='tweetwatch microbenchmarks')
+    parser.add_argument('--quick', action='store_true', help='small inputs, one repeat')
+    parser.add_argument('--only', help='run only the scenario group with this name')
+    parser.add_argument('--output', help='append results as JSON lines to this file')
+    options = parser.parse_args()
+
+    n, repeat = 100000, 3
+    if options.quick:
+        n, repeat = 5000, 1
+
+    environment = {
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'tweetwatch': tweetwatch.meters.__version__,
+        'numpy': numpy is not None
+    }
+
+    out = None
+    if options.output:
+        out = open(options.output, 'a')
+    for name, scenarios in SCENARIOS:
+        if options.only and options.only != name:
+            continue
+        for result in scenarios(n, repeat):
+            result.update(environment)
+            line = json.dumps(result, sort_keys=True)
+            print line
+            sys.stdout.flush()
+            if out:
+                out.write(line + '\n')
+    if out:
+        out.close()
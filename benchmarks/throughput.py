@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+# Jason B. Hill (jason@jasonbhill.com)
+#
+# End-to-end throughput benchmark: replays tweets from a local mock streaming
+# endpoint (tweetwatch.mockserver) through Stream -> dataFunction -> sink and
+# reports messages/sec, bytes/sec and latency as one line of JSON, so runs can
+# be compared from release to release.
+#
+# Usage: python benchmarks/throughput.py [options]
+#        python benchmarks/throughput.py --capture sochi2014-2-8-12-tweets \
+#            --messages 200000 --output results.jsonl
+#
+# Needs pycurl and oauth2, like tweetwatch.stream itself (the API token is a
+# dummy; the mock server doesn't check it).
+
+import os
+import sys
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+# run from a checkout without installing tweetwatch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tweetwatch.stream
+import tweetwatch.meters
+import tweetwatch.sinks
+import tweetwatch.mockserver
+from benchmarks.corpus import Corpus
+
+
+apiToken = {
+    'consumerKey': 'bench',
+    'consumerSecret': 'bench',
+    'accessToken': 'bench',
+    'accessTokenSecret': 'bench'}
+
+
+def run(options):
+    if options.capture:
+        capture = options.capture
+    else:
+        capture = list(Corpus().lines(20000))
+    server = tweetwatch.mockserver.MockServer(capture, loop=True, timestamps=True,
+            gzip=options.gzip)
+    server.start()
+
+    workdir = tempfile.mkdtemp(prefix='tweetwatch-bench-')
+    sink = None
+    if options.sink == 'file':
+        sink = tweetwatch.sinks.RotatingFile(os.path.join(workdir, 'tweets'), rotate=None)
+
+    # end-to-end latency (sent by the server -> handled) in ms, and the time
+    # spent in the sink per message in microseconds
+    latency = tweetwatch.meters.Histogram(tweetwatch.meters.geometricBounds(0.01, 100000))
+    callback = tweetwatch.meters.Histogram(tweetwatch.meters.geometricBounds(0.1, 1000000))
+    state = {'messages': 0, 'bytes': 0}
+
+    def dataFunction(message):
+        t0 = time.time()
+        if sink is not None:
+            sink.write(message)
+        t1 = time.time()
+        sent = server.sendTime(message)
+        if sent is not None:
+            latency.record((t1 - sent) * 1000)
+        callback.record((t1 - t0) * 1000000)
+        state['messages'] += 1
+        state['bytes'] += len(message)
+        if state['messages'] >= options.messages:
+            group.stop()
+
+    curl_encoding = 'identity'
+    if options.gzip:
+        curl_encoding = 'gzip'
+    group = tweetwatch.stream.StreamGroup(apiToken, 'sochi', dataFunction,
+            api_url=server.url, curl_encoding=curl_encoding, workers=options.workers)
+
+    start = time.time()
+    try:
+        group.start()
+    finally:
+        elapsed = time.time() - start
+        server.stop()
+        if sink is not None:
+            sink.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'benchmark': 'throughput',
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'tweetwatch': tweetwatch.stream.__version__,
+        'capture': options.capture or 'synthetic',
+        'gzip': options.gzip,
+        'workers': options.workers,
+        'sink': options.sink,
+        'messages': state['messages'],
+        'bytes': state['bytes'],
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(state['messages'] / elapsed, 1),
+        'bytes_per_sec': round(state['bytes'] / elapsed, 1),
+        'latency_ms_p50': latency.percentile(50),
+        'latency_ms_p99': latency.percentile(99),
+        'callback_us_p50': callback.percentile(50),
+        'callback_us_p99': callback.percentile(99)
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream -> dataFunction -> sink throughput')
+    parser.add_argument('--capture', help='JSON-lines capture file to replay (default: tweets from corpus.py)')
+    parser.add_argument('--messages', type=int, default=100000, help='messages to receive')
+    parser.add_argument('--no-gzip', dest='gzip', action='store_false', help='send uncompressed')
+    parser.add_argument('--workers', type=int, default=0, help='Stream worker threads')
+    parser.add_argument('--sink', choices=['file', 'none'], default='file', help='where messages go')
+    parser.add_argument('--output', help='append the result as a JSON line to this file')
+    options = parser.parse_args()
+
+    result = run(options)
+    line = json.dumps(result, sort_keys=True)
+    print line
+    if options.output:
+        with open(options.output, 'a') as f:
+            f.write(line + '\n')
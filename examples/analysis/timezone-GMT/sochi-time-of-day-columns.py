@@ -0,0 +1,45 @@
+#!/usr/bin/python
+
+# sochi-time-of-day-columns.py
+# Jason B. Hill (jason@jasonbhill.com)
+
+# The same timezone -vs- time-of-day counts as sochi-time-of-day.py, but from
+# a column extract of the hourly tweet files. The first run converts the files
+# (one pass over the JSON); every run after that reads only the id and
+# time_zone columns, which takes well under a second. Requires numpy.
+
+
+import os
+import numpy
+import tweetwatch.columns
+import tweetwatch.snowflake
+
+
+column_dir = 'sochi2014-columns'
+
+# convert the hourly files on the first run
+if not os.path.exists(column_dir):
+    filenames = []
+    for d in range(0,29,1): # february
+        for h in range(0,24): # hours in day
+            filenames.append('sochi2014-2-' + str(d) + '-' + str(h) + '-tweets')
+    print "converted %s tweets" % tweetwatch.columns.convertFiles(filenames, column_dir)
+
+columns = tweetwatch.columns.ColumnReader(column_dir)
+timezones = columns.dictionary('time_zone')
+
+# minute of the day (GMT) of every tweet, straight from the ID column
+minutes = tweetwatch.snowflake.batchMinuteOfDay(columns.column('id'))
+
+# null time zones get the code after the last real one
+codes = numpy.array(columns.column('time_zone'))
+codes[codes == tweetwatch.columns.NULL_INT32] = len(timezones)
+timezones.append(None)
+
+# count tweets by (timezone, minute) in one pass
+counts = numpy.bincount(codes * 1440 + minutes, minlength=len(timezones) * 1440)
+counts = counts.reshape(len(timezones), 1440)
+
+for code, key in enumerate(timezones):
+    if counts[code].sum():
+        print "%s: %s" % (key, list(counts[code]))
@@ -10,21 +10,12 @@
 
 
 import simplejson as json
-import time
+import os
+import tweetwatch.analysis
 import matplotlib
 
-# Function to turn snowflake into a timestamp
-def snowflake2time(s):
-    return (((s >> 22) + 1288834974657) / 1000)
-
-# Function to turn a timestamp into a minute in day
-def time2minute(t):
-    # get the hour in GMT
-    h = time.gmtime(t).tm_hour
-    # get the minute in GMT
-    m = time.gmtime(t).tm_min
-    # return minute of the day
-    return 60*h + m
+# snowflake ID -> minute of the GMT day, in integer arithmetic
+from tweetwatch.snowflake import snowflake2time, time2minute
 
 
 # A dictionary of timezones containing total tweet and tweet by minute data
@@ -35,42 +26,39 @@ def time2minute(t):
 timezone_data = {}
 
 
-# iterate over days and hours
+# add one tweet to the partial results of the chunk being worked on
+def countTweet(tweetjson, timezone_data):
+    # get timezone
+    timezone = tweetjson['user']['utc_offset']
+    minute = time2minute(snowflake2time(tweetjson['id']))
+
+    # add information to dictionary
+    if timezone in timezone_data:
+        timezone_data[timezone]['total'] += 1
+        timezone_data[timezone]['minutes'][minute] += 1
+    else:
+        # create dictionary for this timezone
+        timezone_data[timezone] = {}
+        # set initial counter for this timezone
+        timezone_data[timezone]['total'] = 1
+        # create a list of minute values
+        timezone_data[timezone]['minutes'] = [0 for i in range(1440)]
+        timezone_data[timezone]['minutes'][minute] += 1
+
+
+# hourly files for each day in february
+filenames = []
 for d in range(0,29,1): # february
     for h in range(0,24): # hours in day
-        filename = 'sochi2014-2-' + str(d) + '-' + str(h) + '-tweets'
-        try:
-
-            with open(filename) as f:
-                print "examining %s" % filename
-                for tweet in f:
-
-                    try:
-                        # load json
-                        tweetjson = json.loads(tweet)
-                        # get timezone
-                        timezone = tweetjson['user']['utc_offset']
-                        minute = time2minute(snowflake2time(tweetjson['id']))
-
-                        # add information to dictionary
-                        if timezone in timezone_data:
-                            timezone_data[timezone]['total'] += 1
-                            timezone_data[timezone]['minutes'][minute] += 1
-                        else:
-                            # create dictionary for this timezone
-                            timezone_data[timezone] = {}
-                            # set initial counter for this timezone
-                            timezone_data[timezone]['total'] = 1
-                            # create a list of minute values
-                            timezone_data[timezone]['minutes'] = [0 for i in range(1440)]
-                            timezone_data[timezone]['minutes'][minute] += 1
-
-                    except:
-                        pass
-
-        except:
-            pass
-
+        filenames.append('sochi2014-2-' + str(d) + '-' + str(h) + '-tweets')
+
+# split the files into chunks and count them on all cores; the partial
+# dictionaries are merged (totals and minute lists added) as chunks finish.
+# The checkpoint keeps the counts so far and how far each file was read, so
+# running this again only reads what has been captured since.
+print "examining %s files" % len([f for f in filenames if os.path.exists(f)])
+timezone_data = tweetwatch.analysis.runIncremental(filenames, countTweet,
+        'sochi-tweets-by-utc-offset.checkpoint')
 
 
 # print data to a CSV format to stdout
@@ -4,8 +4,9 @@
 
 import tweetwatch.stream
 import tweetwatch.meters
+import tweetwatch.sinks
+import tweetwatch.rollup
 import time
-import simplejson as json
 
 apiToken = {
     'consumerKey': 'your API key',
@@ -17,89 +18,51 @@ userAgent = 'hilljb / version 0.1.2'
 
 # create a tpm meter; record 180 seconds at a time
 tpm = tweetwatch.meters.TPM(180)
+# tweets delivered vs. held back by Twitter's rate limit
+limits = tweetwatch.meters.LimitTracker()
 # timer to display/record tpm info
 tpm_watch = time.time() 
 
+# hourly files (sochi-year-m-d-h-desc), kept open and written through a buffer
+# ----------------------------------------------------------------------------
+# tweets        (sochi-2014-2-7-20-tweets)
+# errors        (sochi-2014-2-7-20-errors)
+# rate limits   (sochi-2014-2-7-20-rate-limit)
+# other         (sochi-2014-2-7-20-other)
+sink = tweetwatch.sinks.Sink('sochi%(year)d-%(mon)d-%(mday)d-%(hour)d-')
+# tpm           (sochi-2014-2-7-20-tpm)
+tpm_file = tweetwatch.sinks.RotatingFile('sochi%(year)d-%(mon)d-%(mday)d-%(hour)d-tpm')
+
 # define our data function
 def dataFunction(data):
-    # get current gmtime for formatting of filenames
-    t = time.gmtime()
-
-    # form filenames (sochi-year-m-d-h-desc)
-    # --------------------------------------
-    # tweet_file    (sochi-2014-2-7-20-tweets)
-    # error_file    (sochi-2014-2-7-20-errors)
-    # tpm_file      (sochi-2014-2-7-20-tpm)
-    # rate_file     (sochi-2014-2-7-20-rate-limit)
-    date_string = 'sochi' + str(t.tm_year) + '-' + str(t.tm_mon)
-    date_string += '-' + str(t.tm_mday) + '-' + str(t.tm_hour) + '-'
-
-    # if data is non-empty, send to output
-    if len(data) > 5:
-
-        # --- case 0: data isn't json
-        json_data = {}
-        try:
-            json_data = json.loads(data)
-        except:
-            # the data wasn't parsable json
-            filename = date_string + 'errors'
-            f = open(filename, 'a')
-            s = '-------------------------------------------------------------\n'
-            s += str(int(time.time())) + '\n'
-            s += data
-            s += '\n'
-            s += '-------------------------------------------------------------\n'
-            f.write(s)
-            f.close()
-
-        # --- case 1: data is a tweet response
-        if 'text' in json_data:
-            filename = date_string + 'tweets'
-            f = open(filename, 'a')
-            f.write(data)
-            f.close()
-
-            # include this tweet in tpm counter
-            tpm.record(1)
-
-        # --- case 2: other errors
-        if 'tweetwatch_error' in json_data:
-            filename = date_string + 'errors'
-            f = open(filename, 'a')
-            s = '-------------------------------------------------------------\n'
-            s += str(int(time.time())) + '\n'
-            s += data
-            s += '\n'
-            s += '-------------------------------------------------------------\n'
-            f.write(s)
-            f.close()
-
-        # --- case 3: rate limit response
-        if 'limit' in json_data:
-            filename = date_string + 'rate-limit'
-            f = open(filename, 'a')
-            # form timestamp and rate limit string
-            s = str(int(time.time()))
-            s += ': '
-            s += str(json_data['limit']['track']) + '\n'
-            f.write(s)
-            f.close()
-
-            # include in tpm counter
-            tpm.record(json_data['limit']['track'])
-    # end if len(data) > 5
+    # route the message to the file for its type
+    sink.write(data)
+
+    # data is a tweetwatch.message.Message (see lazy_messages below), so its
+    # type is known without decoding it
+
+    # --- case 1: data is a tweet response
+    if data.kind == 'tweet':
+        # include this tweet in tpm counter
+        tpm.record(1)
+        limits.record(1)
+
+    # --- case 2: rate limit response
+    elif data.kind == 'limit':
+        # track is a running total for the connection; count only what's new
+        limits.recordLimit(data.track, S.connections)
 
     global tpm_watch
     if time.time() - tpm_watch > 30:
         # record/display tpm info roughly every 30 seconds
-        print "current tpm: %s" % tpm.get()
-        filename = date_string + 'tpm'
-        f = open(filename, 'a')
+        # tpm counts delivered tweets; the estimated true rate adds those
+        # held back by the rate limit
+        rates = limits.get(60)
+        print "current tpm: %s (estimated %d, %.1f%% missed)" % (tpm.get(),
+                rates['total'] * 60, rates['missed_fraction'] * 100)
         s = str(int(time.time()))
-        s += ': ' + str(tpm.get()) + '\n'
-        f.write(s)
-        f.close()
+        s += ': ' + str(tpm.get()) + ' ' + str(int(rates['total'] * 60)) + '\n'
+        tpm_file.write(s)
         # reset tpm timer
         tpm_watch = time.time()
 
@@ -117,7 +80,16 @@ searchTerms += ', олимпийские' # russian
 searchTerms += ', Олімпійські' # ukrainian
 
 
-S = tweetwatch.stream.Stream(apiToken, searchTerms, dataFunction, user_agent=userAgent)
+# per-minute/hour/day counts by term, language and time zone, for reports
+rollup = tweetwatch.rollup.RollupWriter('sochi-rollup', searchTerms)
+
+S = tweetwatch.stream.Stream(apiToken, searchTerms, dataFunction, user_agent=userAgent,
+        lazy_messages=True, observers=[rollup])
 
 S.configure()
-S.start()
+try:
+    S.start()
+finally:
+    rollup.close()
+    sink.close()
+    tpm_file.close()
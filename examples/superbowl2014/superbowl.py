@@ -12,6 +12,7 @@
 # Load tweetwatch
 import tweetwatch.stream
 import tweetwatch.meters
+import tweetwatch.sinks
 
 # set the API access token / enter your values to make it function
 apiToken = {
@@ -25,27 +26,22 @@ userAgent = 'tweetwatch / version 0.1.2'
 # create a tweets per minute meter; record 180 seconds at a time
 tpm = tweetwatch.meters.TPM(180)
 
+# keep the data file open and buffered rather than reopening it per message
+data_file = tweetwatch.sinks.RotatingFile('superbowl_data', rotate=None)
+
 # define our data function
 def dataFunction(data):
-    # open a file for recording the data
-    f = open('superbowl_data', 'a')
-
-    # write the data to the file when it has non-trivial length
+    # write the data to the file
     # Note: We expect a ton of data here, so rate limited tweets come in as:
     # {"limit":{"track": 9994873}}
     # This means that we've missed 9994873 tweets since the connection was
     # originally established.
-    if len(data) > 5:
-        f.write(data)
-        print data
-
-    # close the data file
-    f.close()
+    data_file.write(data)
+    print data
 
     # print current tpm meter info
-    if len(data) > 5:
-        tpm.record(1)
-        print "\nCurrent tpm: %s\n" % tpm.get()
+    tpm.record(1)
+    print "\nCurrent tpm: %s\n" % tpm.get()
 
 # define search terms
 searchTerms = 'broncos, seahawks'
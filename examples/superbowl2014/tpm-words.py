@@ -28,32 +28,19 @@ try:
 except ImportError:
     import json
 
+import tweetwatch.index
+import tweetwatch.match
 
 # function to turn snowflake into timestamp
-def snowflake2time(s):
-    return (((s >> 22) + 1288834974657) / 1000)
-
-
-# get the minimum and maximum timestamp from snowflakes in the given file
-min_time = 0
-max_time = 0
-with open(input_file) as f:
-    for line in f:
-        try:
-            parsed_line = json.loads(line)
-            if 'id' in parsed_line:
-                s = snowflake2time(parsed_line['id'])
-                # set min time
-                if min_time == 0 or s < min_time:
-                    min_time = s
-                # set max time
-                if s > max_time:
-                    max_time = s
-        except:
-            pass
-
+from tweetwatch.snowflake import snowflake2time
 
 
+# get the minimum and maximum timestamp from snowflakes in the given file; the
+# sidecar time index (input_file + '.idx') makes this instant after the first
+# run and only reads newly appended data after that
+index = tweetwatch.index.TimeIndex(input_file)
+min_time = index.minTime()
+max_time = index.maxTime()
 
 
 # make a list of words from word_file
@@ -62,6 +49,14 @@ with open(word_file) as f:
     for line in f:
         words.append(line.strip())
 
+# compile the words once for matching; the compiled form is cached next to the
+# word file and reused until the word file changes
+matcher = tweetwatch.match.compileFile(word_file, cache=word_file + '.matcher')
+
+# find which search terms a tweet matched the way Twitter does (whole words,
+# hashtags, links), rather than by searching its text for substrings
+tracker = tweetwatch.match.TrackMatcher(', '.join(search_terms))
+
 
 # open files and print file headers
 f_totals = open('tpm_totals', 'a')
@@ -131,26 +126,28 @@ with open(input_file) as f:
         j += 1
         if j % 1000 == 0: print j
         tweet = json.loads(line)
-        if 'id' in tweet:
+        if 'id' in tweet and 'text' in tweet:
             # get timestamp
             s = snowflake2time(tweet['id'])
             # get minute mark
             m = (s - min_time)/60
-            tls = set(tweet['text'].lower().split())
+            text = tweet['text'].lower()
+
+            # search terms matched by this tweet
+            terms = tracker.names(tracker.match(tweet))
 
-            for w in words:
-                if 'text' in tweet and w in tls:
-                    # add any words to total count for this minute
-                    tpm_totals[m] += 1
+            # every word (or phrase) of word_file in this tweet, in one pass
+            for w in matcher.match(text):
+                # add any words to total count for this minute
+                tpm_totals[m] += 1
 
-                    # add words to specific word counts
-                    tpm_by_word[m][w] += 1
+                # add words to specific word counts
+                tpm_by_word[m][w] += 1
 
-                    # add words to specific search word counts
-                    for term in search_terms:
-                        if term in tweet['text'].lower():
-                            tpm_by_term[m][w][term] += 1
-                            tpm_term_only[m][term] += 1
+                # add words to specific search word counts
+                for term in terms:
+                    tpm_by_term[m][w][term] += 1
+                    tpm_term_only[m][term] += 1
 
 # print results
 for i in range(0, 1+(max_time-min_time)/60, 1):
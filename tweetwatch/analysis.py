@@ -0,0 +1,386 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+import os
+import pickle
+import hashlib
+import multiprocessing
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+
+# the job being run: (mapper, initial, raw). Set before the process pool is
+# created so that forked workers inherit it and the functions never need to
+# be pickled; lambdas and closures work as mappers.
+_job = None
+
+
+
+###############################################################################
+# Splitting capture files                                                     #
+###############################################################################
+def splitFile(path, chunk_size=67108864, start=0, size=None):
+    """
+    Returns a list of (path, start, end) byte ranges covering the file at path
+    (or only bytes start to size of it), each about chunk_size bytes long and
+    ending just after a newline.
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + chunk_size
+            if end >= size:
+                end = size
+            else:
+                # move the boundary forward to the end of the line it falls in
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((path, start, min(end, size)))
+            start = end
+    return ranges
+
+
+def completeLines(path, size=None):
+    """
+    Returns the offset just after the last newline in the first size bytes
+    (default all) of the file at path: the end of the lines written so far,
+    leaving out a line still being written.
+    """
+    if size is None:
+        size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            i = f.read(end - start).rfind('\n')
+            if i >= 0:
+                return start + i + 1
+            end = start
+    return 0
+
+
+def iterLines(path, start, end):
+    """
+    Iterate over the lines of the file at path from byte start up to byte end.
+    start must be at the beginning of a line.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            line = f.readline()
+            if not line:
+                return
+            remaining -= len(line)
+            yield line
+
+
+
+###############################################################################
+# Merging partial results                                                     #
+###############################################################################
+def merge(a, b):
+    """
+    Merge partial result b into a and return the result. Numbers are added,
+    dicts are merged key by key, lists are added element by element (the
+    shorter one treated as padded with zeros), and sets are unioned. Anything
+    else must define a merge(other) method.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if isinstance(a, dict):
+        for k, v in b.iteritems():
+            if k in a:
+                a[k] = merge(a[k], v)
+            else:
+                a[k] = v
+        return a
+    if isinstance(a, list):
+        for i, v in enumerate(b):
+            if i < len(a):
+                a[i] = merge(a[i], v)
+            else:
+                a.append(v)
+        return a
+    if isinstance(a, set):
+        a |= b
+        return a
+    if isinstance(a, (int, long, float)):
+        return a + b
+    if hasattr(a, 'merge'):
+        a.merge(b)
+        return a
+    raise TypeError('tweetwatch.analysis.merge error: cannot merge %s' % type(a).__name__)
+
+
+
+###############################################################################
+# Map-reduce runner                                                           #
+###############################################################################
+def _mapRange(job):
+    """
+    Worker body: run the mapper over one byte range and return its partial
+    result, the number of lines read and the number skipped.
+    """
+    mapper, initial, raw, skip = _job
+    path, start, end = job
+    acc = initial()
+    lines = skipped = 0
+    for line in iterLines(path, start, end):
+        lines += 1
+        if raw:
+            tweet = line
+        else:
+            try:
+                tweet = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+        try:
+            mapper(tweet, acc)
+        except skip:
+            # limit notices, other non-tweets and the odd malformed line lack
+            # what a mapper expects
+            skipped += 1
+    return acc, lines, skipped
+
+
+def run(paths, mapper, initial=dict, combine=merge, processes=None, chunk_size=67108864,
+        raw=False, skip=Exception, counts=None):
+    """
+    Run mapper over every tweet in the capture files at paths, using a pool of
+    processes, and return the combined result.
+
+    REQUIRED INPUT:
+
+    paths (list) - Capture files: one JSON message per line. Files that don't
+        exist are skipped.
+
+    mapper (function) - Called as mapper(tweet, acc) for every line, where
+        tweet is the decoded JSON and acc is the partial result of the current
+        byte range, to be updated in place. An exception (see skip) is taken
+        to mean the line wasn't a tweet the mapper can use, and the line is
+        skipped.
+
+    OPTIONAL INPUT:
+
+    initial (function) - Returns an empty partial result. The default is dict.
+
+    combine (function) - combine(a, b) folds partial result b into a and
+        returns the result. The default, tweetwatch.analysis.merge, handles
+        nested dicts, lists and sets of counters.
+
+    processes (int) - Number of worker processes. The default value of None
+        means one per CPU; 1 runs everything in this process.
+
+    chunk_size (int) - Approximate size in bytes of the ranges the files are
+        split into. The default value is 67108864 (64 MB).
+
+    raw (bool) - When True, mapper receives the raw line instead of the decoded
+        JSON, for mappers that only need a field or two. The default value is
+        False.
+
+    skip (exception class or tuple) - Exceptions raised by mapper that skip
+        the line instead of stopping the run. The default, Exception, skips
+        any line the mapper fails on; pass e.g. (KeyError, TypeError) to let
+        other errors through while debugging a mapper.
+
+    counts (dict) - When given, 'lines' and 'skipped' (lines that weren't JSON
+        or that mapper raised a skip exception on) are added to it. The
+        default value is None.
+
+    ***EXAMPLE***
+
+    def byLanguage(tweet, acc):
+        lang = tweet['lang']
+        acc[lang] = acc.get(lang, 0) + 1
+
+    counts = tweetwatch.analysis.run(files, byLanguage)
+    """
+    jobs = []
+    for path in paths:
+        if os.path.exists(path):
+            jobs.extend(splitFile(path, chunk_size))
+
+    return _runJobs(jobs, mapper, initial, combine, processes, raw, skip, counts)
+
+
+def _runJobs(jobs, mapper, initial, combine, processes, raw, skip, counts):
+    """
+    Run mapper over byte ranges as run() does, and return the combined result.
+    """
+    global _job
+
+    _job = (mapper, initial, raw, skip)
+    result = initial()
+    lines = skipped = 0
+    try:
+        if processes == 1 or len(jobs) < 2:
+            for partial, n, s in (_mapRange(job) for job in jobs):
+                result = combine(result, partial)
+                lines += n
+                skipped += s
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                for partial, n, s in pool.imap_unordered(_mapRange, jobs):
+                    result = combine(result, partial)
+                    lines += n
+                    skipped += s
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        _job = None
+    if counts is not None:
+        counts['lines'] = counts.get('lines', 0) + lines
+        counts['skipped'] = counts.get('skipped', 0) + skipped
+    return result
+
+
+
+###############################################################################
+# Resumable runs                                                              #
+###############################################################################
+# bytes at the start of a file whose digest identifies it
+_HEAD = 4096
+
+
+def _fingerprint(path, st, offset):
+    """
+    Returns what identifies the file at path (with os.stat result st) as the
+    one the first offset bytes were read from: device, inode, and a digest of
+    its first bytes.
+    """
+    with open(path, 'rb') as f:
+        head = hashlib.md5(f.read(min(offset, _HEAD))).hexdigest()
+    return {'device': st.st_dev, 'inode': st.st_ino, 'head': head}
+
+
+def _loadCheckpoint(checkpoint, version):
+    """
+    Returns the state saved in a checkpoint file, or None if there is none
+    (or it was made for a different version of the analysis).
+    """
+    if not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != version:
+        return None
+    return state
+
+
+def _plan(paths, files, chunk_size):
+    """
+    Returns the byte ranges of paths not yet read, according to files (path
+    -> offset and fingerprint), and the new entries for files, or None if a
+    file read before has been replaced or truncated since.
+    """
+    jobs = []
+    entries = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        st = os.stat(path)
+        entry = files.get(path)
+        start = 0
+        if entry is not None:
+            start = entry['offset']
+            if st.st_size < start:
+                return None
+            if _fingerprint(path, st, start) != entry['fingerprint']:
+                return None
+        end = completeLines(path, st.st_size)
+        if end > start:
+            jobs.extend(splitFile(path, chunk_size, start, end))
+            entries[path] = {'offset': end, 'size': st.st_size,
+                             'fingerprint': _fingerprint(path, st, end)}
+    return jobs, entries
+
+
+def runIncremental(paths, mapper, checkpoint, initial=dict, combine=merge, processes=None,
+        chunk_size=67108864, raw=False, version=None, skip=Exception, counts=None):
+    """
+    Like run(), but picks up where the last run with the same checkpoint file
+    left off: only the bytes appended to the files since then are read, and
+    their partial result is merged into the saved one. A re-run over hourly
+    capture files, where only the current hour has grown, costs only the new
+    data.
+
+    The checkpoint file holds the combined result so far and, for every file,
+    the offset read up to (the end of its last complete line; a line still
+    being written is left for next time) and a fingerprint: its device and
+    inode and a digest of its first bytes. If a file that was read before has
+    been replaced or truncated, the saved result can't be trusted and every
+    file is read again from the start. Files that have since been deleted stay
+    counted.
+
+    REQUIRED INPUT:
+
+    paths, mapper - As for run().
+
+    checkpoint (string) - The checkpoint file; created if missing. It is
+        rewritten (atomically, by rename) at the end of every run.
+
+    OPTIONAL INPUT:
+
+    initial, combine, processes, chunk_size, raw, skip, counts - As for run().
+        The result must be picklable. counts only covers the bytes read in
+        this run.
+
+    version - Any picklable value naming the analysis (e.g. 2 after changing
+        the mapper); a checkpoint saved with a different version is ignored
+        and the run starts over. The default value is None.
+
+    ***EXAMPLE***
+
+    counts = tweetwatch.analysis.runIncremental(files, byLanguage,
+            'by-language.checkpoint')
+    """
+    state = _loadCheckpoint(checkpoint, version)
+    plan = None
+    if state is not None:
+        plan = _plan(paths, state['files'], chunk_size)
+    if plan is None:
+        state = {'version': version, 'files': {}, 'result': initial()}
+        plan = _plan(paths, state['files'], chunk_size)
+    jobs, entries = plan
+
+    if jobs:
+        partial = _runJobs(jobs, mapper, initial, combine, processes, raw, skip, counts)
+        state['result'] = combine(state['result'], partial)
+    state['files'].update(entries)
+
+    tmp = '%s.%d.tmp' % (checkpoint, os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, checkpoint)
+    return state['result']
@@ -0,0 +1,275 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+#   Segment layout
+#   --------------
+#   header      'TWARCH01'
+#   block       4 byte big-endian compressed length, then a zlib stream holding
+#               one or more messages, each ending in a newline
+#   ...
+#   index       one 32 byte entry per block: offset, compressed length,
+#               message count, smallest and largest snowflake ID in the block
+#   trailer     index offset, block count, 'TWARCEND'
+#
+#   A segment that was never closed has no index or trailer. ArchiveReader
+#   rebuilds the index of such a segment by walking its blocks.
+
+import os
+import struct
+import zlib
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from tweetwatch.message import snowflakeOf
+from tweetwatch.snowflake import time2snowflake
+
+
+_MAGIC = 'TWARCH01'
+_END = 'TWARCEND'
+_BLOCK = struct.Struct('>I')
+_ENTRY = struct.Struct('>QIIqq')
+_TRAILER = struct.Struct('>QI8s')
+
+
+
+###############################################################################
+# Archive writer                                                              #
+###############################################################################
+class ArchiveWriter:
+    def __init__(self, path, block_size=4194304, level=6):
+        """
+        Write messages to a new archive segment at path, compressing them in
+        independent blocks of about block_size bytes (uncompressed) each.
+        Call close() to write the index; without it the segment is still
+        readable, only slower to open.
+        """
+        if not isinstance(block_size, int) or block_size <= 0:
+            raise ValueError('tweetwatch.archive.ArchiveWriter error: block_size must be a positive integer')
+
+        self.path = path
+        self.block_size = block_size
+        self.level = level
+
+        self._file = open(path, 'wb')
+        self._file.write(_MAGIC)
+        self._offset = len(_MAGIC)
+
+        self._pending = []
+        self._pendingBytes = 0
+        self._first = None
+        self._last = None
+
+        # one (offset, length, count, first, last) tuple per block written
+        self.index = []
+
+    def write(self, message, snowflake=None):
+        """
+        Add a message (a string ending in a newline). snowflake is its tweet ID,
+        found in the message itself when not given.
+        """
+        if snowflake is None:
+            snowflake = snowflakeOf(message)
+        if snowflake is not None:
+            if self._first is None or snowflake < self._first:
+                self._first = snowflake
+            if self._last is None or snowflake > self._last:
+                self._last = snowflake
+
+        self._pending.append(message)
+        self._pendingBytes += len(message)
+        if self._pendingBytes >= self.block_size:
+            self._writeBlock()
+
+    def _writeBlock(self):
+        """
+        Compress the pending messages and append them as one block.
+        """
+        if not self._pending:
+            return
+        data = zlib.compress(''.join(self._pending), self.level)
+        self._file.write(_BLOCK.pack(len(data)))
+        self._file.write(data)
+
+        self.index.append((self._offset, len(data), len(self._pending),
+                self._first or 0, self._last or 0))
+        self._offset += _BLOCK.size + len(data)
+
+        self._pending = []
+        self._pendingBytes = 0
+        self._first = None
+        self._last = None
+
+    def close(self):
+        """
+        Write the last block, the index and the trailer, then close the file.
+        """
+        self._writeBlock()
+        for entry in self.index:
+            self._file.write(_ENTRY.pack(*entry))
+        self._file.write(_TRAILER.pack(self._offset, len(self.index), _END))
+        self._file.close()
+
+
+
+###############################################################################
+# Archive reader                                                              #
+###############################################################################
+class ArchiveReader:
+    def __init__(self, path, threads=None):
+        """
+        Open an archive segment. Blocks are decompressed by a pool of 'threads'
+        threads (zlib releases the interpreter lock while it works); the
+        default of None means one per CPU. Use threads=1 to decompress in the
+        calling thread.
+        """
+        self.path = path
+        self.threads = threads
+        self._file = open(path, 'rb')
+
+        if self._file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError('tweetwatch.archive.ArchiveReader error: %s is not an archive segment' % path)
+
+        self.index = self._readIndex()
+
+    def _readIndex(self):
+        """
+        Returns the block index from the trailer, or by scanning the blocks if
+        the segment was not closed.
+        """
+        size = os.fstat(self._file.fileno()).st_size
+        if size >= len(_MAGIC) + _TRAILER.size:
+            self._file.seek(size - _TRAILER.size)
+            offset, count, end = _TRAILER.unpack(self._file.read(_TRAILER.size))
+            if end == _END and offset + count * _ENTRY.size + _TRAILER.size == size:
+                self._file.seek(offset)
+                return [_ENTRY.unpack(self._file.read(_ENTRY.size)) for i in range(count)]
+
+        # no usable trailer: walk the blocks
+        index = []
+        offset = len(_MAGIC)
+        self._file.seek(offset)
+        while True:
+            head = self._file.read(_BLOCK.size)
+            if len(head) < _BLOCK.size:
+                break
+            length, = _BLOCK.unpack(head)
+            data = self._file.read(length)
+            if len(data) < length:
+                break
+            try:
+                messages = zlib.decompress(data).splitlines(True)
+            except zlib.error:
+                # a block cut short by a crash
+                break
+            ids = [i for i in (snowflakeOf(m) for m in messages) if i is not None]
+            index.append((offset, length, len(messages), min(ids or [0]), max(ids or [0])))
+            offset += _BLOCK.size + length
+        return index
+
+    def close(self):
+        """
+        Close the segment file.
+        """
+        self._file.close()
+
+    def count(self):
+        """
+        Returns the number of messages in the segment.
+        """
+        return sum(entry[2] for entry in self.index)
+
+    def readBlock(self, i):
+        """
+        Returns the messages of block i as a list of strings.
+        """
+        offset, length = self.index[i][0], self.index[i][1]
+        # independent reads so that threads don't share a file position
+        f = open(self.path, 'rb')
+        try:
+            f.seek(offset + _BLOCK.size)
+            data = f.read(length)
+        finally:
+            f.close()
+        return zlib.decompress(data).splitlines(True)
+
+    def _blocks(self, blocks):
+        """
+        Yields the message lists of the given blocks in order, decompressing
+        ahead in the thread pool. At most one block per thread is read ahead,
+        so memory stays bounded however large the segment is.
+        """
+        if self.threads == 1 or len(blocks) < 2:
+            for i in blocks:
+                yield self.readBlock(i)
+            return
+        pool = ThreadPool(self.threads)
+        ahead = self.threads or cpu_count()
+        try:
+            pending = deque()
+            for i in blocks:
+                pending.append(pool.apply_async(self.readBlock, (i,)))
+                if len(pending) > ahead:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
+    def __iter__(self):
+        """
+        Iterate over every message in the segment.
+        """
+        for messages in self._blocks(range(len(self.index))):
+            for m in messages:
+                yield m
+
+    def iterRange(self, firstId, lastId):
+        """
+        Iterate over the messages with snowflake IDs between firstId and lastId
+        inclusive. Only blocks whose ID range overlaps are decompressed.
+        """
+        blocks = [i for i, e in enumerate(self.index)
+                if e[2] and e[4] >= firstId and e[3] <= lastId and e[3] != 0]
+        for messages in self._blocks(blocks):
+            for m in messages:
+                s = snowflakeOf(m)
+                if s is not None and firstId <= s <= lastId:
+                    yield m
+
+    def iterTime(self, t0, t1):
+        """
+        Iterate over the tweets created between Unix timestamps t0 (inclusive)
+        and t1 (exclusive).
+        """
+        return self.iterRange(time2snowflake(t0), time2snowflake(t1) - 1)
+
+
+
+def archiveFile(src, dst, block_size=4194304, level=6):
+    """
+    Convert a JSON-lines capture file src into an archive segment dst.
+    """
+    w = ArchiveWriter(dst, block_size=block_size, level=level)
+    with open(src, 'rb') as f:
+        for line in f:
+            w.write(line)
+    w.close()
@@ -0,0 +1,97 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+#   Twitter's documented reconnect strategy for the streaming API
+#   -------------------------------------------------------------
+#   network errors  back off linearly: 250 ms more per attempt, up to 16 s
+#   HTTP errors     back off exponentially: 5 s, doubling, up to 320 s
+#   HTTP 420        back off exponentially: 1 minute, doubling
+#
+#   The delay starts over once a connection has delivered data.
+
+
+# kind -> (first delay, curve, growth, maximum delay); delays are in seconds,
+# curve is 'linear' or 'exponential', and growth is added to the delay for
+# 'linear' curves and multiplies it for 'exponential' ones
+CURVES = {
+    'network': (0.25, 'linear', 0.25, 16.0),
+    'http': (5.0, 'exponential', 2, 320.0),
+    'rate_limit': (60.0, 'exponential', 2, 960.0)
+}
+
+
+
+###############################################################################
+# Backoff class                                                               #
+###############################################################################
+class Backoff:
+    def __init__(self, curves=None):
+        """
+        Works out how long to wait before each reconnect attempt. Call next()
+        with the kind of failure ('network', 'http' or 'rate_limit') for the
+        delay before the next attempt, and reset() once a connection is
+        delivering data.
+
+        OPTIONAL INPUT:
+
+        curves (dictionary) - Replaces entries of CURVES, e.g. to shorten the
+            delays in tests: {'http': (0.1, 'exponential', 2, 1.0)}. The
+            default value is None.
+
+        ***EXAMPLE***
+
+        b = Backoff()
+        b.next('http'), b.next('http'), b.next('http')
+            --> (5.0, 10.0, 20.0)
+        """
+        self.curves = dict(CURVES)
+        if curves:
+            self.curves.update(curves)
+        self.reset()
+
+    def reset(self):
+        """
+        Start over: the connection is healthy again.
+        """
+        self.kind = None
+        self.attempts = 0
+        self.delay = 0
+
+    def next(self, kind):
+        """
+        Returns the number of seconds to wait before reconnecting after a
+        failure of the given kind. A failure of a different kind than the last
+        one starts that kind's curve from the beginning.
+        """
+        if not kind in self.curves:
+            raise ValueError('tweetwatch.backoff.Backoff error: unknown kind %r' % kind)
+        first, curve, growth, maximum = self.curves[kind]
+        if kind != self.kind:
+            self.kind = kind
+            self.attempts = 0
+
+        if curve == 'linear':
+            delay = first + growth * self.attempts
+        else:
+            delay = first * growth ** self.attempts
+        self.attempts += 1
+        self.delay = min(delay, maximum)
+        return self.delay
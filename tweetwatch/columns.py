@@ -0,0 +1,285 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+#   Column directory layout
+#   -----------------------
+#   meta            JSON: row count and the fields stored
+#   id              int64 tweet IDs
+#   time            int64 creation times, milliseconds since the Unix epoch
+#   utc_offset      int32 author UTC offsets in seconds; NULL_INT32 for null
+#   time_zone       int32 codes into time_zone.dict; NULL_INT32 for null
+#   time_zone.dict  JSON list of the distinct time zone names
+#   lang            int32 codes into lang.dict; NULL_INT32 for null
+#   lang.dict       JSON list of the distinct language codes
+#
+#   Integers are stored in native byte order, one fixed-width value per tweet,
+#   so that row i of every column describes the same tweet.
+
+import os
+from array import array
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+# numpy is optional; without it columns are read into array.array objects
+try: import numpy
+except ImportError:
+    numpy = None
+
+from tweetwatch.message import Message
+from tweetwatch.snowflake import snowflake2ms
+
+
+# stands in for null in int32 columns
+NULL_INT32 = -2147483648
+
+
+def _typecode(size):
+    """
+    Returns an array.array typecode for signed integers of size bytes.
+    """
+    for c in ['i', 'l']:
+        if array(c).itemsize == size:
+            return c
+    raise ValueError('tweetwatch.columns error: no %d byte integer type in array' % size)
+
+
+# array.array typecodes of the right widths (there is no 'q' in Python 2)
+_INT64 = _typecode(8)
+_INT32 = _typecode(4)
+
+# field name -> (array typecode, numpy dtype, dictionary encoded)
+FIELDS = {
+    'id': (_INT64, '=i8', False),
+    'time': (_INT64, '=i8', False),
+    'utc_offset': (_INT32, '=i4', False),
+    'time_zone': (_INT32, '=i4', True),
+    'lang': (_INT32, '=i4', True)
+}
+
+
+
+###############################################################################
+# Column writer                                                               #
+###############################################################################
+class ColumnWriter:
+    def __init__(self, directory, fields=('id', 'time', 'utc_offset', 'time_zone', 'lang'),
+            buffer_rows=65536):
+        """
+        Write the chosen fields of tweets to typed column files in directory,
+        creating it if needed. Writing to an existing column directory appends
+        to it (the fields must match). Call close() when done.
+        """
+        for f in fields:
+            if not f in FIELDS:
+                raise ValueError('tweetwatch.columns.ColumnWriter error: unknown field %r' % f)
+
+        self.directory = directory
+        self.fields = list(fields)
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+
+        # value -> code, per dictionary encoded field
+        self._codes = {}
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        meta = os.path.join(directory, 'meta')
+        if os.path.exists(meta):
+            with open(meta) as f:
+                m = json.load(f)
+            if m['fields'] != self.fields:
+                raise ValueError('tweetwatch.columns.ColumnWriter error: %s holds different fields' % directory)
+            self.rows = m['rows']
+
+        # flush() appends to the columns before it rewrites meta, so after a
+        # crash a column can hold rows meta doesn't count; drop them
+        for f in self.fields:
+            path = os.path.join(directory, f)
+            if not os.path.exists(path):
+                continue
+            size = self.rows * array(FIELDS[f][0]).itemsize
+            actual = os.path.getsize(path)
+            if actual < size:
+                raise ValueError('tweetwatch.columns.ColumnWriter error: %s is missing rows' % path)
+            if actual > size:
+                with open(path, 'r+b') as c:
+                    c.truncate(size)
+
+        for f in self.fields:
+            if FIELDS[f][2]:
+                values = []
+                path = os.path.join(directory, f + '.dict')
+                if os.path.exists(path):
+                    with open(path) as d:
+                        values = json.load(d)
+                self._codes[f] = dict((v, i) for i, v in enumerate(values))
+
+        self._buffers = dict((f, array(FIELDS[f][0])) for f in self.fields)
+        self._buffered = 0
+
+    def write(self, message):
+        """
+        Add one tweet. message is a raw JSON string (or a
+        tweetwatch.message.Message); non-tweets and tweets without an ID are
+        ignored. Fields are pulled out without decoding the whole message.
+        """
+        if not isinstance(message, Message):
+            message = Message(message)
+        if message.kind != 'tweet' or message.id is None:
+            return
+
+        b = self._buffers
+        for f in self.fields:
+            if f == 'id':
+                b[f].append(message.id)
+            elif f == 'time':
+                b[f].append(snowflake2ms(message.id))
+            elif f == 'utc_offset':
+                v = message.utc_offset
+                if v is None:
+                    v = NULL_INT32
+                b[f].append(v)
+            else:
+                b[f].append(self._code(f, getattr(message, f)))
+
+        self._buffered += 1
+        if self._buffered >= self.buffer_rows:
+            self.flush()
+
+    def _code(self, field, value):
+        """
+        Returns the dictionary code of value in field, adding it if new.
+        """
+        if value is None:
+            return NULL_INT32
+        codes = self._codes[field]
+        code = codes.get(value)
+        if code is None:
+            code = len(codes)
+            codes[value] = code
+        return code
+
+    def flush(self):
+        """
+        Append buffered rows to the column files and update the metadata.
+        """
+        for f in self.fields:
+            with open(os.path.join(self.directory, f), 'ab') as out:
+                self._buffers[f].tofile(out)
+            self._buffers[f] = array(FIELDS[f][0])
+        self.rows += self._buffered
+        self._buffered = 0
+
+        for f, codes in self._codes.iteritems():
+            values = [None] * len(codes)
+            for v, i in codes.iteritems():
+                values[i] = v
+            self._replace(f + '.dict', values)
+        self._replace('meta', {'rows': self.rows, 'fields': self.fields})
+
+    def _replace(self, name, obj):
+        """
+        Atomically replace a JSON file in the column directory.
+        """
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(obj, f)
+        os.rename(path + '.tmp', path)
+
+    def close(self):
+        """
+        Flush everything to disk.
+        """
+        self.flush()
+
+
+
+def convertFiles(paths, directory, **options):
+    """
+    Extract the tweets of the JSON-lines capture files at paths into the column
+    directory. Missing files are skipped. Returns the ColumnWriter's row count.
+    """
+    w = ColumnWriter(directory, **options)
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for line in f:
+                w.write(line)
+    w.close()
+    return w.rows
+
+
+
+###############################################################################
+# Column reader                                                               #
+###############################################################################
+class ColumnReader:
+    def __init__(self, directory):
+        """
+        Open a column directory written by ColumnWriter.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, 'meta')) as f:
+            m = json.load(f)
+        self.rows = m['rows']
+        self.fields = m['fields']
+
+    def column(self, field):
+        """
+        Returns the values of a field. With numpy installed this is a read-only
+        numpy.memmap, so nothing is read until it is used; otherwise it is an
+        array.array read into memory. Dictionary encoded fields are returned as
+        their codes; see dictionary().
+        """
+        if not field in self.fields:
+            raise KeyError('tweetwatch.columns.ColumnReader error: no column %r' % field)
+        typecode, dtype, encoded = FIELDS[field]
+        path = os.path.join(self.directory, field)
+
+        if numpy is not None:
+            if self.rows == 0:
+                return numpy.zeros(0, dtype=dtype)
+            return numpy.memmap(path, dtype=dtype, mode='r', shape=(self.rows,))
+
+        a = array(typecode)
+        with open(path, 'rb') as f:
+            a.fromfile(f, self.rows)
+        return a
+
+    def dictionary(self, field):
+        """
+        Returns the list of distinct values of a dictionary encoded field;
+        code i stands for dictionary(field)[i].
+        """
+        with open(os.path.join(self.directory, field + '.dict')) as f:
+            return json.load(f)
+
+    def decode(self, field, code):
+        """
+        Returns the value for one code of a dictionary encoded field.
+        """
+        if code == NULL_INT32:
+            return None
+        return self.dictionary(field)[code]
@@ -0,0 +1,209 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+import math
+import time
+
+from tweetwatch.snowflake import snowflake2time
+
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+
+
+def _mix(s):
+    """
+    Returns a well-mixed 64 bit hash of integer s (MurmurHash3's finalizer).
+    Snowflake IDs differ mostly in their high and lowest bits, so they are
+    scrambled before being used as bit positions.
+    """
+    s &= _MASK64
+    s = ((s ^ (s >> 33)) * 0xff51afd7ed558ccd) & _MASK64
+    s = ((s ^ (s >> 33)) * 0xc4ceb9fe1a85ec53) & _MASK64
+    return s ^ (s >> 33)
+
+
+
+###############################################################################
+# Rotating Bloom filter                                                       #
+# --------------------------------------------------------------------------- #
+# One Bloom filter per span of tweet creation time; the oldest is dropped as  #
+# newer tweets arrive                                                         #
+###############################################################################
+class Dedup:
+    def __init__(self, window=600, generations=4, memory=16777216, capacity=2000000):
+        """
+        Remembers the snowflake IDs of recent tweets in a fixed amount of
+        memory to spot the ones delivered twice (after a reconnect, or by two
+        overlapping connections).
+
+        IDs are kept in a ring of Bloom filters, each covering window /
+        generations seconds of tweet creation time as read from the ID itself.
+        An ID is only ever checked against the one filter for its time span,
+        so a check costs a few bit tests no matter how many tweets are
+        remembered, and old filters are dropped as time moves on. One filter
+        more than generations is kept, so that a full window is remembered
+        while the newest span is still filling. IDs dated in the future (by
+        more than one span past the local clock) go to the filter of the
+        newest span allowed, so a bad ID can't push every filter out at once.
+        A Bloom filter never misses a duplicate but may, rarely, call a new ID
+        a duplicate; see falsePositiveRate().
+
+        OPTIONAL INPUT:
+
+        window (int) - Seconds of tweet creation time to remember, relative to
+            the newest tweet seen: from window up to window + window /
+            generations seconds back, depending on how far into its span the
+            newest tweet is. Older tweets are always let through. The default
+            value is 600 (10 minutes).
+
+        generations (int) - Number of filters the window is split into. More
+            generations expire old IDs more smoothly. The default value is 4.
+
+        memory (int) - Total bytes for all generations + 1 filters. The
+            default value is 16777216 (16 MB).
+
+        capacity (int) - Expected number of tweets per window, used to pick
+            the number of hash functions. The default value is 2000000.
+
+        ***EXAMPLE***
+
+        dedup = Dedup(window=300, memory=8*1024*1024)
+        if not dedup.seen(tweetID):
+            archive.write(tweet)
+        """
+        for name, value in [('window', window), ('generations', generations),
+                ('memory', memory), ('capacity', capacity)]:
+            if not isinstance(value, (int, long)) or value <= 0:
+                raise ValueError('tweetwatch.dedup.Dedup error: %s must be a positive integer' % name)
+
+        self.window = window
+        self.generations = generations
+        self.span = max(1, window // generations)
+
+        # bits per filter, and hash functions at the optimum for capacity (but
+        # no more than 16; past that the false positive rate is already tiny
+        # and every extra hash slows down each check)
+        self.bits = max(64, (memory // (generations + 1)) * 8)
+        perFilter = max(1, capacity // generations)
+        self.hashes = min(16, max(1, int(round(float(self.bits) / perFilter * math.log(2)))))
+
+        # span number -> [bytearray of bits, bits set]; the newest span seen
+        self._filters = {}
+        self._newest = None
+
+        # IDs checked, duplicates found, IDs too old to check
+        self.checked = 0
+        self.duplicates = 0
+        self.expired = 0
+
+    def _span(self, snowflake):
+        """
+        Returns the span number an ID is filed under: that of its creation
+        time, but no later than the span after the local clock's.
+        """
+        return min(snowflake2time(snowflake), int(time.time()) + self.span) // self.span
+
+    def _filter(self, span):
+        """
+        Returns the filter for a span of time, making room for it if it is the
+        newest yet, or None if the span has already been dropped.
+        """
+        if self._newest is None or span > self._newest:
+            self._newest = span
+            for old in [k for k in self._filters if k < span - self.generations]:
+                del self._filters[old]
+        elif span < self._newest - self.generations:
+            return None
+        f = self._filters.get(span)
+        if f is None:
+            f = self._filters[span] = [bytearray(self.bits // 8), 0]
+        return f
+
+    def seen(self, snowflake):
+        """
+        Returns True if snowflake has been seen before (or, with probability
+        falsePositiveRate(), if it collides with IDs that have). Otherwise
+        remembers it and returns False.
+        """
+        self.checked += 1
+        f = self._filter(self._span(snowflake))
+        if f is None:
+            self.expired += 1
+            return False
+
+        bits, size = f[0], self.bits
+        h = _mix(snowflake)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        new = 0
+        for i in xrange(self.hashes):
+            p = (h1 + i * h2) % size
+            mask = 1 << (p & 7)
+            if not bits[p >> 3] & mask:
+                bits[p >> 3] |= mask
+                new += 1
+        if new:
+            f[1] += new
+            return False
+        self.duplicates += 1
+        return True
+
+    __call__ = seen
+
+    def __contains__(self, snowflake):
+        """
+        Check for snowflake without remembering it.
+        """
+        if self._newest is None:
+            return False
+        f = self._filters.get(self._span(snowflake))
+        if f is None:
+            return False
+        h = _mix(snowflake)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        for i in xrange(self.hashes):
+            p = (h1 + i * h2) % self.bits
+            if not f[0][p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def falsePositiveRate(self):
+        """
+        Returns the current chance that a new ID is wrongly reported as seen,
+        for the fullest filter: (fraction of its bits set) ** hashes.
+        """
+        if not self._filters:
+            return 0.0
+        fill = max(f[1] for f in self._filters.values()) / float(self.bits)
+        return fill ** self.hashes
+
+    def stats(self):
+        """
+        Returns a dictionary of counters: checked, duplicates, expired, the
+        number of live filters, and the false positive rate.
+        """
+        return {
+            'checked': self.checked,
+            'duplicates': self.duplicates,
+            'expired': self.expired,
+            'filters': len(self._filters),
+            'false_positive_rate': self.falsePositiveRate()
+        }
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+import time
+
+
+
+###############################################################################
+# Framer class                                                                #
+# --------------------------------------------------------------------------- #
+# Turns the arbitrary chunks handed to pycurl's WRITEFUNCTION into complete   #
+# streaming API messages                                                      #
+###############################################################################
+class Framer:
+    def __init__(self, dataFunction, delimited=None, keepalives=False):
+        """
+        Collect raw chunks from the network and call dataFunction exactly once
+        for every complete message.
+
+        Twitter's streaming API separates messages with '\\r\\n'. libcurl,
+        however, hands us whatever arrived on the socket: half a tweet, or a
+        dozen tweets at once. The framer keeps a single reusable bytearray for
+        partial messages. When a chunk holds complete messages and nothing is
+        pending, the message is sliced directly from the chunk (or the chunk is
+        passed on as-is when it is exactly one message), so data is never
+        concatenated more than once.
+
+        Each message is passed to dataFunction as a string that still ends in
+        '\\r\\n', so writing it straight to a file produces JSON-lines output.
+
+        REQUIRED INPUT:
+
+        dataFunction (function) - Called with each complete message.
+
+        OPTIONAL INPUT:
+
+        delimited (string) - Either None (messages separated by '\\r\\n') or
+            'length', matching the 'delimited=length' option of the streaming
+            API where each message is preceded by its size in bytes on a line
+            of its own. The default value is None.
+
+        keepalives (bool) - When True, the blank keep-alive lines Twitter sends
+            roughly every 30 seconds are passed on to dataFunction as '\\r\\n'.
+            They are dropped by default. Either way, the time of the last
+            keep-alive is kept in self.lastKeepalive.
+        """
+        if dataFunction is None or not hasattr(dataFunction, '__call__'):
+            raise ValueError('tweetwatch.framing.Framer error: dataFunction must be a Python function')
+        if not delimited in [None, 'length']:
+            raise ValueError("tweetwatch.framing.Framer error: delimited must be None or 'length'")
+
+        self.dataFunction = dataFunction
+        self.delimited = delimited
+        self.keepalives = keepalives
+
+        # time of the most recent keep-alive newline
+        self.lastKeepalive = None
+
+        # bytes received, over every connection
+        self.bytes = 0
+
+        # holds the unfinished tail of the previous chunk(s)
+        self._buffer = bytearray()
+
+        # length-delimited mode: size of the message being read, or None while
+        # reading the length prefix
+        self._need = None
+
+    def reset(self):
+        """
+        Discard any partial message. Call whenever a new connection is made.
+        """
+        del self._buffer[:]
+        self._need = None
+
+    def pending(self):
+        """
+        Returns the number of bytes held back waiting for the end of a message.
+        """
+        return len(self._buffer)
+
+    def write(self, chunk):
+        """
+        Accept a chunk from pycurl's WRITEFUNCTION. Complete messages are sent
+        to dataFunction before returning.
+        """
+        self.bytes += len(chunk)
+        if self.delimited == 'length':
+            self._writeLength(chunk)
+        else:
+            self._writeLines(chunk)
+
+    def _emit(self, message):
+        """
+        Send a message on to dataFunction, noting and filtering keep-alives.
+        """
+        if len(message) <= 2 and not message.strip():
+            self.lastKeepalive = time.time()
+            if not self.keepalives:
+                return
+        self.dataFunction(message)
+
+    def _writeLines(self, chunk):
+        """
+        Split a chunk on '\\r\\n' boundaries.
+        """
+        buf = self._buffer
+        n = len(chunk)
+        pos = 0
+
+        # finish off the message left over from the previous chunk
+        if buf:
+            if buf[-1] == 13 and chunk[:1] == '\n':
+                # the delimiter itself was split across chunks
+                buf.append(10)
+                pos = 1
+            else:
+                i = chunk.find('\r\n')
+                if i < 0:
+                    buf.extend(buffer(chunk))
+                    return
+                buf.extend(buffer(chunk, 0, i + 2))
+                pos = i + 2
+            message = str(buf)
+            del buf[:]
+            self._emit(message)
+
+        # whole messages within this chunk
+        while pos < n:
+            i = chunk.find('\r\n', pos)
+            if i < 0:
+                buf.extend(buffer(chunk, pos))
+                return
+            if pos == 0 and i + 2 == n:
+                # the chunk is exactly one message; pass it through untouched
+                self._emit(chunk)
+            else:
+                self._emit(chunk[pos:i + 2])
+            pos = i + 2
+
+    def _writeLength(self, chunk):
+        """
+        Split a chunk according to 'delimited=length' size prefixes.
+        """
+        buf = self._buffer
+        n = len(chunk)
+        pos = 0
+
+        while pos < n:
+            if self._need is None:
+                # reading the length prefix (or a keep-alive newline)
+                i = chunk.find('\n', pos)
+                if i < 0:
+                    buf.extend(buffer(chunk, pos))
+                    return
+                if buf:
+                    buf.extend(buffer(chunk, pos, i - pos))
+                    line = str(buf).strip()
+                    del buf[:]
+                else:
+                    line = chunk[pos:i].strip()
+                pos = i + 1
+                if not line:
+                    self._emit('\r\n')
+                    continue
+                try:
+                    self._need = int(line)
+                except ValueError:
+                    raise ValueError('tweetwatch.framing.Framer error: bad length prefix %r' % line[:32])
+            else:
+                # reading the message body
+                remaining = self._need - len(buf)
+                if not buf and n - pos >= remaining:
+                    if pos == 0 and remaining == n:
+                        self._emit(chunk)
+                    else:
+                        self._emit(chunk[pos:pos + remaining])
+                    pos += remaining
+                    self._need = None
+                elif n - pos >= remaining:
+                    buf.extend(buffer(chunk, pos, remaining))
+                    pos += remaining
+                    message = str(buf)
+                    del buf[:]
+                    self._need = None
+                    self._emit(message)
+                else:
+                    buf.extend(buffer(chunk, pos))
+                    return
@@ -0,0 +1,182 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+import os
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+from tweetwatch.message import snowflakeOf
+from tweetwatch.snowflake import snowflake2minute, snowflake2ms, snowflake2time
+
+
+
+###############################################################################
+# Sparse time index                                                           #
+# --------------------------------------------------------------------------- #
+# A sidecar file mapping each minute of snowflake time to the byte range of   #
+# a JSON-lines capture file that holds that minute's tweets                   #
+###############################################################################
+class TimeIndex:
+    def __init__(self, path, sidecar=None):
+        """
+        Open (and bring up to date) the time index of the capture file at path.
+        The index is kept in sidecar, by default path + '.idx'. Only the part
+        of the capture appended since the last update is read.
+
+        For every minute, the index holds the offset of the first line with a
+        tweet from that minute and the end offset of the last one, so that
+        tweets arriving slightly out of order are never missed.
+        """
+        self.path = path
+        if sidecar:
+            self.sidecar = sidecar
+        else:
+            self.sidecar = path + '.idx'
+
+        self._load()
+        self.update()
+
+    def _clear(self):
+        """
+        Reset the index to cover nothing.
+        """
+        self.inode = None
+        self.indexed = 0
+        self.min = None
+        self.max = None
+        self.minutes = {}
+
+    def _load(self):
+        """
+        Read the sidecar file, if there is one.
+        """
+        self._clear()
+        try:
+            with open(self.sidecar) as f:
+                d = json.load(f)
+        except (IOError, ValueError):
+            return
+        self.inode = d['inode']
+        self.indexed = d['indexed']
+        self.min = d['min']
+        self.max = d['max']
+        self.minutes = dict((int(m), r) for m, r in d['minutes'].items())
+
+    def _save(self):
+        """
+        Write the sidecar file, replacing the old one atomically.
+        """
+        tmp = self.sidecar + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'inode': self.inode, 'indexed': self.indexed, 'min': self.min,
+                'max': self.max, 'minutes': self.minutes}, f)
+        os.rename(tmp, self.sidecar)
+
+    def update(self):
+        """
+        Index lines appended to the capture since the last update. The index is
+        rebuilt from scratch if the file was replaced or truncated. A partial
+        last line is left for the next update.
+        """
+        st = os.stat(self.path)
+        if st.st_ino != self.inode or st.st_size < self.indexed:
+            self._clear()
+            self.inode = st.st_ino
+        if st.st_size == self.indexed:
+            return
+
+        minutes = self.minutes
+        offset = self.indexed
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    break
+                end = offset + len(line)
+                s = snowflakeOf(line)
+                if s is not None:
+                    if self.min is None or s < self.min:
+                        self.min = s
+                    if self.max is None or s > self.max:
+                        self.max = s
+                    minute = snowflake2minute(s)
+                    r = minutes.get(minute)
+                    if r is None:
+                        minutes[minute] = [offset, end]
+                    else:
+                        r[1] = end
+                offset = end
+
+        self.indexed = offset
+        self._save()
+
+    def minTime(self):
+        """
+        Returns the Unix timestamp of the earliest tweet, or None.
+        """
+        if self.min is None:
+            return None
+        return snowflake2time(self.min)
+
+    def maxTime(self):
+        """
+        Returns the Unix timestamp of the latest tweet, or None.
+        """
+        if self.max is None:
+            return None
+        return snowflake2time(self.max)
+
+    def offsets(self, t0, t1):
+        """
+        Returns the (start, end) byte range holding every tweet created between
+        Unix timestamps t0 and t1, or None if there are none.
+        """
+        ranges = [r for m, r in self.minutes.iteritems() if t0 // 60 <= m <= t1 // 60]
+        if not ranges:
+            return None
+        return min(r[0] for r in ranges), max(r[1] for r in ranges)
+
+    def iter_range(self, t0, t1):
+        """
+        Iterate over the lines of tweets created between Unix timestamps t0
+        (inclusive) and t1 (exclusive), seeking straight to the indexed range.
+        """
+        r = self.offsets(t0, t1)
+        if r is None:
+            return
+        lo = t0 * 1000
+        hi = t1 * 1000
+        with open(self.path, 'rb') as f:
+            f.seek(r[0])
+            remaining = r[1] - r[0]
+            while remaining > 0:
+                line = f.readline()
+                if not line:
+                    break
+                remaining -= len(line)
+                s = snowflakeOf(line)
+                if s is not None:
+                    ms = snowflake2ms(s)
+                    if lo <= ms < hi:
+                        yield line
@@ -0,0 +1,360 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+import hashlib
+import os
+import re
+
+try: import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+
+###############################################################################
+# Compiled word list matcher                                                  #
+# --------------------------------------------------------------------------- #
+# Single words are looked up in a dict; phrases are found with an             #
+# Aho-Corasick automaton whose alphabet is words rather than characters       #
+###############################################################################
+class Matcher:
+    def __init__(self, words):
+        """
+        Compile a list of words and phrases for matching against tweet text.
+
+        Text is matched the way the examples always have: lower cased and split
+        on whitespace. A single word matches when it is one of the resulting
+        tokens; a phrase ('go hawks') matches when its words appear as
+        consecutive tokens. Because single words are hashed and phrases are
+        walked token by token, the cost per tweet depends on the length of the
+        tweet, not on the size of the word list.
+
+        words (list) - Words and phrases, as byte strings (UTF-8) or unicode.
+        """
+        # lower cased word -> the entry as given
+        self._words = {}
+
+        # the phrase automaton: one dict of token -> state per state, the
+        # failure link of each state and the phrases that end there
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for w in words:
+            key = w
+            if isinstance(key, str):
+                key = key.decode('utf-8')
+            tokens = key.lower().split()
+            if len(tokens) == 1:
+                self._words.setdefault(tokens[0], w)
+            elif tokens:
+                self._addPhrase(tokens, w)
+
+        self._link()
+
+    def __len__(self):
+        """
+        Returns the number of distinct words and phrases.
+        """
+        return len(self._words) + sum(len(o) for o in self._out if o)
+
+    def _addPhrase(self, tokens, entry):
+        """
+        Add the path for one phrase to the automaton.
+        """
+        state = 0
+        for t in tokens:
+            nxt = self._goto[state].get(t)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][t] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        if not entry in self._out[state]:
+            self._out[state].append(entry)
+
+    def _link(self):
+        """
+        Compute failure links breadth-first and merge the outputs of each state
+        with those of its failure state.
+        """
+        queue = list(self._goto[0].values())
+        i = 0
+        while i < len(queue):
+            state = queue[i]
+            i += 1
+            for t, nxt in self._goto[state].iteritems():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and not t in self._goto[f]:
+                    f = self._fail[f]
+                f = self._goto[f].get(t, 0)
+                self._fail[nxt] = f
+                for entry in self._out[f]:
+                    if not entry in self._out[nxt]:
+                        self._out[nxt].append(entry)
+
+    def matchTokens(self, tokens):
+        """
+        Returns the list of words and phrases found in a list of lower cased
+        tokens, each listed once.
+        """
+        words = self._words
+        found = [words[t] for t in set(tokens) if t in words]
+
+        if len(self._goto) > 1:
+            goto = self._goto
+            fail = self._fail
+            out = self._out
+            phrases = []
+            state = 0
+            for t in tokens:
+                while state and not t in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(t, 0)
+                if out[state]:
+                    for entry in out[state]:
+                        if not entry in phrases:
+                            phrases.append(entry)
+            found.extend(phrases)
+
+        return found
+
+    def match(self, text):
+        """
+        Returns the list of words and phrases found in text, each listed once.
+        """
+        if isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        return self.matchTokens(text.lower().split())
+
+    def save(self, path):
+        """
+        Write the compiled matcher to a file.
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """
+        Returns a matcher written by save().
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+
+def compileFile(path, cache=None):
+    """
+    Returns a Matcher for a word file (one word or phrase per line). If cache
+    is given, the compiled matcher is stored there together with a hash of the
+    word file, and reused as long as the word file hasn't changed.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = hashlib.sha1(data).hexdigest()
+
+    if cache and os.path.exists(cache):
+        try:
+            with open(cache, 'rb') as f:
+                cachedDigest, matcher = pickle.load(f)
+            if cachedDigest == digest:
+                return matcher
+        except Exception:
+            # unreadable or stale cache; compile again
+            pass
+
+    words = [line.strip() for line in data.splitlines()]
+    matcher = Matcher([w for w in words if w])
+
+    if cache:
+        tmp = cache + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump((digest, matcher), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, cache)
+
+    return matcher
+
+
+
+###############################################################################
+# Track term attribution                                                      #
+# --------------------------------------------------------------------------- #
+# Tells which of the Stream's searchTerms a delivered tweet matched           #
+###############################################################################
+
+# a token, including a leading '#' or '@'
+_TOKEN = re.compile(r'[#@]?\w+', re.UNICODE)
+
+# scripts written without spaces between words; terms in these are matched as
+# substrings since they can't be matched as tokens
+_UNSPACED = re.compile(u'[\u0e00-\u0e7f\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]')
+
+
+def _tokens(text, tokens):
+    """
+    Add the lower cased tokens of text to the set tokens. '#word' and '@word'
+    yield both the marked and the bare word.
+    """
+    for t in _TOKEN.findall(text.lower()):
+        tokens.add(t)
+        if t[0] in u'#@':
+            tokens.add(t[1:])
+
+
+class TrackMatcher:
+    def __init__(self, searchTerms):
+        """
+        Compile the comma-separated searchTerms string given to
+        tweetwatch.stream.Stream into a matcher that reports which terms a
+        tweet matched. Term IDs are positions in self.terms.
+
+        Matching mirrors the streaming API's track semantics: case is ignored;
+        words separated by spaces must all appear, in any order; a term matches
+        whole words only, so 'olympi' does not match 'olympics'; 'hashtag'
+        matches 'hashtag' and '#hashtag' while '#hashtag' only matches the
+        hashtag; punctuation splits words, so 'example.com' matches links to
+        example.com; quotes around a term are ignored. The tweet text, hashtags,
+        mentioned screen names, expanded and display URLs, and the same fields
+        of a retweeted or quoted tweet are searched. Terms in scripts written
+        without spaces (Japanese, Chinese, Thai, Korean) are matched as
+        substrings of the text.
+        """
+        if isinstance(searchTerms, str):
+            searchTerms = searchTerms.decode('utf-8')
+
+        self.terms = []
+
+        # token -> IDs of the token terms that include it
+        self._index = {}
+        # number of distinct tokens each term needs
+        self._need = []
+        # (term ID, lower cased term) for substring terms
+        self._substrings = []
+
+        for term in searchTerms.split(','):
+            term = term.strip().strip('\'"').strip()
+            if not term:
+                continue
+            i = len(self.terms)
+            self.terms.append(term)
+
+            if _UNSPACED.search(term):
+                self._substrings.append((i, term.lower()))
+                self._need.append(0)
+                continue
+
+            required = set()
+            for word in term.lower().split():
+                if word.startswith('www.'):
+                    word = word[4:]
+                marked = word[:1] in u'#@'
+                parts = _TOKEN.findall(word)
+                if marked and parts:
+                    # '#hashtag' stays one token; '@user' matches as 'user'
+                    if word[0] == u'#':
+                        required.add(parts[0])
+                    else:
+                        required.add(parts[0][1:])
+                    parts = parts[1:]
+                for p in parts:
+                    required.add(p.lstrip(u'#@'))
+            self._need.append(len(required))
+            for t in required:
+                self._index.setdefault(t, []).append(i)
+
+    def _collect(self, tweet, tokens, texts):
+        """
+        Gather the tokens and raw text of a tweet and any tweet it embeds.
+        """
+        text = tweet.get('text')
+        if text:
+            texts.append(text)
+            _tokens(text, tokens)
+        entities = tweet.get('entities') or {}
+        for h in entities.get('hashtags') or []:
+            if h.get('text'):
+                tokens.add(u'#' + h['text'].lower())
+                tokens.add(h['text'].lower())
+        for m in entities.get('user_mentions') or []:
+            if m.get('screen_name'):
+                tokens.add(m['screen_name'].lower())
+        for key in ('urls', 'media'):
+            for u in entities.get(key) or []:
+                for field in ('expanded_url', 'display_url'):
+                    if u.get(field):
+                        _tokens(u[field], tokens)
+        for key in ('retweeted_status', 'quoted_status'):
+            if tweet.get(key):
+                self._collect(tweet[key], tokens, texts)
+
+    def _match(self, tokens, texts):
+        """
+        Returns the sorted IDs of the terms satisfied by tokens and texts.
+        """
+        hits = {}
+        index = self._index
+        for t in tokens:
+            ids = index.get(t)
+            if ids:
+                for i in ids:
+                    hits[i] = hits.get(i, 0) + 1
+        need = self._need
+        found = [i for i, n in hits.iteritems() if n == need[i]]
+
+        if self._substrings:
+            lowered = [t.lower() for t in texts]
+            for i, term in self._substrings:
+                for t in lowered:
+                    if term in t:
+                        found.append(i)
+                        break
+
+        found.sort()
+        return found
+
+    def match(self, tweet):
+        """
+        Returns the sorted list of IDs of the terms a decoded tweet matched.
+        """
+        tokens = set()
+        texts = []
+        self._collect(tweet, tokens, texts)
+        return self._match(tokens, texts)
+
+    def matchText(self, text):
+        """
+        Returns the sorted list of IDs of the terms matched by a piece of text.
+        """
+        if isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+        tokens = set()
+        _tokens(text, tokens)
+        return self._match(tokens, [text])
+
+    def names(self, ids):
+        """
+        Returns the terms for a list of term IDs.
+        """
+        return [self.terms[i] for i in ids]
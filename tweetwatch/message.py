@@ -0,0 +1,290 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+import re
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+
+# the first key of every non-tweet message the streaming API sends, plus the
+# error records made by tweetwatch.stream
+CONTROL = frozenset(['delete', 'limit', 'warning', 'disconnect', 'scrub_geo',
+    'status_withheld', 'user_withheld', 'friends', 'event', 'tweetwatch_error'])
+
+# first keys that start a tweet
+_TWEET = frozenset(['created_at', 'id', 'id_str', 'text'])
+
+_ID = re.compile(r'"id":\s*(\d+)')
+_TEXT = re.compile(r'"text":\s*("(?:[^"\\]|\\.)*")')
+_LANG = re.compile(r'"lang":\s*(null|"(?:[^"\\]|\\.)*")')
+_SCREEN_NAME = re.compile(r'"screen_name":\s*("(?:[^"\\]|\\.)*")')
+_UTC_OFFSET = re.compile(r'"utc_offset":\s*(null|-?\d+)')
+_TIME_ZONE = re.compile(r'"time_zone":\s*(null|"(?:[^"\\]|\\.)*")')
+_TRACK = re.compile(r'"track":\s*(\d+)')
+
+
+
+def classify(message):
+    """
+    Returns the type of a streaming API message from its first few bytes:
+    'tweet', one of the control message types in CONTROL (e.g. 'limit',
+    'delete', 'warning', 'tweetwatch_error'), 'keepalive' for a blank line, or
+    'unknown' for anything that isn't a JSON object.
+    """
+    if not message.startswith('{"'):
+        if not message.strip():
+            return 'keepalive'
+        if message.lstrip().startswith('{'):
+            # pretty-printed or re-serialized JSON; fall back to decoding
+            try:
+                keys = json.loads(message).keys()
+            except ValueError:
+                return 'unknown'
+            for k in keys:
+                if k in CONTROL:
+                    return k
+            if 'text' in keys:
+                return 'tweet'
+        return 'unknown'
+    key = message[2:message.find('"', 2)]
+    if key in CONTROL:
+        return key
+    if key in _TWEET or '"text":' in message:
+        return 'tweet'
+    return 'unknown'
+
+
+def snowflakeOf(message):
+    """
+    Returns the snowflake ID of a tweet message, or None for anything else.
+    """
+    if classify(message) != 'tweet':
+        return None
+    m = _ID.search(message)
+    if m:
+        return int(m.group(1))
+    return None
+
+
+
+###############################################################################
+# Lazy message                                                                #
+###############################################################################
+class _lazy(object):
+    """
+    A property computed on first access and then stored on the instance.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.__doc__ = f.__doc__
+
+    def __get__(self, obj, cls):
+        if obj is None:
+            return self
+        v = self.f(obj)
+        obj.__dict__[self.f.__name__] = v
+        return v
+
+
+class Message(str):
+    """
+    A streaming API message that is still its raw string (so it can be written
+    to a file or passed to json.loads as before) but can also answer questions
+    about itself without decoding the whole document. The type comes from the
+    first key; id, text, lang and the author's user fields are picked out with
+    targeted searches that rely on the field order Twitter uses, and fall back
+    to a full decode when a field can't be found that way. The full document is
+    decoded only when the json attribute is used.
+
+    ***EXAMPLE***
+
+    def dataFunction(message):
+        if message.kind == 'tweet':
+            zones[message.time_zone] += 1
+    """
+    def __new__(cls, data, kind=None):
+        self = str.__new__(cls, data)
+        if kind:
+            self.__dict__['kind'] = kind
+        return self
+
+    def _field(self, path):
+        """
+        Look a field up in the fully decoded document; None if it is missing.
+        """
+        try:
+            v = self.json
+            for key in path:
+                v = v[key]
+            return v
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _string(self, pattern, pos, path):
+        """
+        Returns the string (or null) value matched by pattern from pos on.
+        """
+        m = pattern.search(self, pos)
+        if m is None:
+            return self._field(path)
+        if m.group(1) == 'null':
+            return None
+        return json.loads(m.group(1))
+
+    @_lazy
+    def kind(self):
+        """The message type; see tweetwatch.message.classify."""
+        return classify(self)
+
+    @_lazy
+    def json(self):
+        """The fully decoded message."""
+        return json.loads(self)
+
+    @_lazy
+    def _user(self):
+        """Offset of the author's user object, or -1."""
+        return self.find('"user":{')
+
+    @_lazy
+    def id(self):
+        """The tweet ID (for a delete notice, the deleted tweet's ID)."""
+        m = _ID.search(self)
+        if m:
+            return int(m.group(1))
+        return self._field(['id'])
+
+    @_lazy
+    def text(self):
+        """The tweet text, as unicode."""
+        return self._string(_TEXT, 0, ['text'])
+
+    @_lazy
+    def lang(self):
+        """The language of the tweet (not of its author)."""
+        # the tweet's own "lang" comes last, after the user object and any
+        # retweeted status
+        pos = self.rfind('"lang":')
+        if pos < 0 or pos < self._user:
+            return self._field(['lang'])
+        return self._string(_LANG, pos, ['lang'])
+
+    @_lazy
+    def user_id(self):
+        """The author's user ID."""
+        if self._user < 0:
+            return self._field(['user', 'id'])
+        m = _ID.search(self, self._user)
+        if m:
+            return int(m.group(1))
+        return self._field(['user', 'id'])
+
+    @_lazy
+    def screen_name(self):
+        """The author's screen name."""
+        if self._user < 0:
+            return self._field(['user', 'screen_name'])
+        return self._string(_SCREEN_NAME, self._user, ['user', 'screen_name'])
+
+    @_lazy
+    def utc_offset(self):
+        """The author's UTC offset in seconds, or None."""
+        if self._user < 0:
+            return self._field(['user', 'utc_offset'])
+        m = _UTC_OFFSET.search(self, self._user)
+        if m is None:
+            return self._field(['user', 'utc_offset'])
+        if m.group(1) == 'null':
+            return None
+        return int(m.group(1))
+
+    @_lazy
+    def time_zone(self):
+        """The author's time zone name, or None."""
+        if self._user < 0:
+            return self._field(['user', 'time_zone'])
+        return self._string(_TIME_ZONE, self._user, ['user', 'time_zone'])
+
+    @_lazy
+    def track(self):
+        """For a limit notice, the number of undelivered tweets so far."""
+        m = _TRACK.search(self)
+        if m:
+            return int(m.group(1))
+        return self._field(['limit', 'track'])
+
+
+
+###############################################################################
+# Classifier stage                                                            #
+###############################################################################
+class Classifier:
+    def __init__(self, dataFunction, kinds=None, wrap=False, dedup=None, observers=None):
+        """
+        A stage between the framer and dataFunction that classifies every
+        message by its leading bytes, counts messages by type, drops types not
+        listed in kinds (all are passed when kinds is None), and, if wrap is
+        True, hands dataFunction Message objects instead of plain strings.
+        When dedup (a tweetwatch.dedup.Dedup) is given, tweets it has already
+        seen are dropped and counted as 'duplicate'. Every observer is called
+        with each message that isn't a duplicate, as a Message, before the
+        types in kinds are picked out.
+        """
+        self.dataFunction = dataFunction
+        self.kinds = None
+        if kinds is not None:
+            self.kinds = frozenset(kinds)
+        self.wrap = wrap
+        self.dedup = dedup
+        self.observers = list(observers or [])
+
+        # messages seen, by type
+        self.counts = {}
+
+    def __call__(self, message):
+        kind = classify(message)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        raw = message
+        if self.observers:
+            message = Message(message, kind)
+        elif self.kinds is not None and not kind in self.kinds:
+            return
+        elif self.wrap:
+            message = Message(message, kind)
+        if self.dedup is not None and kind == 'tweet':
+            if isinstance(message, Message):
+                snowflake = message.id
+            else:
+                m = _ID.search(message)
+                snowflake = m and int(m.group(1))
+            if snowflake and self.dedup.seen(snowflake):
+                self.counts['duplicate'] = self.counts.get('duplicate', 0) + 1
+                return
+        if self.observers:
+            for observer in self.observers:
+                observer(message)
+            if self.kinds is not None and not kind in self.kinds:
+                return
+            if not self.wrap:
+                message = raw
+        self.dataFunction(message)
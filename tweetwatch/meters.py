@@ -22,6 +22,11 @@ __version__ = '0.1.2'
 
 import time
 import sys
+import math
+from array import array
+from bisect import bisect_left
+
+from tweetwatch.snowflake import snowflake2ms
 
 def _currMinMark():
     """
@@ -61,9 +66,11 @@ def _nextMinMark():
 class TPM:
     def __init__(self, maxLen):
         """
-        Create a dict with keys=timestamp and values=tweetcount to track the
-        number of tweets (tweetcount) that occur at 'timestamp'. This list will
-        hold timestamp values from the current second and back maxLen seconds.
+        Create a circular array of per-second tweet counts, indexed by
+        timestamp modulo its length, that holds the current second and the
+        maxLen seconds before it. A running sum of the most recent 60 seconds is
+        kept alongside, so recording and reading the meter are both constant
+        time operations no matter how large maxLen is.
         """
         if not isinstance(maxLen, int):
             raise TypeError('tweetwatch.meters.TPM error: maxLen must be an integer')
@@ -71,28 +78,21 @@ class TPM:
             raise ValueError('tweetwatch.meters.TPM error: maxLen must be >= 60')
         else: self._maxLen = maxLen
 
-        # initialize self._tweetsBySecond
-        self._tweetsBySecond = {}
-        t = int(time.time())
-        for i in range(t, t-(maxLen+1), -1):
-            self._tweetsBySecond[i] = 0
+        # initialize self._tweetsBySecond (one slot per second)
+        self._size = maxLen + 1
+        self._tweetsBySecond = array('l', [0]) * self._size
 
-    def _extendBySecond(self, timestamp):
-        """
-        Appends the dict self._tweetsBySecond to include timestamp:0. If the
-        dict has grown longer than self.maxLen, elements are popped from the
-        dict until proper length is obtained.
-        """
-        if not timestamp in self._tweetsBySecond:
-            self._tweetsBySecond[timestamp] = 0
-        while len(self._tweetsBySecond) > self._maxLen:
-            v = self._tweetsBySecond.pop(min(self._tweetsBySecond.keys()))
+        # the most recent second held in the array
+        self._latest = int(time.time())
+
+        # number of tweets in the 60 seconds ending at self._latest
+        self._windowSum = 0
 
     def _extendToNow(self, timestamp=None):
         """
-        Prepends the list self._tweetsBySecond to include [timestamp, 0]
-        entries for all seconds between its first timestamp value and now. This
-        prepares the list for recording tweet counts at any given second.
+        Move the most recent second of self._tweetsBySecond forward to now,
+        zeroing the slots of seconds that fall out of range and removing the
+        seconds that leave the 60 second window from the running sum.
 
         If the optional timestamp is set, use this value instead of now.
         """
@@ -102,18 +102,30 @@ class TPM:
         else:
             s = int(time.time())
 
-        # get the timestamp of the most recent time in the dict
-        m = max(self._tweetsBySecond, key=self._tweetsBySecond.get)
+        if s <= self._latest:
+            return
+
+        counts = self._tweetsBySecond
+        size = self._size
+
+        if s - self._latest >= 60:
+            # the whole window has passed
+            self._windowSum = 0
+            for i in range(max(self._latest + 1, s - size + 1), s + 1):
+                counts[i % size] = 0
+        else:
+            for i in range(self._latest + 1, s + 1):
+                # second i - 60 leaves the window as second i enters it
+                self._windowSum -= counts[(i - 60) % size]
+                counts[i % size] = 0
 
-        # add the required entries to the dict 
-        for i in range(m + 1, s + 1, 1):
-            self._extendBySecond(i)
+        self._latest = s
 
     def record(self, numTweets, timestamp=None):
         """
-        Add numTweets to self._tweetsBySecond[timestamp]. If the specified key
-        does not exist, add the appropriate indices. If timestamp is not
-        specified, use the current timestamp.
+        Add numTweets to the count for timestamp. If timestamp is not
+        specified, use the current timestamp. Timestamps up to maxLen seconds
+        older than the most recent one recorded are accepted.
         """
         # if timestamp isn't given, use current timestamp
         if not timestamp:
@@ -129,38 +141,404 @@ class TPM:
         if numTweets <= 0:
             raise ValueError('tweetwatch.meters.TPM.record error: numTweets not a positive integer')
 
-        # if timestamp is an existing key, then add numTweets to the value
-        if timestamp in self._tweetsBySecond:
-            self._tweetsBySecond[timestamp] += numTweets
+        # move the array forward when this is a new second
+        if timestamp > self._latest:
+            self._extendToNow(timestamp)
+        elif timestamp < self._latest - self._maxLen:
+            raise ValueError('tweetwatch.meters.TPM.record error: timestamp older than maxLen seconds')
 
-        # if timestamp is not an existing key, extend self._tweetsBySecond
-        else:
-            # make sure that the given timestamp is greater than existing keys
-            if timestamp < max(self._tweetsBySecond, key=self._tweetsBySecond.get):
-                raise ValueError('tweetwatch.meters.TPM.record error: timestamp less than previous timestamps')
-            else:
-                self._extendToNow(timestamp)
-                self._tweetsBySecond[timestamp] += numTweets
+        self._tweetsBySecond[timestamp % self._size] += numTweets
+        if timestamp > self._latest - 60:
+            self._windowSum += numTweets
 
     def get(self):
         """
         Returns the current tweet per minute measurement as an integer.
         """
-        # set a timestamp for now
-        t = int(time.time())
-
-        # make sure the dict is up-to-date by second.
-        self._extendToNow(t)
+        # make sure the array is up-to-date by second.
+        self._extendToNow(int(time.time()))
 
         # return a measurement of number of tweets over the last 60 seconds
-        return sum([self._tweetsBySecond[i] for i in range(t,t-60,-1)])
+        return self._windowSum
+
+
+
+
+
+###############################################################################
+# Exponentially weighted moving averages                                      #
+###############################################################################
+class EWMA:
+    def __init__(self, window, interval=1):
+        """
+        An exponentially weighted moving average of an event rate, updated
+        once every 'interval' seconds and decaying over 'window' seconds (in
+        the style of the Unix load average).
+        """
+        if not isinstance(window, int) or not isinstance(interval, int):
+            raise TypeError('tweetwatch.meters.EWMA error: window and interval must be integers')
+        if window <= 0 or interval <= 0:
+            raise ValueError('tweetwatch.meters.EWMA error: window and interval must be positive')
+
+        self.window = window
+        self.interval = interval
+        self._alpha = 1.0 - math.exp(-float(interval) / window)
+        self._rate = None
+
+    def tick(self, count, idle=0):
+        """
+        Fold in 'count' events seen during the last interval, followed by
+        'idle' intervals in which nothing happened. Idle intervals decay the
+        average in one step rather than one tick at a time.
+        """
+        instant = float(count) / self.interval
+        if self._rate is None:
+            self._rate = instant
+        else:
+            self._rate += self._alpha * (instant - self._rate)
+        if idle:
+            self._rate *= (1.0 - self._alpha) ** idle
+
+    def get(self):
+        """
+        Returns the average rate in events per second.
+        """
+        return self._rate or 0.0
+
+
+class Rates:
+    def __init__(self, windows=(1, 60, 300, 900)):
+        """
+        Track the tweet rate over several windows at once, by default 1
+        second, 1 minute, 5 minutes and 15 minutes. Recording only adds to a
+        counter; the averages are brought up to date once per elapsed second.
+        """
+        if not windows:
+            raise ValueError('tweetwatch.meters.Rates error: at least one window is required')
+
+        self._ewmas = [EWMA(w) for w in windows]
+        self._uncounted = 0
+        self._lastTick = int(time.time())
+
+        # total number of events ever recorded
+        self.count = 0
+
+    def _tickToNow(self, now):
+        """
+        Close out every whole second between the last tick and now.
+        """
+        elapsed = now - self._lastTick
+        if elapsed <= 0:
+            return
+        for e in self._ewmas:
+            e.tick(self._uncounted, elapsed - 1)
+        self._uncounted = 0
+        self._lastTick = now
+
+    def record(self, numTweets=1, timestamp=None):
+        """
+        Count numTweets at timestamp (default now).
+        """
+        if not timestamp:
+            timestamp = int(time.time())
+        if timestamp > self._lastTick:
+            self._tickToNow(timestamp)
+        self._uncounted += numTweets
+        self.count += numTweets
+
+    def get(self, window=60):
+        """
+        Returns the averaged rate, in tweets per second, for the given window.
+        """
+        self._tickToNow(int(time.time()))
+        for e in self._ewmas:
+            if e.window == window:
+                return e.get()
+        raise KeyError('tweetwatch.meters.Rates.get error: no %s second window' % window)
+
+    def getAll(self):
+        """
+        Returns a dict mapping each window (in seconds) to its rate in tweets
+        per second.
+        """
+        self._tickToNow(int(time.time()))
+        return dict((e.window, e.get()) for e in self._ewmas)
+
+
+
+
+
+###############################################################################
+# Limit notices                                                               #
+###############################################################################
+class LimitTracker:
+    def __init__(self, windows=(60, 300, 900)):
+        """
+        Counts delivered tweets and the tweets Twitter held back, per second,
+        so the share of matching tweets actually received can be read over
+        sliding windows of the last 'windows' seconds.
+
+        A limit notice ({"limit":{"track":N}}) carries the running total N of
+        undelivered tweets since its connection opened, not the number missed
+        since the last notice. recordLimit() keeps the last total seen for
+        each connection and counts only the increase. A total lower than the
+        last one means the connection was restarted and counts in full.
+
+        ***EXAMPLE***
+
+        limits = LimitTracker()
+        limits.record(1)              # for each tweet
+        limits.recordLimit(120)       # {"limit":{"track":120}}
+        limits.recordLimit(150)       # 30 more missed
+        limits.get(60)['missed_fraction']
+            --> 0.9933...
+        """
+        if not windows:
+            raise ValueError('tweetwatch.meters.LimitTracker error: at least one window is required')
+        for w in windows:
+            if not isinstance(w, int):
+                raise TypeError('tweetwatch.meters.LimitTracker error: windows must be integers')
+            if w <= 0:
+                raise ValueError('tweetwatch.meters.LimitTracker error: windows must be positive')
+
+        self.windows = sorted(windows)
+        self._maxLen = self.windows[-1]
+
+        # circular arrays of per-second counts, like TPM
+        self._size = self._maxLen + 1
+        self._delivered = array('l', [0]) * self._size
+        self._missed = array('l', [0]) * self._size
+        self._latest = int(time.time())
+        self._start = self._latest
+
+        # connection -> the last running total seen on it
+        self._totals = {}
+
+        # totals ever recorded, and the number of restarted connections seen
+        self.delivered = 0
+        self.missed = 0
+        self.resets = 0
+
+    def _extendToNow(self, timestamp):
+        """
+        Move the most recent second forward to timestamp, zeroing the slots
+        of seconds that fall out of range.
+        """
+        if timestamp <= self._latest:
+            return
+        for i in range(max(self._latest + 1, timestamp - self._size + 1), timestamp + 1):
+            self._delivered[i % self._size] = 0
+            self._missed[i % self._size] = 0
+        self._latest = timestamp
+
+    def _slot(self, timestamp):
+        """
+        Returns the array index for timestamp (default now), or None if it is
+        older than the longest window.
+        """
+        if not timestamp:
+            timestamp = int(time.time())
+        if timestamp > self._latest:
+            self._extendToNow(timestamp)
+        elif timestamp < self._latest - self._maxLen:
+            return None
+        return timestamp % self._size
 
+    def record(self, numTweets=1, timestamp=None):
+        """
+        Count numTweets delivered tweets at timestamp (default now).
+        """
+        self.delivered += numTweets
+        i = self._slot(timestamp)
+        if i is not None:
+            self._delivered[i] += numTweets
 
+    def recordLimit(self, track, connection=None, timestamp=None):
+        """
+        Take a limit notice's running total 'track' at timestamp (default
+        now), and return the number of tweets missed since the last notice on
+        the same connection.
+
+        'connection' tells connections apart, e.g. Stream.connections (which
+        goes up on every reconnect) or the shard of a StreamGroup. Passing it
+        is the surest way to handle reconnects; otherwise call reset() when
+        the connection restarts.
+        """
+        last = self._totals.get(connection, 0)
+        if track < last:
+            # a new connection; its count started over
+            self.resets += 1
+            missed = track
+        else:
+            missed = track - last
+        self._totals[connection] = track
 
+        if missed:
+            self.missed += missed
+            i = self._slot(timestamp)
+            if i is not None:
+                self._missed[i] += missed
+        return missed
 
+    def reset(self, connection=None):
+        """
+        Forget the running total of a connection that has been restarted (or
+        closed for good).
+        """
+        self._totals.pop(connection, None)
 
+    def get(self, window=60):
+        """
+        Returns a dict of rates in tweets per second over the last 'window'
+        seconds: 'delivered', 'missed', 'total' (the estimated true rate of
+        matching tweets) and 'missed_fraction' (missed / total, or 0.0).
+        Until the tracker has run for 'window' seconds, rates are taken over
+        the time it has run.
+        """
+        if not window in self.windows:
+            raise KeyError('tweetwatch.meters.LimitTracker.get error: no %s second window' % window)
+        now = int(time.time())
+        self._extendToNow(now)
+
+        delivered = missed = 0
+        for t in range(now - window + 1, now + 1):
+            delivered += self._delivered[t % self._size]
+            missed += self._missed[t % self._size]
+
+        seconds = float(min(window, now - self._start + 1))
+        total = delivered + missed
+        fraction = 0.0
+        if total:
+            fraction = float(missed) / total
+        return {
+            'delivered': delivered / seconds,
+            'missed': missed / seconds,
+            'total': total / seconds,
+            'missed_fraction': fraction
+        }
+
+    def getAll(self):
+        """
+        Returns a dict mapping each window (in seconds) to get(window).
+        """
+        return dict((w, self.get(w)) for w in self.windows)
 
 
 
 
 
+###############################################################################
+# Histograms                                                                  #
+###############################################################################
+def geometricBounds(low, high, perDecade=10):
+    """
+    Returns a list of bucket upper bounds growing geometrically from low to
+    high, with perDecade buckets for every factor of ten.
+    """
+    if low <= 0 or high <= low:
+        raise ValueError('tweetwatch.meters.geometricBounds error: need 0 < low < high')
+    bounds = []
+    i = 0
+    while True:
+        b = low * 10.0 ** (float(i) / perDecade)
+        bounds.append(b)
+        if b >= high:
+            return bounds
+        i += 1
+
+
+class Histogram:
+    def __init__(self, bounds):
+        """
+        A fixed-bucket histogram. 'bounds' is a sorted list of bucket upper
+        bounds; values above the last bound land in one final overflow bucket.
+        Recording is a binary search over the bounds plus an increment, and the
+        memory used never grows.
+        """
+        if not bounds or list(bounds) != sorted(bounds):
+            raise ValueError('tweetwatch.meters.Histogram error: bounds must be a sorted, non-empty list')
+
+        self.bounds = list(bounds)
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all counts.
+        """
+        self.counts = array('l', [0]) * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = None
+
+    def record(self, value):
+        """
+        Add one observation of value.
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        Returns the upper bound of the bucket holding the p-th percentile
+        (0 < p <= 100), or None if nothing has been recorded. Values in the
+        overflow bucket report the largest value seen.
+        """
+        if not self.count:
+            return None
+        rank = math.ceil(self.count * p / 100.0)
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                if i < len(self.bounds):
+                    return min(self.bounds[i], self.max)
+                return self.max
+        return self.max
+
+    def mean(self):
+        """
+        Returns the mean of all recorded values, or None.
+        """
+        if not self.count:
+            return None
+        return float(self.total) / self.count
+
+
+class LagHistogram(Histogram):
+    def __init__(self, bounds=None):
+        """
+        A histogram of ingest lag in milliseconds: the time a tweet arrives
+        minus the time encoded in its snowflake ID. The default buckets run
+        from 1 millisecond to 1 day, ten per decade.
+        """
+        if bounds is None:
+            bounds = geometricBounds(1, 86400000)
+        Histogram.__init__(self, bounds)
+
+    def recordTweet(self, snowflake, arrival=None):
+        """
+        Record the lag of the tweet with ID snowflake. arrival is a Unix
+        timestamp in (fractional) seconds and defaults to now. Clock skew that
+        makes a lag negative is recorded as zero.
+        """
+        if arrival is None:
+            arrival = time.time()
+        lag = int(arrival * 1000) - snowflake2ms(snowflake)
+        if lag < 0:
+            lag = 0
+        self.record(lag)
+
+    def p50(self):
+        """
+        Returns the median lag in milliseconds.
+        """
+        return self.percentile(50)
+
+    def p99(self):
+        """
+        Returns the 99th percentile lag in milliseconds.
+        """
+        return self.percentile(99)
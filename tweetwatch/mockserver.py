@@ -0,0 +1,350 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+#   A stand-in for Twitter's streaming endpoint, for testing and benchmarking
+#   tweetwatch.stream without a network connection or an API token. It
+#   replays a JSON-lines capture file over a chunked HTTP response, the way
+#   stream.twitter.com sends tweets.
+
+import sys
+import time
+import zlib
+import socket
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+from tweetwatch.message import snowflakeOf
+from tweetwatch.snowflake import snowflake2ms
+
+
+
+###############################################################################
+# Request handler                                                             #
+###############################################################################
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # chunked transfer encoding needs HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.mock.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self._serve({})
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self._serve(urlparse.parse_qs(self.rfile.read(length)))
+
+    def _serve(self, params):
+        mock = self.server.mock
+        status = mock._nextStatus()
+        mock.connections += 1
+
+        if status != 200:
+            body = json.dumps({'errors': [{'message': 'mock error', 'code': status}]})
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        gzipped = mock.gzip and 'gzip' in (self.headers.getheader('Accept-Encoding') or '')
+        delimited = params.get('delimited', [None])[0] == 'length'
+
+        if mock.timestamps:
+            # whatever the last connection sent but didn't deliver is gone
+            mock.sendTimes = {}
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+
+        self._compressor = None
+        if gzipped:
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+
+        try:
+            self._replay(mock, delimited)
+            if self._compressor:
+                self._chunk(self._compressor.flush(zlib.Z_FINISH), raw=True)
+            self.wfile.write('0\r\n\r\n')
+        except socket.error:
+            # the client went away
+            pass
+        self.close_connection = 1
+
+    def _chunk(self, data, raw=False):
+        """
+        Send data as one HTTP chunk, compressing it first if gzip is on.
+        """
+        if self._compressor and not raw:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+
+    def _replay(self, mock, delimited):
+        """
+        Send the capture file's messages, with keep-alives, limit notices and
+        stall warnings mixed in, until the file runs out, the connection is to
+        be cut, or the server stops.
+        """
+        sent = 0
+        start = time.time()
+        first = None
+        lastSend = start
+        lastStall = start
+
+        for message in mock._messages():
+            if mock._stopping.is_set():
+                return
+
+            s = None
+            if mock.speed or mock.timestamps:
+                s = snowflakeOf(message)
+
+            # pace the replay by the tweets' own creation times
+            if mock.speed:
+                if s is not None:
+                    ms = snowflake2ms(s)
+                    if first is None:
+                        first = ms
+                    due = start + (ms - first) / 1000.0 / mock.speed
+                    while True:
+                        now = time.time()
+                        if now >= due or mock._stopping.is_set():
+                            break
+                        if mock.keepalive and now - lastSend >= mock.keepalive:
+                            self._chunk('\r\n')
+                            lastSend = now
+                        wait = due - now
+                        if mock.keepalive:
+                            wait = min(wait, mock.keepalive)
+                        time.sleep(wait)
+
+            if not message.endswith('\r\n'):
+                message = message.rstrip('\r\n') + '\r\n'
+            if delimited:
+                message = '%d\r\n%s' % (len(message), message)
+            if mock.timestamps and s is not None:
+                # keyed by ID, so limit notices, stall warnings and keep-alives
+                # can't shift the matching; a looped capture can have a tweet
+                # in flight more than once
+                mock.sendTimes.setdefault(s, []).append(time.time())
+            self._chunk(message)
+            sent += 1
+            mock.sent += 1
+            lastSend = time.time()
+
+            if mock.limit_every and sent % mock.limit_every == 0:
+                mock.undelivered += mock.limit_every
+                self._chunk(json.dumps({'limit': {'track': mock.undelivered}}) + '\r\n')
+
+            if mock.stall_every and lastSend - lastStall >= mock.stall_every:
+                lastStall = lastSend
+                self._chunk(json.dumps({'warning': {'code': 'FALLING_BEHIND',
+                        'message': 'mock stall warning', 'percent_full': 60}}) + '\r\n')
+
+            if mock.disconnect_after and sent >= mock.disconnect_after:
+                self._chunk(json.dumps({'disconnect': {'code': 7, 'stream_name': 'mock',
+                        'reason': 'mock disconnect'}}) + '\r\n')
+                return
+
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+
+###############################################################################
+# Mock streaming endpoint                                                     #
+###############################################################################
+class MockServer:
+    def __init__(self, capture, port=0, speed=None, gzip=True, keepalive=30,
+            limit_every=None, stall_every=None, disconnect_after=None, statuses=None,
+            loop=False, timestamps=False, verbose=False):
+        """
+        Serve a capture file like the streaming API would, on localhost.
+
+        REQUIRED INPUT:
+
+        capture (string or list) - A JSON-lines capture file (as written by the
+            examples), or a list of messages.
+
+        OPTIONAL INPUT:
+
+        port (int) - Port to listen on; 0 picks a free one. The default value
+            is 0.
+
+        speed (float) - Replay at this multiple of real time, going by the
+            creation times in the tweets' IDs: 1 is real time, 10 is ten times
+            faster. None sends as fast as the client reads. The default value
+            is None.
+
+        gzip (bool) - Compress the response when the client accepts gzip. The
+            default value is True.
+
+        keepalive (int) - Send a blank line after this many idle seconds, as
+            Twitter does about every 30 seconds. The default value is 30.
+
+        limit_every (int) - After every limit_every messages, send a limit
+            notice whose running total grows by limit_every. The default value
+            is None (no notices).
+
+        stall_every (int) - Send a stall warning every stall_every seconds.
+            The default value is None (no warnings).
+
+        disconnect_after (int) - Send a disconnect message and close the
+            connection after this many messages. The default value is None.
+
+        statuses (list) - HTTP status codes for successive connections, e.g.
+            [503, 420, 200]; once used up every connection gets 200. Anything
+            other than 200 is answered with a short JSON error body and the
+            connection is closed. The default value is None.
+
+        loop (bool) - Start the capture over when it runs out, instead of
+            ending the response. The default value is False.
+
+        timestamps (bool) - Record the time each tweet was sent in
+            self.sendTimes (tweet ID -> send times not yet claimed by
+            sendTime()), which starts empty on every connection, for measuring
+            latency. The default value is False.
+
+        ***EXAMPLE***
+
+        server = MockServer('sochi2014-2-8-12-tweets', speed=10, limit_every=500)
+        server.start()
+        S = tweetwatch.stream.Stream(apiToken, 'sochi', dataFunction,
+                api_url=server.url, curl_encoding='gzip')
+        """
+        if isinstance(capture, list):
+            self.lines = capture
+        else:
+            with open(capture, 'rb') as f:
+                self.lines = [line for line in f if line.strip()]
+        if speed is not None and not speed > 0:
+            raise ValueError('tweetwatch.mockserver.MockServer error: speed must be positive or None')
+
+        self.speed = speed
+        self.gzip = gzip
+        self.keepalive = keepalive
+        self.limit_every = limit_every
+        self.stall_every = stall_every
+        self.disconnect_after = disconnect_after
+        self.statuses = list(statuses or [])
+        self.loop = loop
+        self.timestamps = timestamps
+        self.verbose = verbose
+
+        # connections served, messages sent, running total for limit notices
+        self.connections = 0
+        self.sent = 0
+        self.undelivered = 0
+        self.sendTimes = {}
+
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server = _Server(('127.0.0.1', port), _Handler)
+        self._server.mock = self
+        self._thread = None
+
+        self.port = self._server.server_address[1]
+        self.url = 'http://127.0.0.1:%d/1.1/statuses/filter.json' % self.port
+
+    def _nextStatus(self):
+        """
+        Returns the HTTP status for a new connection.
+        """
+        with self._lock:
+            if self.statuses:
+                return self.statuses.pop(0)
+        return 200
+
+    def _messages(self):
+        """
+        Yields the messages to send on one connection.
+        """
+        while True:
+            for line in self.lines:
+                yield line
+            if not self.loop:
+                return
+
+    def sendTime(self, message):
+        """
+        Returns the time the tweet in message (a raw JSON string or a
+        tweetwatch.message.Message) was sent, and forgets it; None if it wasn't
+        recorded, or message isn't a tweet. Copies of a tweet sent more than
+        once are matched in order. Needs timestamps=True.
+        """
+        s = snowflakeOf(message)
+        if s is None:
+            return None
+        times = self.sendTimes.get(s)
+        if times:
+            return times.pop(0)
+        return None
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        End every response and stop serving.
+        """
+        self._stopping.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+
+
+if __name__ == '__main__':
+    # python -m tweetwatch.mockserver capture-file [port [speed]]
+    if len(sys.argv) < 2:
+        print >> sys.stderr, 'usage: python -m tweetwatch.mockserver capture-file [port [speed]]'
+        sys.exit(1)
+    port = 0
+    speed = None
+    if len(sys.argv) > 2:
+        port = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        speed = float(sys.argv[3])
+    server = MockServer(sys.argv[1], port=port, speed=speed, loop=True, verbose=True)
+    print 'serving %s at %s' % (sys.argv[1], server.url)
+    server._server.serve_forever()
@@ -0,0 +1,297 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+import os
+import sys
+import threading
+import traceback
+import Queue
+
+
+# placed on the queue once per worker to shut the pool down
+_STOP = object()
+
+
+
+###############################################################################
+# Pipeline class                                                              #
+# --------------------------------------------------------------------------- #
+# A bounded queue between the network thread and a pool of worker threads    #
+###############################################################################
+class Pipeline:
+    def __init__(self, dataFunction, workers=1, maxsize=10000, overflow='block',
+            spill_file=None, wrap=None):
+        """
+        Hand messages from the network thread to a pool of worker threads that
+        run dataFunction, so a slow handler (a disk write, say) never holds up
+        reading from the socket.
+
+        REQUIRED INPUT:
+
+        dataFunction (function) - Called with each message, from one of the
+            worker threads. With more than one worker, calls may overlap and
+            the order of messages is not guaranteed.
+
+        OPTIONAL INPUT:
+
+        workers (int) - Number of worker threads. The default value is 1.
+
+        maxsize (int) - Maximum number of messages waiting in the queue. The
+            default value is 10000.
+
+        overflow (string) - What to do when the queue is full. Must be one of
+            'block' (the network thread waits; tweetwatch.stream.Stream also
+            pauses the transfer with pycurl's WRITEFUNC_PAUSE until the queue
+            has drained to half its size), 'drop_oldest' (throw away the oldest
+            waiting message to make room), or 'spill' (append the message to
+            spill_file; workers read spilled messages back once the queue is
+            empty). The default value is 'block'.
+
+        spill_file (string) - Path of the overflow file used with
+            overflow='spill'. Required in that case, ignored otherwise. The
+            file is emptied whenever every spilled message has been read back,
+            and removed by stop().
+
+        wrap (function) - Called with each line read back from spill_file to
+            rebuild the message that was spilled, e.g. tweetwatch.message.Message
+            when dataFunction expects Message objects. The default value is
+            None (spilled messages come back as plain strings).
+        """
+        if dataFunction is None or not hasattr(dataFunction, '__call__'):
+            raise ValueError('tweetwatch.pipeline.Pipeline error: dataFunction must be a Python function')
+        if not isinstance(workers, int) or not isinstance(maxsize, int):
+            raise TypeError('tweetwatch.pipeline.Pipeline error: workers and maxsize must be integers')
+        if workers < 1 or maxsize < 1:
+            raise ValueError('tweetwatch.pipeline.Pipeline error: workers and maxsize must be positive')
+        if not overflow in ['block', 'drop_oldest', 'spill']:
+            raise ValueError("tweetwatch.pipeline.Pipeline error: overflow must be 'block', 'drop_oldest', or 'spill'")
+        if overflow == 'spill' and not spill_file:
+            raise ValueError("tweetwatch.pipeline.Pipeline error: overflow='spill' requires spill_file")
+
+        self.dataFunction = dataFunction
+        self.workers = workers
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.spill_file = spill_file
+        self.wrap = wrap
+
+        self._queue = Queue.Queue(maxsize)
+        self._threads = []
+
+        # counters are updated without locks to keep them off the critical
+        # path; with several workers, processed and errors are approximate
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.processed = 0
+        self.errors = 0
+
+        # overflow file state (overflow='spill' only)
+        self._spillLock = threading.Lock()
+        self._spillOut = None
+        self._spillIn = None
+        self._unspilled = 0
+
+    def start(self):
+        """
+        Start the worker threads. Calling start() on a running pipeline does
+        nothing.
+        """
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name='tweetwatch-worker-%d' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, wait=True):
+        """
+        Let the workers finish the messages already queued or spilled, then
+        stop them. If wait is True, block until they have exited and remove
+        the spill file.
+        """
+        for t in self._threads:
+            self._queue.put(_STOP)
+        if wait:
+            for t in self._threads:
+                t.join()
+            self._closeSpill()
+            if self.spill_file and os.path.exists(self.spill_file):
+                os.remove(self.spill_file)
+        self._threads = []
+
+    def depth(self):
+        """
+        Returns the approximate number of messages waiting in the queue.
+        """
+        return self._queue.qsize()
+
+    def full(self):
+        """
+        Returns True when the queue has no room for another message.
+        """
+        return self._queue.full()
+
+    def free(self):
+        """
+        Returns the approximate number of messages the queue has room for.
+        """
+        return self.maxsize - self._queue.qsize()
+
+    def stats(self):
+        """
+        Returns a dict of the queue depth and message counters.
+        """
+        return {
+            'depth': self.depth(),
+            'maxsize': self.maxsize,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'spilled': self.spilled,
+            'processed': self.processed,
+            'errors': self.errors
+        }
+
+    def put(self, message):
+        """
+        Queue a message for the workers, applying the overflow policy if the
+        queue is full. Called from the network thread.
+        """
+        if self.overflow == 'block':
+            self._queue.put(message)
+            self.enqueued += 1
+            return
+
+        try:
+            self._queue.put_nowait(message)
+            self.enqueued += 1
+            return
+        except Queue.Full:
+            pass
+
+        if self.overflow == 'drop_oldest':
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+            except Queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(message)
+                self.enqueued += 1
+            except Queue.Full:
+                self.dropped += 1
+        else:
+            self._spill(message)
+
+    def _spill(self, message):
+        """
+        Append a message that didn't fit in the queue to the spill file.
+        """
+        self._spillLock.acquire()
+        try:
+            if self._spillOut is None:
+                # nothing is waiting in the file; start it over
+                self._spillOut = open(self.spill_file, 'wb')
+                self._spillIn = open(self.spill_file, 'rb')
+            self._spillOut.write(message)
+            self._spillOut.flush()
+            self.spilled += 1
+            self._unspilled += 1
+        finally:
+            self._spillLock.release()
+
+    def _unspill(self):
+        """
+        Returns the next message from the spill file, or None if every spilled
+        message has been read back.
+        """
+        if not self._unspilled:
+            return None
+        self._spillLock.acquire()
+        try:
+            if not self._unspilled:
+                return None
+            self._unspilled -= 1
+            message = self._spillIn.readline()
+            if not self._unspilled:
+                # all read back; don't let the file grow for the whole run
+                self._spillOut.truncate(0)
+                self._closeSpill()
+        finally:
+            self._spillLock.release()
+        if self.wrap is not None:
+            message = self.wrap(message)
+        return message
+
+    def _closeSpill(self):
+        """
+        Close the spill file's handles; the next spill starts it over.
+        """
+        if self._spillOut is not None:
+            self._spillOut.close()
+            self._spillIn.close()
+            self._spillOut = None
+            self._spillIn = None
+
+    def _work(self):
+        """
+        Worker thread body: run dataFunction over queued messages until told
+        to stop.
+        """
+        # in spill mode, wake up regularly to check the spill file
+        timeout = None
+        if self.overflow == 'spill':
+            timeout = 0.1
+
+        while True:
+            try:
+                if self._unspilled:
+                    # don't wait on the queue while spilled messages remain
+                    message = self._queue.get_nowait()
+                else:
+                    message = self._queue.get(True, timeout)
+            except Queue.Empty:
+                message = self._unspill()
+                if message is None:
+                    continue
+
+            if message is _STOP:
+                # spilled messages count as queued too
+                message = self._unspill()
+                while message is not None:
+                    self._handle(message)
+                    message = self._unspill()
+                return
+
+            self._handle(message)
+
+    def _handle(self, message):
+        """
+        Run dataFunction over one message, counting it.
+        """
+        try:
+            self.dataFunction(message)
+        except Exception:
+            self.errors += 1
+            print >> sys.stderr, 'tweetwatch.pipeline.Pipeline error: exception in dataFunction'
+            traceback.print_exc()
+        self.processed += 1
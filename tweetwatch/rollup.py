@@ -0,0 +1,402 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+#   Per-minute counters kept by the collector as it runs (tweets per search
+#   term, language and time zone, messages by type, tweets missed to rate
+#   limits, errors), summed into hours and days, and appended to a compact
+#   binary file that a report can read back in milliseconds instead of
+#   replaying the capture.
+#
+#   File format
+#   -----------
+#   The file starts with MAGIC and is a sequence of records:
+#
+#   'K' id (uint32) length (uint16) key   a key: JSON [field, value], UTF-8
+#   'M', 'H' or 'D' bucket (uint32) n (uint32) n * (key id, count) (uint32s)
+#                                         counts for one minute, hour or day,
+#                                         numbered from the Unix epoch
+#
+#   All integers are little-endian. Records are only ever appended, and the
+#   counts of every record for the same bucket and key add up, so a bucket
+#   written in parts (late tweets, a restarted collector) reads back whole. A
+#   record cut short by a crash is ignored.
+
+import os
+import time
+import struct
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+from tweetwatch.message import Message
+from tweetwatch.match import TrackMatcher
+from tweetwatch.snowflake import snowflake2time
+from tweetwatch.sketches import RESOLUTIONS
+
+
+MAGIC = 'TWROLLUP\x01\n'
+
+# the fields counted by default
+FIELDS = ('kind', 'term', 'lang', 'time_zone', 'limit', 'error')
+
+# resolution -> record type, and back
+_TYPES = {'minute': 'M', 'hour': 'H', 'day': 'D'}
+_RESOLUTIONS = dict((t, r) for r, t in _TYPES.iteritems())
+_SECONDS = dict(RESOLUTIONS)
+
+_KEY = struct.Struct('<IH')
+_BLOCK = struct.Struct('<II')
+_COUNT = struct.Struct('<II')
+
+
+
+def _read(f, resolutions=None):
+    """
+    Read a rollup file. Returns the key table ({id: (field, value)}),
+    {resolution: {bucket: {id: count}}} for the given resolutions (default
+    all; the blocks of other resolutions are skipped over, not read), and the
+    offset just past the last complete record.
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('tweetwatch.rollup error: %s is not a rollup file' % f.name)
+    if resolutions is None:
+        resolutions = _TYPES.keys()
+    size = os.fstat(f.fileno()).st_size
+    keys = {}
+    data = dict((r, {}) for r in resolutions)
+    end = f.tell()
+    while True:
+        kind = f.read(1)
+        if kind == 'K':
+            head = f.read(_KEY.size)
+            if len(head) < _KEY.size:
+                break
+            i, length = _KEY.unpack(head)
+            raw = f.read(length)
+            if len(raw) < length:
+                break
+            keys[i] = tuple(json.loads(raw.decode('utf-8')))
+            end = f.tell()
+        elif kind in _RESOLUTIONS:
+            head = f.read(_BLOCK.size)
+            if len(head) < _BLOCK.size:
+                break
+            bucket, n = _BLOCK.unpack(head)
+            resolution = _RESOLUTIONS[kind]
+            if not resolution in data:
+                f.seek(n * _COUNT.size, os.SEEK_CUR)
+                if f.tell() > size:
+                    break
+                end = f.tell()
+                continue
+            raw = f.read(n * _COUNT.size)
+            if len(raw) < n * _COUNT.size:
+                break
+            end = f.tell()
+            counts = data[resolution].setdefault(bucket, {})
+            values = struct.unpack('<%dI' % (2 * n), raw)
+            for j in range(0, 2 * n, 2):
+                counts[values[j]] = counts.get(values[j], 0) + values[j + 1]
+        else:
+            # end of the file, or a record cut short
+            break
+    return keys, data, end
+
+
+
+###############################################################################
+# Writer                                                                      #
+###############################################################################
+class RollupWriter:
+    def __init__(self, path, searchTerms=None, fields=FIELDS, grace=2):
+        """
+        Count messages into per-minute, per-hour and per-day buckets, and
+        append each bucket to a rollup file once it is complete. Pass the
+        writer to Stream(observers=[...]), or call it with each message.
+
+        Tweets are counted in the minute of their IDs and other messages in
+        the minute they arrive. A minute is written once the stream has moved
+        'grace' minutes past it, and an hour or day once all of its minutes
+        have been. Tweets that turn up even later are written as extra
+        records for their bucket. An existing file is appended to.
+
+        What is counted (each field can be turned off with fields):
+
+        'kind'      every message by type: tweet, limit, delete, warning, ...
+        'term'      tweets by each search term they match (needs searchTerms)
+        'lang'      tweets by language
+        'time_zone' tweets by their author's time zone
+        'limit'     tweets missed to rate limits: the increase in a limit
+                    notice's running total (one writer per connection; a
+                    writer shared by a StreamGroup sees the totals of all
+                    shards mixed together)
+        'error'     tweetwatch_error records by type (e.g. 'HTTP 420 - http
+                    rate limit' or 'network')
+
+        REQUIRED INPUT:
+
+        path (string) - The rollup file.
+
+        OPTIONAL INPUT:
+
+        searchTerms (string) - The comma-separated terms given to Stream.
+            The default value is None.
+
+        fields (list) - The fields to count. The default is all of them.
+
+        grace (int) - Minutes to wait for late tweets before writing a
+            minute. The default value is 2.
+
+        ***EXAMPLE***
+
+        rollup = RollupWriter('sochi-rollup', searchTerms)
+        S = tweetwatch.stream.Stream(apiToken, searchTerms, dataFunction,
+                observers=[rollup])
+        try:
+            S.start()
+        finally:
+            rollup.close()
+        """
+        for field in fields:
+            if not field in FIELDS:
+                raise ValueError('tweetwatch.rollup.RollupWriter error: unknown field %r' % field)
+        self.path = path
+        self.fields = frozenset(fields)
+        self.grace = grace
+        self.matcher = None
+        if searchTerms and 'term' in self.fields:
+            self.matcher = TrackMatcher(searchTerms)
+
+        # (field, value) -> key id; carried on from the file if it exists
+        self._ids = {}
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as f:
+                keys, data, end = _read(f, [])
+            self._ids = dict((key, i) for i, key in keys.iteritems())
+            self._file = open(path, 'r+b')
+            # drop a record left incomplete by a crash before appending
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(MAGIC)
+            self._file.flush()
+
+        # resolution -> bucket -> key id -> count, for buckets not written
+        self._open = dict((r, {}) for r, seconds in RESOLUTIONS)
+        self._newest = None
+        # the last limit notice's running total
+        self._track = 0
+
+    def _id(self, field, value):
+        """
+        Returns the id of a key, appending it to the file if it is new.
+        """
+        key = (field, value)
+        i = self._ids.get(key)
+        if i is None:
+            i = self._ids[key] = len(self._ids)
+            raw = json.dumps(key, ensure_ascii=False)
+            if isinstance(raw, unicode):
+                raw = raw.encode('utf-8')
+            self._file.write('K' + _KEY.pack(i, len(raw)) + raw)
+        return i
+
+    def count(self, field, value, n=1, timestamp=None):
+        """
+        Add n to (field, value) in the minute of timestamp (default now).
+        """
+        if not timestamp:
+            timestamp = time.time()
+        minute = int(timestamp) // 60
+        counts = self._open['minute'].get(minute)
+        if counts is None:
+            counts = self._open['minute'][minute] = {}
+        i = self._id(field, value)
+        counts[i] = counts.get(i, 0) + n
+        self._advance(max(minute, int(time.time()) // 60))
+
+    def __call__(self, message):
+        """
+        Count one message.
+        """
+        if not isinstance(message, Message):
+            message = Message(message)
+        kind = message.kind
+        if kind == 'keepalive':
+            self._advance(int(time.time()) // 60)
+            return
+        fields = self.fields
+
+        timestamp = None
+        if kind == 'tweet' and message.id:
+            timestamp = snowflake2time(message.id)
+        if 'kind' in fields:
+            self.count('kind', kind, 1, timestamp)
+
+        if kind == 'tweet':
+            if self.matcher is not None:
+                terms = self.matcher.terms
+                for i in self.matcher.matchText(message.text or u''):
+                    self.count('term', terms[i], 1, timestamp)
+            if 'lang' in fields:
+                self.count('lang', message.lang, 1, timestamp)
+            if 'time_zone' in fields:
+                self.count('time_zone', message.time_zone, 1, timestamp)
+        elif kind == 'limit' and 'limit' in fields:
+            track = message.track or 0
+            missed = track - self._track
+            if track < self._track:
+                # a new connection; its count started over
+                missed = track
+            self._track = track
+            if missed:
+                self.count('limit', None, missed)
+        elif kind == 'tweetwatch_error' and 'error' in fields:
+            self.count('error', message.json['tweetwatch_error'].get('type'))
+
+    def _write(self, resolution, bucket, counts):
+        """
+        Append the counts of one bucket to the file.
+        """
+        items = sorted(counts.iteritems())
+        values = []
+        for i, n in items:
+            values.append(i)
+            values.append(n)
+        self._file.write(_TYPES[resolution] + _BLOCK.pack(bucket, len(items)) +
+                         struct.pack('<%dI' % len(values), *values))
+
+    def _advance(self, minute, final=False):
+        """
+        The stream has reached minute: write out the buckets it has moved far
+        enough past (every bucket, if final), and flush the file.
+        """
+        if not final and self._newest is not None and minute <= self._newest:
+            return
+        self._newest = minute
+
+        # each resolution's complete buckets go up into the next one
+        wrote = False
+        for j, (resolution, seconds) in enumerate(RESOLUTIONS):
+            buckets = self._open[resolution]
+            perMinute = seconds // 60
+            for bucket in sorted(buckets):
+                if not final and (bucket + 1) * perMinute + self.grace > minute:
+                    continue
+                counts = buckets.pop(bucket)
+                self._write(resolution, bucket, counts)
+                wrote = True
+                if j + 1 < len(RESOLUTIONS):
+                    upper = RESOLUTIONS[j + 1][1]
+                    target = self._open[RESOLUTIONS[j + 1][0]].setdefault(bucket * seconds // upper, {})
+                    for i, n in counts.iteritems():
+                        target[i] = target.get(i, 0) + n
+        if wrote:
+            self._file.flush()
+
+    def close(self):
+        """
+        Write every bucket, complete or not, and close the file.
+        """
+        self._advance(self._newest or 0, final=True)
+        self._file.close()
+
+
+
+###############################################################################
+# Reader                                                                      #
+###############################################################################
+class RollupReader:
+    def __init__(self, path, resolutions=None):
+        """
+        Read a rollup file written by RollupWriter (even while it is still
+        being written).
+
+        REQUIRED INPUT:
+
+        path (string) - The rollup file.
+
+        OPTIONAL INPUT:
+
+        resolutions (list) - Any of 'minute', 'hour' and 'day'; the blocks of
+            the others are skipped, which makes reading hours or days of a
+            long run fast. The default is all three.
+
+        ***EXAMPLE***
+
+        rollup = RollupReader('sochi-rollup', ['hour'])
+        rollup.series('term', u'sochi', 'hour')
+            --> [(1391990400, 40213), (1391994000, 39872), ...]
+        rollup.totals('time_zone', 'hour', start=1391990400, end=1392076800)
+            --> {u'Moscow': 91210, None: 402177, ...}
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self.keys, self.data, end = _read(f, resolutions)
+        self._ids = dict((key, i) for i, key in self.keys.iteritems())
+
+    def _buckets(self, resolution, start, end):
+        """
+        Yields (start of bucket as a Unix timestamp, {key id: count}) for the
+        buckets of a resolution from start (inclusive) to end (exclusive).
+        """
+        if not resolution in self.data:
+            raise KeyError('tweetwatch.rollup.RollupReader error: %s buckets were not read' % resolution)
+        seconds = _SECONDS[resolution]
+        for bucket, counts in sorted(self.data[resolution].iteritems()):
+            t = bucket * seconds
+            if start is not None and t < start:
+                continue
+            if end is not None and t >= end:
+                break
+            yield t, counts
+
+    def series(self, field, value=None, resolution='minute', start=None, end=None):
+        """
+        Returns [(start of bucket as a Unix timestamp, count)] of (field,
+        value), for the buckets from start to end (Unix timestamps; default
+        all) that counted it.
+        """
+        i = self._ids.get((field, value))
+        if i is None:
+            return []
+        return [(t, counts[i]) for t, counts in self._buckets(resolution, start, end) if i in counts]
+
+    def totals(self, field, resolution='hour', start=None, end=None):
+        """
+        Returns {value: count} over the buckets from start to end for every
+        value of field.
+        """
+        ids = dict((i, key[1]) for i, key in self.keys.iteritems() if key[0] == field)
+        totals = {}
+        for t, counts in self._buckets(resolution, start, end):
+            for i, n in counts.iteritems():
+                if i in ids:
+                    totals[ids[i]] = totals.get(ids[i], 0) + n
+        return totals
+
+    def values(self, field):
+        """
+        Returns the values counted for field.
+        """
+        return [key[1] for key in self.keys.itervalues() if key[0] == field]
@@ -0,0 +1,322 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+import os
+import time
+import threading
+
+from tweetwatch.message import classify
+
+
+
+###############################################################################
+# Rotating file                                                               #
+###############################################################################
+class RotatingFile:
+    def __init__(self, pattern, rotate='hour', max_bytes=None, buffer_size=1048576,
+            flush_interval=1.0, flush_bytes=262144, fsync=False, atomic=False):
+        """
+        An append-only file that stays open between writes, buffers its output
+        and starts a new file every hour (or day, or every max_bytes bytes).
+
+        REQUIRED INPUT:
+
+        pattern (string) - The file name, with optional %-style fields filled
+            in from the current GMT time: %(year)d, %(mon)d, %(mday)d and
+            %(hour)d. Fields are not zero-padded, matching the file names of
+            the examples.
+
+            ***EXAMPLE***
+
+            pattern = 'sochi%(year)d-%(mon)d-%(mday)d-%(hour)d-tweets'
+
+        OPTIONAL INPUT:
+
+        rotate (string) - One of 'hour', 'day', or None (never rotate on time).
+            The default value is 'hour'.
+
+        max_bytes (int) - When set, a file that reaches this size is closed and
+            writing continues in pattern + '.1', '.2', and so on. The default
+            value is None.
+
+        buffer_size (int) - Size of the write buffer in bytes. The default
+            value is 1048576 (1 MB).
+
+        flush_interval (float) - Seconds between group commits: buffered data
+            is flushed (and optionally fsync'ed) once it is this old, by the
+            next write or, while the stream is quiet, by a background timer
+            thread (which also closes the file once its hour or day is over).
+            None flushes by size only and starts no thread. The default value
+            is 1.0.
+
+        flush_bytes (int) - Flush as soon as this many bytes have been written
+            since the last flush. The default value is 262144 (256 KB).
+
+        fsync (bool) - When True, every flush is followed by os.fsync. The
+            default value is False.
+
+        atomic (bool) - When True, the current file is written as name +
+            '.tmp' and renamed to its name once it is closed, so a file under
+            its final name is always complete. Sequence numbers of finished
+            files that already exist are skipped rather than appended to.
+            Leave it False for readers that follow the current hour's file as
+            it grows (e.g. tweetwatch.analysis.runIncremental). The default
+            value is False.
+
+        A message is always written whole to a single file; the old file is
+        flushed, synced and closed (and, if atomic, renamed) before the next
+        one is opened.
+        """
+        if not rotate in ['hour', 'day', None]:
+            raise ValueError("tweetwatch.sinks.RotatingFile error: rotate must be 'hour', 'day', or None")
+        if max_bytes is not None and (not isinstance(max_bytes, int) or max_bytes <= 0):
+            raise ValueError('tweetwatch.sinks.RotatingFile error: max_bytes must be a positive integer')
+
+        self.pattern = pattern
+        self.rotate = rotate
+        self.max_bytes = max_bytes
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self.atomic = atomic
+
+        # seconds covered by one file
+        if rotate == 'hour':
+            self._period = 3600
+        elif rotate == 'day':
+            self._period = 86400
+        else:
+            self._period = None
+
+        # the file's final name, and the path being written (name + '.tmp'
+        # when atomic)
+        self.name = None
+        self.path = None
+        self._file = None
+        self._periodKey = None
+        self._seq = 0
+        self._size = 0
+        self._unflushed = 0
+        self._lastFlush = time.time()
+
+        # writes may come from several pipeline workers at once
+        self._lock = threading.Lock()
+
+        # the interval flush timer, running while a file is open
+        self._timer = None
+        self._stopTimer = threading.Event()
+
+    def _nameFor(self, now):
+        """
+        Returns the file name for the given Unix timestamp.
+        """
+        t = time.gmtime(now)
+        name = self.pattern % {'year': t.tm_year, 'mon': t.tm_mon, 'mday': t.tm_mday,
+                'hour': t.tm_hour}
+        if self._seq:
+            name += '.%d' % self._seq
+        return name
+
+    def _open(self, now):
+        """
+        Close the current file, if any, and open the one for now.
+        """
+        self._close()
+        self.name = self._nameFor(now)
+        self.path = self.name
+        if self.atomic:
+            # never append to a file that has been finished
+            while os.path.exists(self.name):
+                self._seq += 1
+                self.name = self._nameFor(now)
+            self.path = self.name + '.tmp'
+        self._file = open(self.path, 'ab', self.buffer_size)
+        self._size = os.path.getsize(self.path)
+        if self.flush_interval and self._timer is None:
+            self._stopTimer.clear()
+            self._timer = threading.Thread(target=self._tick, name='tweetwatch-flush')
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _close(self):
+        """
+        Flush, sync and close the current file.
+        """
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._unflushed = 0
+            if self.atomic:
+                os.rename(self.path, self.name)
+
+    def _tick(self):
+        """
+        Timer thread body: flush data that has waited flush_interval seconds,
+        and close a file whose hour or day is over, while no writes come in.
+        """
+        while not self._stopTimer.wait(self.flush_interval):
+            self._lock.acquire()
+            try:
+                if self._file is None:
+                    continue
+                now = time.time()
+                if self._period and int(now) // self._period != self._periodKey:
+                    self._close()
+                elif self._unflushed and now - self._lastFlush >= self.flush_interval:
+                    self._flush(now)
+            finally:
+                self._lock.release()
+
+    def _flush(self, now):
+        """
+        Group commit: push buffered data to the operating system.
+        """
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._unflushed = 0
+        self._lastFlush = now
+
+    def write(self, data):
+        """
+        Append data to the current file, rotating first if needed.
+        """
+        now = time.time()
+        self._lock.acquire()
+        try:
+            if self._period:
+                key = int(now) // self._period
+                if key != self._periodKey:
+                    self._periodKey = key
+                    self._seq = 0
+                    self._open(now)
+            if self._file is None:
+                self._open(now)
+            elif self.max_bytes and self._size and self._size + len(data) > self.max_bytes:
+                self._seq += 1
+                self._open(now)
+
+            self._file.write(data)
+            self._size += len(data)
+            self._unflushed += len(data)
+
+            if self._unflushed >= self.flush_bytes or (self.flush_interval is not None
+                    and now - self._lastFlush >= self.flush_interval):
+                self._flush(now)
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        """
+        Flush buffered data now, e.g. from a timer while the stream is quiet.
+        """
+        self._lock.acquire()
+        try:
+            if self._file is not None:
+                self._flush(time.time())
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        Flush and close the file, and stop the timer thread. A later write
+        opens the file again.
+        """
+        self._lock.acquire()
+        try:
+            self._close()
+            timer = self._timer
+            self._timer = None
+            self._stopTimer.set()
+        finally:
+            self._lock.release()
+        if timer is not None and timer is not threading.current_thread():
+            timer.join()
+
+
+
+###############################################################################
+# Message router                                                              #
+###############################################################################
+class Sink:
+    def __init__(self, prefix, **options):
+        """
+        Route streaming API messages to separate rotating files by type:
+
+            prefix + 'tweets'       tweets
+            prefix + 'rate-limit'   {"limit": ...} notices
+            prefix + 'errors'       tweetwatch_error records and anything that
+                                    isn't a JSON object
+            prefix + 'other'        deletes, stall warnings, disconnects, etc.
+
+        prefix may use the same time fields as RotatingFile, and any other
+        keyword arguments are passed on to each RotatingFile. A Sink can be
+        handed to tweetwatch.stream.Stream directly as its dataFunction.
+
+        ***EXAMPLE***
+
+        sink = Sink('sochi%(year)d-%(mon)d-%(mday)d-%(hour)d-')
+        """
+        self.files = {
+            'tweet': RotatingFile(prefix + 'tweets', **options),
+            'limit': RotatingFile(prefix + 'rate-limit', **options),
+            'tweetwatch_error': RotatingFile(prefix + 'errors', **options),
+            'other': RotatingFile(prefix + 'other', **options)
+        }
+
+    def _route(self, message):
+        """
+        Returns the key of self.files a message belongs in, judging by its
+        first key only.
+        """
+        # tweetwatch.message.Message objects already know their type
+        kind = getattr(message, 'kind', None) or classify(message)
+        if kind == 'tweet' or kind == 'limit' or kind == 'tweetwatch_error':
+            return kind
+        if kind == 'unknown':
+            return 'tweetwatch_error'
+        return 'other'
+
+    def write(self, message):
+        """
+        Write a message to the file for its type.
+        """
+        self.files[self._route(message)].write(message)
+
+    __call__ = write
+
+    def flush(self):
+        """
+        Flush all files.
+        """
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        """
+        Flush and close all files.
+        """
+        for f in self.files.values():
+            f.close()
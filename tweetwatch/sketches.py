@@ -0,0 +1,908 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+#   Fixed-memory summaries of open-ended vocabularies (hashtags, words, users,
+#   URLs) for "top 50 in the last 5 minutes" while a stream runs.
+#
+#   SpaceSaving     the k most frequent keys, with counts that are never too
+#                   low and too high by at most total / k
+#   CountMinSketch  the count of any key, never too low and too high by at
+#                   most about 2.7 * total / width with high probability
+#   Windowed        a ring of either, one per span of time, merged on demand
+#                   for a sliding window
+#   HyperLogLog     the number of distinct keys, within about 1.04 / sqrt(2^p)
+#                   in 2^p bytes
+#   TweetSketches   Windowed sketches of hashtags, words, authors and URLs,
+#                   fed from the Stream message path (Stream(observers=...))
+#   DistinctCounts  HyperLogLog counts of distinct authors and tweets per
+#                   minute, hour and day, by search term and time zone
+#
+#   Every sketch can be merged with another of the same shape and pickled, so
+#   sketches built by several processes (or saved to disk) can be combined.
+
+import re
+import time
+import math
+import zlib
+import heapq
+import struct
+import pickle
+import hashlib
+from array import array
+from bisect import bisect_left
+from itertools import izip
+
+from tweetwatch.message import Message
+from tweetwatch.match import TrackMatcher
+from tweetwatch.snowflake import snowflake2time
+
+
+
+def _hashes(key):
+    """
+    Returns two independent 64 bit hashes of key (a string, or unicode which
+    is hashed as UTF-8). The hashes don't depend on the process, so sketches
+    built in different processes can be merged.
+    """
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return struct.unpack('<QQ', hashlib.md5(key).digest())
+
+
+
+###############################################################################
+# Space-Saving                                                                #
+# --------------------------------------------------------------------------- #
+# Keys are kept in buckets by count, so that adding one to a key and finding  #
+# the key with the smallest count are both constant time                      #
+###############################################################################
+class SpaceSaving:
+    def __init__(self, k=100):
+        """
+        The (approximate) k most frequent keys of a stream, in O(k) memory.
+        Once k keys are held, a new key replaces the one with the smallest
+        count and takes over that count, remembered as its error. A count is
+        never lower than the true count, nor higher by more than its error.
+
+        OPTIONAL INPUT:
+
+        k (int) - Number of keys to keep. Keep a few times more than you will
+            read back (top(50) from k=200) for accurate counts at the bottom of
+            the list. The default value is 100.
+
+        ***EXAMPLE***
+
+        top = SpaceSaving(200)
+        for tag in hashtags:
+            top.add(tag)
+        top.top(3)
+            --> [(u'sochi2014', 9331, 0), (u'olympics', 5120, 0), ...]
+        """
+        if not isinstance(k, int) or k <= 0:
+            raise ValueError('tweetwatch.sketches.SpaceSaving error: k must be a positive integer')
+        self.k = k
+        self.total = 0
+
+        # key -> count, key -> overestimate, count -> set of keys with it
+        self._counts = {}
+        self._errors = {}
+        self._buckets = {}
+        self._min = 0
+
+    def add(self, key, count=1):
+        """
+        Count key count (a positive integer) more times.
+        """
+        if count <= 0:
+            return
+        self.total += count
+        counts = self._counts
+        buckets = self._buckets
+        c = counts.get(key)
+        if c is None:
+            if len(counts) < self.k:
+                c = 0
+                self._errors[key] = 0
+            else:
+                # take over the slot of a key with the smallest count
+                c = self._min
+                bucket = buckets[c]
+                old = bucket.pop()
+                if not bucket:
+                    del buckets[c]
+                del counts[old]
+                del self._errors[old]
+                self._errors[key] = c
+        else:
+            bucket = buckets[c]
+            bucket.remove(key)
+            if not bucket:
+                del buckets[c]
+
+        n = c + count
+        counts[key] = n
+        bucket = buckets.get(n)
+        if bucket is None:
+            buckets[n] = set([key])
+        else:
+            bucket.add(key)
+
+        m = self._min
+        if n < m:
+            self._min = n
+        elif not m in buckets:
+            # the smallest bucket emptied; by one, the key moved to the next
+            if count == 1:
+                self._min = m + 1
+            else:
+                self._min = min(buckets)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def __len__(self):
+        return len(self._counts)
+
+    def estimate(self, key):
+        """
+        Returns the count of key, or 0 if it isn't held (its true count is
+        then at most the smallest count held).
+        """
+        return self._counts.get(key, 0)
+
+    def top(self, n=None):
+        """
+        Returns the n (default all k) most frequent keys as a list of (key,
+        count, error) tuples, most frequent first.
+        """
+        if n is None:
+            n = len(self._counts)
+        best = heapq.nlargest(n, self._counts.iteritems(), key=lambda kc: kc[1])
+        return [(key, c, self._errors[key]) for key, c in best]
+
+    def merge(self, other):
+        """
+        Add the counts of another SpaceSaving into this one. A key held by
+        only one of the two is counted as the other's smallest count (the
+        most it can have had there), and the k largest counts are kept.
+        """
+        floors = []
+        for s in [self, other]:
+            if len(s._counts) >= s.k:
+                floors.append(s._min)
+            else:
+                floors.append(0)
+
+        merged = {}
+        for key in set(self._counts) | set(other._counts):
+            count = error = 0
+            for s, floor in zip([self, other], floors):
+                if key in s._counts:
+                    count += s._counts[key]
+                    error += s._errors[key]
+                else:
+                    count += floor
+                    error += floor
+            merged[key] = (count, error)
+
+        kept = heapq.nlargest(self.k, merged.iteritems(), key=lambda kv: kv[1][0])
+        self._counts = {}
+        self._errors = {}
+        self._buckets = {}
+        for key, (count, error) in kept:
+            self._counts[key] = count
+            self._errors[key] = error
+            self._buckets.setdefault(count, set()).add(key)
+        self._min = 0
+        if self._buckets:
+            self._min = min(self._buckets)
+        self.total += other.total
+
+
+
+###############################################################################
+# Count-Min sketch                                                            #
+###############################################################################
+class CountMinSketch:
+    def __init__(self, width=2048, depth=4):
+        """
+        The count of any key in width * depth counters: each key adds to one
+        counter in each of depth rows, and its count is read as the smallest
+        of them. Collisions only ever add, so a count is never too low; with
+        probability 1 - exp(-depth) it is too high by no more than
+        e * total / width.
+
+        OPTIONAL INPUT:
+
+        width (int) - Counters per row. The default value is 2048.
+
+        depth (int) - Number of rows. The default value is 4.
+
+        ***EXAMPLE***
+
+        cms = CountMinSketch()
+        cms.add('sochi')
+        cms.estimate('sochi')
+            --> 1
+        """
+        for name, value in [('width', width), ('depth', depth)]:
+            if not isinstance(value, int) or value <= 0:
+                raise ValueError('tweetwatch.sketches.CountMinSketch error: %s must be a positive integer' % name)
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self._table = array('l', [0]) * (width * depth)
+
+    def _cells(self, key):
+        """
+        Returns the index of key's counter in each row.
+        """
+        h1, h2 = _hashes(key)
+        w = self.width
+        return [i * w + (h1 + i * h2) % w for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """
+        Count key count more times.
+        """
+        self.total += count
+        table = self._table
+        for i in self._cells(key):
+            table[i] += count
+
+    def estimate(self, key):
+        """
+        Returns the count of key (possibly too high; never too low).
+        """
+        table = self._table
+        return min(table[i] for i in self._cells(key))
+
+    def merge(self, other):
+        """
+        Add the counts of another CountMinSketch of the same width and depth
+        into this one.
+        """
+        if other.width != self.width or other.depth != self.depth:
+            raise ValueError('tweetwatch.sketches.CountMinSketch.merge error: sketches differ in shape')
+        table = self._table
+        for i, v in enumerate(other._table):
+            if v:
+                table[i] += v
+        self.total += other.total
+
+
+
+###############################################################################
+# Sliding windows                                                             #
+###############################################################################
+class Windowed:
+    def __init__(self, sketch, window=300, span=60, **options):
+        """
+        A sketch over a sliding window of time, kept as one sub-sketch per
+        span seconds. Adding goes to the current span's sub-sketch; reading
+        merges the sub-sketches of the last window seconds into a new sketch.
+
+        REQUIRED INPUT:
+
+        sketch (class) - The class of the sub-sketches (SpaceSaving or
+            CountMinSketch), made with sketch(**options).
+
+        OPTIONAL INPUT:
+
+        window (int) - Seconds covered, counting the current (partial) span.
+            The default value is 300.
+
+        span (int) - Seconds per sub-sketch; the window slides by this much.
+            The default value is 60.
+
+        ***EXAMPLE***
+
+        tags = Windowed(SpaceSaving, window=300, span=60, k=200)
+        tags.add(u'sochi2014')
+        tags.top(50)
+        """
+        for name, value in [('window', window), ('span', span)]:
+            if not isinstance(value, int) or value <= 0:
+                raise ValueError('tweetwatch.sketches.Windowed error: %s must be a positive integer' % name)
+        self.sketch = sketch
+        self.options = options
+        self.window = window
+        self.span = span
+        self.spans = max(1, -(-window // span))
+
+        # span number -> sub-sketch; the newest span seen
+        self._sketches = {}
+        self._newest = None
+
+    def current(self, timestamp=None):
+        """
+        Returns the sub-sketch for timestamp (default now), making room for it
+        if it is the newest yet, or None if it has already slid out.
+        """
+        if not timestamp:
+            timestamp = int(time.time())
+        i = int(timestamp) // self.span
+        if self._newest is None or i > self._newest:
+            self._newest = i
+            for old in [k for k in self._sketches if k <= i - self.spans]:
+                del self._sketches[old]
+        elif i <= self._newest - self.spans:
+            return None
+        s = self._sketches.get(i)
+        if s is None:
+            s = self._sketches[i] = self.sketch(**self.options)
+        return s
+
+    def add(self, key, count=1, timestamp=None):
+        """
+        Count key count more times at timestamp (default now).
+        """
+        s = self.current(timestamp)
+        if s is not None:
+            s.add(key, count)
+
+    def merged(self, timestamp=None):
+        """
+        Returns a new sketch of the window ending at timestamp (default now).
+        """
+        if not timestamp:
+            timestamp = int(time.time())
+        newest = int(timestamp) // self.span
+        merged = self.sketch(**self.options)
+        for i, s in self._sketches.iteritems():
+            if newest - self.spans < i <= newest:
+                merged.merge(s)
+        return merged
+
+    def top(self, n=None, timestamp=None):
+        """
+        Shortcut for merged(timestamp).top(n), for SpaceSaving sub-sketches.
+        """
+        return self.merged(timestamp).top(n)
+
+    def estimate(self, key, timestamp=None):
+        """
+        Returns the count of key over the window ending at timestamp (default
+        now), adding up the sub-sketches without merging them.
+        """
+        if not timestamp:
+            timestamp = int(time.time())
+        newest = int(timestamp) // self.span
+        return sum(s.estimate(key) for i, s in self._sketches.iteritems()
+                   if newest - self.spans < i <= newest)
+
+    def merge(self, other):
+        """
+        Merge in another Windowed sketch with the same span, sub-sketch by
+        sub-sketch (spans are numbered from the Unix epoch, so they line up
+        across processes).
+        """
+        if other.span != self.span:
+            raise ValueError('tweetwatch.sketches.Windowed.merge error: spans differ')
+        for i, s in sorted(other._sketches.iteritems()):
+            mine = self.current(i * self.span)
+            if mine is not None:
+                mine.merge(s)
+
+
+
+###############################################################################
+# Stream observer                                                             #
+###############################################################################
+_URL = re.compile(r'https?://\S+')
+_TOKEN = re.compile(r'[#@]?\w+', re.UNICODE)
+
+FIELDS = ('hashtags', 'words', 'users', 'urls')
+
+
+class TweetSketches:
+    def __init__(self, window=300, span=60, k=200, width=2048, depth=4, fields=FIELDS,
+            minWordLength=3):
+        """
+        Sliding-window sketches of the hashtags, words, authors (screen names)
+        and URLs of every tweet, for Stream(observers=[...]). Each field gets
+        a Windowed SpaceSaving for its top keys and, if width is not None, a
+        Windowed CountMinSketch for the count of any key. Hashtags and words
+        are lowercased; URLs are as they appear in the text (t.co links).
+
+        OPTIONAL INPUT:
+
+        window, span (int) - See Windowed. The defaults are 300 and 60.
+
+        k (int) - Keys kept per field and span; see SpaceSaving. The default
+            value is 200.
+
+        width, depth (int) - See CountMinSketch; width=None keeps top keys
+            only. The defaults are 2048 and 4.
+
+        fields (list) - Any of 'hashtags', 'words', 'users' and 'urls'. The
+            default is all four.
+
+        minWordLength (int) - Shorter words are skipped. The default value
+            is 3.
+
+        ***EXAMPLE***
+
+        sketches = TweetSketches()
+        S = tweetwatch.stream.Stream(apiToken, 'sochi', dataFunction,
+                observers=[sketches])
+        ...
+        sketches.top('hashtags', 50)
+        """
+        for field in fields:
+            if not field in FIELDS:
+                raise ValueError('tweetwatch.sketches.TweetSketches error: unknown field %r' % field)
+        self.fields = tuple(fields)
+        self.minWordLength = minWordLength
+        self.tweets = 0
+
+        self.heavy = {}
+        self.counts = {}
+        for field in self.fields:
+            self.heavy[field] = Windowed(SpaceSaving, window, span, k=k)
+            if width is not None:
+                self.counts[field] = Windowed(CountMinSketch, window, span, width=width, depth=depth)
+
+    def _keys(self, message):
+        """
+        Returns a dictionary of the keys of each field in a tweet.
+        """
+        keys = {}
+        if 'users' in self.fields:
+            keys['users'] = [message.screen_name]
+        text = message.text or u''
+        if 'urls' in self.fields:
+            keys['urls'] = _URL.findall(text)
+        if 'hashtags' in self.fields or 'words' in self.fields:
+            hashtags = []
+            words = []
+            for token in _TOKEN.findall(_URL.sub(u' ', text).lower()):
+                if token[0] == u'#':
+                    hashtags.append(token[1:])
+                elif token[0] != u'@' and len(token) >= self.minWordLength:
+                    words.append(token)
+            keys['hashtags'] = hashtags
+            keys['words'] = words
+        return keys
+
+    def __call__(self, message):
+        """
+        Count a message's keys if it is a tweet; anything else is ignored.
+        """
+        if not isinstance(message, Message):
+            message = Message(message)
+        if message.kind != 'tweet':
+            return
+        self.tweets += 1
+        now = int(time.time())
+        keys = self._keys(message)
+        for field in self.fields:
+            heavy = self.heavy[field].current(now)
+            if heavy is None:
+                # the clock stepped back past the window
+                continue
+            counts = self.counts.get(field)
+            if counts is not None:
+                counts = counts.current(now)
+            for key in keys[field]:
+                if key is None:
+                    continue
+                heavy.add(key)
+                if counts is not None:
+                    counts.add(key)
+
+    def top(self, field, n=50):
+        """
+        Returns the n most frequent keys of field over the window, as (key,
+        count, error) tuples.
+        """
+        return self.heavy[field].top(n)
+
+    def estimate(self, field, key):
+        """
+        Returns the count of one key of field over the window, from the
+        Count-Min sketch if there is one.
+        """
+        if field in self.counts:
+            return self.counts[field].estimate(key)
+        return self.heavy[field].merged().estimate(key)
+
+    def merge(self, other):
+        """
+        Merge in the sketches of another TweetSketches with the same settings.
+        """
+        for field in self.fields:
+            self.heavy[field].merge(other.heavy[field])
+            if field in self.counts:
+                self.counts[field].merge(other.counts[field])
+        self.tweets += other.tweets
+
+
+
+###############################################################################
+# HyperLogLog                                                                 #
+###############################################################################
+# 2 ** -r for every register value r
+_INVERSE_POWERS = [2.0 ** -r for r in range(66)]
+
+
+def _position(h, precision):
+    """
+    Returns the register a 64 bit hash goes to in a HyperLogLog of the given
+    precision, and its rank there (leading zeros of the remaining bits + 1).
+    """
+    bits = 64 - precision
+    return h >> bits, bits - (h & ((1 << bits) - 1)).bit_length() + 1
+
+
+class HyperLogLog:
+    def __init__(self, precision=11):
+        """
+        Counts distinct keys in 2 ** precision one-byte registers, to within
+        about 1.04 / sqrt(2 ** precision) (2.3% at the default precision of
+        11, in 2 KB). Each key's hash picks a register and the register keeps
+        the longest run of leading zero bits seen in the rest of the hash.
+
+        Until a quarter of the registers are in use only those are stored, as
+        a sorted array of register numbers and their values (3 bytes each),
+        so a counter that has seen a few keys takes a few bytes rather than
+        2 KB. Past that the registers are stored in full.
+
+        Two HyperLogLogs of the same precision merge into the count of the
+        union of their keys, so per-minute counts roll up into hours and days.
+        Pickling stores the registers compressed.
+
+        OPTIONAL INPUT:
+
+        precision (int) - 4 to 16. The default value is 11.
+
+        ***EXAMPLE***
+
+        users = HyperLogLog()
+        for tweet in tweets:
+            users.add(tweet.user_id)
+        users.count()
+            --> 48213
+        """
+        if not isinstance(precision, int) or not 4 <= precision <= 16:
+            raise ValueError('tweetwatch.sketches.HyperLogLog error: precision must be from 4 to 16')
+        self.precision = precision
+        # None while sparse; then a bytearray of 2 ** precision registers
+        self.registers = None
+        # while sparse: register numbers in use, in order, and their values
+        self._index = array('H')
+        self._ranks = bytearray()
+
+    def _set(self, i, rank):
+        """
+        Raise register i to rank.
+        """
+        registers = self.registers
+        if registers is not None:
+            if rank > registers[i]:
+                registers[i] = rank
+            return
+        index = self._index
+        j = bisect_left(index, i)
+        if j < len(index) and index[j] == i:
+            if rank > self._ranks[j]:
+                self._ranks[j] = rank
+            return
+        index.insert(j, i)
+        self._ranks.insert(j, rank)
+        if len(index) > (1 << self.precision) // 4:
+            self._densify()
+
+    def _densify(self):
+        """
+        Switch to storing every register.
+        """
+        registers = bytearray(1 << self.precision)
+        for i, rank in izip(self._index, self._ranks):
+            registers[i] = rank
+        self.registers = registers
+        self._index = None
+        self._ranks = None
+
+    def addHash(self, h):
+        """
+        Add a key by its 64 bit hash (see add()).
+        """
+        i, rank = _position(h, self.precision)
+        self._set(i, rank)
+
+    def add(self, key):
+        """
+        Add a key: a string, unicode, or integer (e.g. a user or tweet ID).
+        """
+        if isinstance(key, (int, long)):
+            key = '%d' % key
+        self.addHash(_hashes(key)[0])
+
+    def count(self):
+        """
+        Returns the estimated number of distinct keys added.
+        """
+        m = 1 << self.precision
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        powers = _INVERSE_POWERS
+        if self.registers is None:
+            # empty registers count 2 ** -0 each
+            zeros = m - len(self._index)
+            total = zeros + sum(powers[r] for r in self._ranks)
+        else:
+            zeros = self.registers.count('\0')
+            total = sum(powers[r] for r in self.registers)
+        estimate = alpha * m * m / total
+        if estimate <= 2.5 * m and zeros:
+            # few keys; count the empty registers instead
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        """
+        Add the keys of another HyperLogLog of the same precision.
+        """
+        if other.precision != self.precision:
+            raise ValueError('tweetwatch.sketches.HyperLogLog.merge error: precisions differ')
+        if other.registers is None:
+            for i, rank in izip(other._index, other._ranks):
+                self._set(i, rank)
+            return
+        if self.registers is None:
+            self._densify()
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def __getstate__(self):
+        if self.registers is None:
+            return (self.precision, None, self._index.tostring(), str(self._ranks))
+        return (self.precision, zlib.compress(str(self.registers)))
+
+    def __setstate__(self, state):
+        self.precision = state[0]
+        if state[1] is None:
+            self.registers = None
+            self._index = array('H', state[2])
+            self._ranks = bytearray(state[3])
+        else:
+            self.registers = bytearray(zlib.decompress(state[1]))
+            self._index = None
+            self._ranks = None
+
+
+
+###############################################################################
+# Distinct authors and tweets by time, term and time zone                     #
+###############################################################################
+# resolution -> seconds per bucket
+RESOLUTIONS = [('minute', 60), ('hour', 3600), ('day', 86400)]
+
+# what is counted -> index in a bucket's [authors, tweets] pair
+_WHAT = {'authors': 0, 'tweets': 1}
+
+
+class DistinctCounts:
+    def __init__(self, precision=11, searchTerms=None, timeZones=True, minutes=180,
+            hours=168, days=None):
+        """
+        Distinct authors and distinct tweets per minute, hour and day (GMT, by
+        the time in each tweet's ID), overall, by search term and by the
+        author's time zone, for Stream(observers=[...]). Each bucket holds a
+        pair of HyperLogLogs, so hours and days cost at most a few KB per key
+        no matter how many tweets they saw (much less for keys with few
+        tweets), and buckets from separate runs or processes can be merged.
+        Tweets without an author ID count as tweets but not as authors.
+
+        Minutes, hours and days older than the last 'minutes', 'hours' and
+        'days' are dropped as time moves on. Use save() and load() to keep
+        them on disk.
+
+        OPTIONAL INPUT:
+
+        precision (int) - See HyperLogLog. The default value is 11.
+
+        searchTerms (string) - The comma-separated terms given to Stream, to
+            count by the terms each tweet's text matched (see
+            tweetwatch.match.TrackMatcher). The default value is None (no
+            counts by term).
+
+        timeZones (bool) - Count by the author's time zone. The default value
+            is True.
+
+        minutes (int) - Minutes to keep. The default value is 180.
+
+        hours (int) - Hours to keep, or None for all. The default value is 168
+            (a week).
+
+        days (int) - Days to keep, or None for all. The default value is None.
+
+        ***EXAMPLE***
+
+        distinct = DistinctCounts(searchTerms=searchTerms)
+        S = tweetwatch.stream.Stream(apiToken, searchTerms, dataFunction,
+                observers=[distinct])
+        ...
+        distinct.series('hour', ('term', u'sochi'))
+            --> [(391664, 48213), (391665, 51007), ...]
+        distinct.save('sochi-distinct')
+        """
+        if not isinstance(minutes, int) or minutes <= 0:
+            raise ValueError('tweetwatch.sketches.DistinctCounts error: minutes must be a positive integer')
+        for n in (hours, days):
+            if n is not None and (not isinstance(n, int) or n <= 0):
+                raise ValueError('tweetwatch.sketches.DistinctCounts error: hours and days must be positive integers or None')
+        # raises for a bad precision before any tweets arrive
+        HyperLogLog(precision)
+
+        self.precision = precision
+        self.matcher = None
+        if searchTerms:
+            self.matcher = TrackMatcher(searchTerms)
+        self.timeZones = timeZones
+        self.minutes = minutes
+        self.hours = hours
+        self.days = days
+
+        # resolution -> bucket number -> key -> [authors, tweets]; bucket
+        # numbers count minutes, hours or days since the Unix epoch
+        self.buckets = dict((name, {}) for name, seconds in RESOLUTIONS)
+        # resolution -> buckets kept, and the newest bucket seen
+        self._keep = {'minute': minutes, 'hour': hours, 'day': days}
+        self._newest = dict((name, None) for name, seconds in RESOLUTIONS)
+
+    def _keys(self, message):
+        """
+        Returns the keys a tweet is counted under: None (every tweet), and
+        ('term', term) and ('time_zone', zone) pairs.
+        """
+        keys = [None]
+        if self.matcher is not None:
+            terms = self.matcher.terms
+            for i in self.matcher.matchText(message.text or u''):
+                keys.append(('term', terms[i]))
+        if self.timeZones:
+            keys.append(('time_zone', message.time_zone))
+        return keys
+
+    def __call__(self, message):
+        """
+        Count a message if it is a tweet; anything else is ignored.
+        """
+        if not isinstance(message, Message):
+            message = Message(message)
+        if message.kind != 'tweet':
+            return
+        snowflake = message.id
+        if snowflake is None:
+            return
+        self.add(snowflake, message.user_id, self._keys(message))
+
+    def add(self, snowflake, userID, keys=(None,)):
+        """
+        Count the tweet with ID snowflake, by the author with ID userID (None
+        if unknown), under each of keys.
+        """
+        # the author's and the tweet's register and rank are the same in every
+        # HyperLogLog they go into
+        if userID is not None:
+            a, aRank = _position(_hashes('%d' % userID)[0], self.precision)
+        b, bRank = _position(_hashes('%d' % snowflake)[0], self.precision)
+        t = snowflake2time(snowflake)
+        for name, seconds in RESOLUTIONS:
+            i = t // seconds
+            keep = self._keep[name]
+            if keep is not None:
+                newest = self._newest[name]
+                if newest is None or i > newest:
+                    self._newest[name] = i
+                    buckets = self.buckets[name]
+                    for old in [k for k in buckets if k <= i - keep]:
+                        del buckets[old]
+                elif i <= newest - keep:
+                    continue
+            bucket = self.buckets[name].get(i)
+            if bucket is None:
+                bucket = self.buckets[name][i] = {}
+            for key in keys:
+                pair = bucket.get(key)
+                if pair is None:
+                    pair = bucket[key] = [HyperLogLog(self.precision), HyperLogLog(self.precision)]
+                # inline for registers stored in full, the common case in
+                # busy buckets
+                if userID is not None:
+                    registers = pair[0].registers
+                    if registers is None:
+                        pair[0]._set(a, aRank)
+                    elif aRank > registers[a]:
+                        registers[a] = aRank
+                registers = pair[1].registers
+                if registers is None:
+                    pair[1]._set(b, bRank)
+                elif bRank > registers[b]:
+                    registers[b] = bRank
+
+    def count(self, resolution, bucket, key=None, what='authors'):
+        """
+        Returns the number of distinct authors (what='authors') or tweets
+        (what='tweets') under key in one minute, hour or day (resolution),
+        numbered from the Unix epoch; 0 if nothing was counted there.
+        """
+        pair = self.buckets[resolution].get(bucket, {}).get(key)
+        if pair is None:
+            return 0
+        return pair[_WHAT[what]].count()
+
+    def series(self, resolution, key=None, what='authors'):
+        """
+        Returns [(bucket, count)] for every minute, hour or day counted under
+        key, in time order.
+        """
+        out = []
+        for i, bucket in sorted(self.buckets[resolution].iteritems()):
+            pair = bucket.get(key)
+            if pair is not None:
+                out.append((i, pair[_WHAT[what]].count()))
+        return out
+
+    def keys(self):
+        """
+        Returns the keys counted so far.
+        """
+        keys = set()
+        for buckets in self.buckets.itervalues():
+            for bucket in buckets.itervalues():
+                keys.update(bucket)
+        return keys
+
+    def merge(self, other):
+        """
+        Add the counts of another DistinctCounts of the same precision, e.g.
+        one from an earlier run or another process.
+        """
+        if other.precision != self.precision:
+            raise ValueError('tweetwatch.sketches.DistinctCounts.merge error: precisions differ')
+        for name, seconds in RESOLUTIONS:
+            for i, bucket in other.buckets[name].iteritems():
+                target = self.buckets[name].setdefault(i, {})
+                for key, pair in bucket.iteritems():
+                    mine = target.get(key)
+                    if mine is None:
+                        mine = target[key] = [HyperLogLog(self.precision), HyperLogLog(self.precision)]
+                    mine[0].merge(pair[0])
+                    mine[1].merge(pair[1])
+
+    def save(self, path):
+        """
+        Write the counts to a file (HyperLogLog registers are compressed).
+        """
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """
+        Returns counts written by save().
+        """
+        with open(path, 'rb') as f:
+            return pickle.load(f)
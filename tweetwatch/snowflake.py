@@ -0,0 +1,181 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+#   A snowflake ID holds the time it was generated, in milliseconds since
+#   Twitter's epoch (TWEPOCH), shifted left by 22 bits. Everything here is
+#   integer arithmetic on that; Unix time has no leap seconds, so minutes and
+#   hours of the GMT day come out the same as from time.gmtime.
+
+from array import array
+
+# numpy is optional; the batch functions fall back to plain loops without it
+try: import numpy
+except ImportError:
+    numpy = None
+
+
+# Twitter's epoch in milliseconds since the Unix epoch
+TWEPOCH = 1288834974657
+
+
+
+###############################################################################
+# Scalar functions                                                            #
+###############################################################################
+def snowflake2ms(s):
+    """
+    Returns the Unix time in milliseconds encoded in snowflake ID s.
+    """
+    return (s >> 22) + TWEPOCH
+
+
+def snowflake2time(s):
+    """
+    Returns the Unix timestamp (whole seconds) encoded in snowflake ID s.
+    """
+    return ((s >> 22) + TWEPOCH) // 1000
+
+
+def snowflake2minute(s):
+    """
+    Returns the minute of snowflake ID s as a number of minutes since the Unix
+    epoch. Multiply by 60 for the Unix timestamp of the start of the minute.
+    """
+    return ((s >> 22) + TWEPOCH) // 60000
+
+
+def time2snowflake(t):
+    """
+    Returns the smallest snowflake ID generated at or after Unix timestamp t.
+    """
+    return (int(t * 1000) - TWEPOCH) << 22
+
+
+def time2minute(t):
+    """
+    Returns the minute of the GMT day (0 to 1439) of Unix timestamp t.
+    """
+    return (int(t) // 60) % 1440
+
+
+def time2hour(t):
+    """
+    Returns the hour of the GMT day (0 to 23) of Unix timestamp t.
+    """
+    return (int(t) // 3600) % 24
+
+
+
+###############################################################################
+# Batch functions                                                             #
+# --------------------------------------------------------------------------- #
+# Each takes a numpy integer array, an array.array of 8 byte integers, or any #
+# sequence of IDs. numpy arrays (and array.array, when numpy is installed)    #
+# are processed with whole-array operations; otherwise the result is an       #
+# array.array built in a loop.                                                #
+###############################################################################
+def _int64(ids):
+    """
+    Returns ids as an int64 numpy array without copying when possible, or None
+    without numpy.
+    """
+    if numpy is None:
+        return None
+    if isinstance(ids, numpy.ndarray):
+        return ids.astype(numpy.int64, copy=False)
+    if isinstance(ids, array) and ids.itemsize == 8:
+        return numpy.frombuffer(ids, dtype=numpy.int64)
+    return numpy.asarray(ids, dtype=numpy.int64)
+
+
+def _typecode():
+    """
+    Returns an array.array typecode for 8 byte integers.
+    """
+    if array('l').itemsize == 8:
+        return 'l'
+    raise ValueError('tweetwatch.snowflake error: array.array has no 8 byte integer type; install numpy')
+
+
+def batchMs(ids):
+    """
+    Returns the Unix time in milliseconds of every ID.
+    """
+    a = _int64(ids)
+    if a is not None:
+        return (a >> 22) + TWEPOCH
+    return array(_typecode(), [(s >> 22) + TWEPOCH for s in ids])
+
+
+def batchMinute(ids):
+    """
+    Returns the minute since the Unix epoch of every ID.
+    """
+    a = _int64(ids)
+    if a is not None:
+        return ((a >> 22) + TWEPOCH) // 60000
+    return array(_typecode(), [((s >> 22) + TWEPOCH) // 60000 for s in ids])
+
+
+def batchMinuteOfDay(ids):
+    """
+    Returns the minute of the GMT day (0 to 1439) of every ID.
+    """
+    a = _int64(ids)
+    if a is not None:
+        return (((a >> 22) + TWEPOCH) // 60000) % 1440
+    return array(_typecode(), [(((s >> 22) + TWEPOCH) // 60000) % 1440 for s in ids])
+
+
+def batchHourOfDay(ids):
+    """
+    Returns the hour of the GMT day (0 to 23) of every ID.
+    """
+    a = _int64(ids)
+    if a is not None:
+        return (((a >> 22) + TWEPOCH) // 3600000) % 24
+    return array(_typecode(), [(((s >> 22) + TWEPOCH) // 3600000) % 24 for s in ids])
+
+
+def batchBuckets(ids):
+    """
+    Returns (ms, minute, minuteOfDay, hourOfDay) for every ID in one pass: the
+    Unix time in milliseconds, the minute since the Unix epoch, the minute of
+    the GMT day and the hour of the GMT day.
+    """
+    a = _int64(ids)
+    if a is not None:
+        ms = (a >> 22) + TWEPOCH
+        minute = ms // 60000
+        minuteOfDay = minute % 1440
+        return ms, minute, minuteOfDay, minuteOfDay // 60
+
+    c = _typecode()
+    ms, minute, minuteOfDay, hourOfDay = array(c), array(c), array(c), array(c)
+    for s in ids:
+        t = (s >> 22) + TWEPOCH
+        m = t // 60000
+        d = m % 1440
+        ms.append(t)
+        minute.append(m)
+        minuteOfDay.append(d)
+        hourOfDay.append(d // 60)
+    return ms, minute, minuteOfDay, hourOfDay
@@ -0,0 +1,310 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or (at your
+#   option) any later version.
+#
+#   This program is distributed in the hope that it will be useful, but WITHOUT
+#   ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+#   FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public
+#   License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+__author__ = 'Jason B. Hill (jason@jasonbhill.com)'
+__copyright__ = 'Copyright (c) 2014'
+__version__ = '0.1.2'
+
+
+#   Exporting the runtime statistics of a stream (Stream.snapshot() or
+#   StreamGroup.snapshot()) while it runs: in Prometheus' text format or as
+#   JSON over HTTP, or as a JSON file rewritten every few seconds. Everything
+#   here takes a 'source', any function returning a snapshot dictionary, and
+#   runs in its own thread; nothing is added to the stream's message path.
+
+import os
+import time
+import threading
+import BaseHTTPServer
+import SocketServer
+
+try: import simplejson as json
+except ImportError:
+    import json
+
+
+
+def mergeSnapshots(snapshots):
+    """
+    Returns the snapshots of several streams added up into one: counters are
+    summed (per key for the dictionaries), the callback histograms are added
+    bucket by bucket, uptime is the longest and keep-alive age the shortest.
+    """
+    merged = {
+        'timestamp': time.time(),
+        'uptime': None,
+        'bytes': 0,
+        'messages': {},
+        'decode_failures': 0,
+        'connections': 0,
+        'reconnects': {},
+        'keepalive_age': None,
+        'queue': None,
+        'callback_us': None
+    }
+    for s in snapshots:
+        for key in ['bytes', 'decode_failures', 'connections']:
+            merged[key] += s[key]
+        for key in ['messages', 'reconnects']:
+            for k, n in s[key].iteritems():
+                merged[key][k] = merged[key].get(k, 0) + n
+        if s['uptime'] is not None:
+            merged['uptime'] = max(merged['uptime'], s['uptime'])
+        if s['keepalive_age'] is not None:
+            if merged['keepalive_age'] is None or s['keepalive_age'] < merged['keepalive_age']:
+                merged['keepalive_age'] = s['keepalive_age']
+        if s['queue'] is not None:
+            if merged['queue'] is None:
+                merged['queue'] = dict.fromkeys(s['queue'], 0)
+            for k, n in s['queue'].iteritems():
+                merged['queue'][k] += n
+        h = s['callback_us']
+        if h is not None:
+            m = merged['callback_us']
+            if m is None:
+                merged['callback_us'] = dict(h, counts=list(h['counts']))
+                continue
+            m['counts'] = [a + b for a, b in zip(m['counts'], h['counts'])]
+            m['count'] += h['count']
+            m['sum'] += h['sum']
+            m['max'] = max(m['max'], h['max'])
+            # percentiles can't be added; keep the worst shard's
+            m['p50'] = max(m['p50'], h['p50'])
+            m['p99'] = max(m['p99'], h['p99'])
+    return merged
+
+
+
+def _number(value):
+    """
+    Returns value as a Prometheus sample value: '%d' for integers (a long's
+    repr ends in 'L'), and the shortest exact form for floats.
+    """
+    if isinstance(value, (int, long)):
+        return '%d' % value
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return value > 0 and '+Inf' or '-Inf'
+    return repr(value)
+
+
+def prometheus(snapshot, prefix='tweetwatch'):
+    """
+    Returns a snapshot in Prometheus' text exposition format.
+
+    ***EXAMPLE***
+
+    print prometheus(S.snapshot())
+        --> # TYPE tweetwatch_bytes_total counter
+            tweetwatch_bytes_total 1048576
+            ...
+    """
+    lines = []
+    def declare(name, kind):
+        lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+    def sample(name, value, labels=None):
+        name = '%s_%s' % (prefix, name)
+        if labels:
+            name += '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"'))
+                                      for k, v in sorted(labels.items()))
+        lines.append('%s %s' % (name, _number(value)))
+    def metric(name, kind, value):
+        declare(name, kind)
+        sample(name, value)
+
+    if snapshot['uptime'] is not None:
+        metric('uptime_seconds', 'gauge', snapshot['uptime'])
+    metric('bytes_total', 'counter', snapshot['bytes'])
+    metric('decode_failures_total', 'counter', snapshot['decode_failures'])
+    metric('connections_total', 'counter', snapshot['connections'])
+    if snapshot['keepalive_age'] is not None:
+        metric('keepalive_age_seconds', 'gauge', snapshot['keepalive_age'])
+    declare('messages_total', 'counter')
+    for kind, n in sorted(snapshot['messages'].items()):
+        sample('messages_total', n, {'type': kind})
+    declare('reconnects_total', 'counter')
+    for reason, n in sorted(snapshot['reconnects'].items()):
+        sample('reconnects_total', n, {'reason': reason})
+
+    queue = snapshot['queue']
+    if queue is not None:
+        metric('queue_depth', 'gauge', queue['depth'])
+        for key in ['enqueued', 'dropped', 'spilled', 'processed', 'errors']:
+            metric('queue_%s_total' % key, 'counter', queue[key])
+
+    h = snapshot['callback_us']
+    if h is not None:
+        # Prometheus histograms are cumulative, ending with a +Inf bucket
+        declare('callback_microseconds', 'histogram')
+        cumulative = 0
+        for bound, n in zip(h['bounds'] + ['+Inf'], h['counts']):
+            cumulative += n
+            sample('callback_microseconds_bucket', cumulative, {'le': bound})
+        sample('callback_microseconds_sum', h['sum'])
+        sample('callback_microseconds_count', h['count'])
+
+    return '\n'.join(lines) + '\n'
+
+
+
+###############################################################################
+# HTTP endpoint                                                               #
+###############################################################################
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body = prometheus(self.server.stats.source(), self.server.stats.prefix)
+            kind = 'text/plain; version=0.0.4'
+        elif path == '/stats.json':
+            body = json.dumps(self.server.stats.source(), sort_keys=True)
+            kind = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', kind)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+
+class StatsServer:
+    def __init__(self, source, port=9464, host='127.0.0.1', prefix='tweetwatch'):
+        """
+        Serve a stream's statistics over HTTP from a background thread:
+        /metrics in Prometheus' text format and /stats.json as JSON.
+
+        REQUIRED INPUT:
+
+        source (function) - Returns a snapshot when called, e.g. S.snapshot
+            for a Stream or StreamGroup S.
+
+        OPTIONAL INPUT:
+
+        port (int) - Port to listen on; 0 picks a free one. The default value
+            is 9464.
+
+        host (string) - Address to listen on. The default value is
+            '127.0.0.1' (this machine only).
+
+        prefix (string) - Prefix of the Prometheus metric names. The default
+            value is 'tweetwatch'.
+
+        ***EXAMPLE***
+
+        S = tweetwatch.stream.Stream(apiToken, 'sochi', dataFunction, stats=True)
+        StatsServer(S.snapshot).start()
+        S.start()
+        """
+        self.source = source
+        self.prefix = prefix
+        self._server = _Server((host, port), _Handler)
+        self._server.stats = self
+        self.port = self._server.server_address[1]
+        self.url = 'http://%s:%d/metrics' % (host, self.port)
+        self._thread = None
+
+    def start(self):
+        """
+        Serve in a background (daemon) thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop serving.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+
+
+###############################################################################
+# Periodic JSON file                                                          #
+###############################################################################
+class StatsFile:
+    def __init__(self, source, path, interval=10):
+        """
+        Rewrite a JSON file with a stream's statistics every few seconds from a
+        background thread. The file is replaced in one rename, so a reader
+        never sees half of it.
+
+        REQUIRED INPUT:
+
+        source (function) - Returns a snapshot when called, e.g. S.snapshot.
+
+        path (string) - The file to write.
+
+        OPTIONAL INPUT:
+
+        interval (float) - Seconds between writes. The default value is 10.
+
+        ***EXAMPLE***
+
+        StatsFile(S.snapshot, 'sochi-stats.json', interval=5).start()
+        """
+        if not interval > 0:
+            raise ValueError('tweetwatch.stats.StatsFile error: interval must be positive')
+        self.source = source
+        self.path = path
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def write(self):
+        """
+        Write the file now.
+        """
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.source(), f, sort_keys=True)
+        os.rename(tmp, self.path)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.write()
+
+    def start(self):
+        """
+        Write in a background (daemon) thread.
+        """
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop writing, after writing the file one last time.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
@@ -23,6 +23,7 @@ __version__ = '0.1.2'
 
 import sys
 import time
+from collections import deque
 
 try: import pycurl
 except ImportError:
@@ -48,6 +49,58 @@ except ImportError:
         print >> sys.stderr, "tweetwatch.stream fatal error: 'import json' failed."
         sys.exit(0)
 
+from tweetwatch.backoff import Backoff
+from tweetwatch.framing import Framer
+from tweetwatch.pipeline import Pipeline
+from tweetwatch.match import TrackMatcher
+from tweetwatch.meters import Histogram, geometricBounds
+from tweetwatch.message import Classifier, Message
+from tweetwatch.stats import mergeSnapshots
+
+
+
+###############################################################################
+# Exceptions                                                                  #
+###############################################################################
+class StreamError(Exception):
+    """
+    Base class of the errors raised by tweetwatch.stream.
+    """
+    pass
+
+
+class StreamHTTPError(StreamError):
+    """
+    The server refused a connection with an HTTP error that retrying won't
+    fix. status is the HTTP status code and shard the index of the shard.
+    """
+    errtype = 'HTTP error'
+
+    def __init__(self, status, shard=0):
+        StreamError.__init__(self, '%s (shard %d)' % (self.errtype, shard))
+        self.status = status
+        self.shard = shard
+
+
+class BadRequest(StreamHTTPError):
+    errtype = 'HTTP 400 - bad request'
+
+
+class Unauthorized(StreamHTTPError):
+    errtype = 'HTTP 401 - unauthorized'
+
+
+class Forbidden(StreamHTTPError):
+    errtype = 'HTTP 403 - forbidden'
+
+
+# HTTP status code -> exception, for the codes that end a connection for good
+HTTP_ERRORS = {
+    400: BadRequest,
+    401: Unauthorized,
+    403: Forbidden
+}
+
 
 
 ###############################################################################
@@ -59,7 +112,9 @@ class Stream:
     def __init__(self, apiToken, searchTerms, dataFunction,
             api_url='https://stream.twitter.com/1.1/statuses/filter.json', curl_encoding='gzip',
             filter_level='none', follow=None, language=None, locations=None, stall_warnings='true',
-            timeout=300, user_agent=None):
+            timeout=300, user_agent=None, delimited=None, workers=0, queue_size=10000,
+            overflow='block', spill_file=None, message_types=None, lazy_messages=False,
+            dedup=None, stats=False, observers=None):
         """
         Setup a persistant HTTP connection to Twitter's streaming API.
 
@@ -106,7 +161,9 @@ class Stream:
             searchTerms = 'item1, \'iterm with space\', #iterm3'
 
         dataFunction (function) - A Python function to route the JSON responses
-            of the API appropriately.
+            of the API appropriately. It is called once for every complete
+            message (a string ending in '\\r\\n'), no matter how the data was
+            split up on the network. Keep-alive newlines are not passed on.
 
         OPTIONAL INPUT:
 
@@ -189,6 +246,65 @@ class Stream:
             ***EXAMPLE***
 
             userAgent = 'mywebsite.com / version: 1.1.3'
+
+        delimited (string) - Either None or 'length'. When set to 'length',
+            Twitter prefixes every message with its size in bytes and messages
+            are framed by that size rather than by scanning for '\\r\\n'. The
+            messages handed to dataFunction are the same either way. The
+            default value is None.
+
+        workers (int) - When 0, dataFunction is called directly from libcurl's
+            write callback, so a slow dataFunction slows down reading from the
+            network. When positive, messages are put on a bounded queue and
+            that many worker threads call dataFunction instead (see
+            tweetwatch.pipeline.Pipeline); the queue is available as
+            self.pipeline. The default value is 0.
+
+        queue_size (int) - Maximum number of queued messages when workers is
+            positive. The default value is 10000.
+
+        overflow (string) - One of 'block', 'drop_oldest', or 'spill', saying
+            what happens when the queue is full. With 'block' the transfer is
+            paused (pycurl.WRITEFUNC_PAUSE) until the workers catch up. The
+            default value is 'block'.
+
+        spill_file (string) - File to hold overflow messages when overflow is
+            'spill'; it is emptied once they have been read back and removed
+            when the stream stops. The default value is None.
+
+        message_types (list) - Message types to pass on to dataFunction, as
+            named by tweetwatch.message.classify: 'tweet', 'limit', 'delete',
+            'warning', 'tweetwatch_error', and so on. Every message is typed
+            from its first few bytes, so unwanted control messages are dropped
+            before anything decodes them. The default value of None passes on
+            every type.
+
+            ***EXAMPLE***
+
+            message_types = ['tweet', 'limit', 'tweetwatch_error']
+
+        lazy_messages (bool) - When True, dataFunction receives
+            tweetwatch.message.Message objects: strings that also have kind,
+            id, text, lang, utc_offset, time_zone (and other) attributes,
+            extracted on first use without decoding the whole message, and a
+            json attribute holding the decoded message. The default value is
+            False.
+
+        dedup (tweetwatch.dedup.Dedup) - When given, tweets whose IDs it has
+            already seen are dropped before reaching dataFunction, so a tweet
+            delivered again after a reconnect is only counted once. Share one
+            Dedup between streams to also drop tweets matched by more than one
+            of them. The default value is None.
+
+        stats (bool) - When True, the time spent in every dataFunction call is
+            kept in a histogram, reported by snapshot() along with the
+            counters that are always kept. The default value is False.
+
+        observers (list) - Functions called with every message (as a
+            tweetwatch.message.Message, whatever message_types and
+            lazy_messages say) before it is queued for dataFunction, e.g. a
+            tweetwatch.sketches.TweetSketches. They run on the network thread,
+            so they must be quick. The default value is None.
         """
         # the connection hasn't been configured or started yet
         self.connection = None
@@ -323,6 +439,56 @@ class Stream:
         else:
             self.user_agent = None
 
+        # 'delimited' may only be None or 'length'
+        if delimited and not delimited == 'length':
+            raise ValueError("error in input to tweetwatch.stream.Stream.__init__():\n" \
+                            "'delimited' must be either None or 'length'")
+        elif delimited:
+            self.delimited = 'length'
+        else:
+            self.delimited = None
+
+        # with stats, every call of dataFunction is timed (in microseconds);
+        # worker threads record without a lock, so a count may rarely be lost
+        self.callbackTime = None
+        handler = self.dataFunction
+        if stats:
+            self.callbackTime = Histogram(geometricBounds(1, 100000000))
+            handler = self._timed
+
+        # 'workers' is optional; must be a non-negative integer
+        if workers and not isinstance(workers, int):
+            raise TypeError("error in input to tweetwatch.stream.Stream.__init__():\n" \
+                            "'workers' must be an integer")
+        elif workers and workers < 0:
+            raise ValueError("error in input to tweetwatch.stream.Stream.__init__():\n" \
+                            "'workers' must be a non-negative integer")
+        elif workers:
+            # the pipeline checks queue_size, overflow and spill_file itself
+            # spilled messages are read back as strings; rewrap them
+            wrap = None
+            if lazy_messages:
+                wrap = Message
+            self.pipeline = Pipeline(handler, workers=workers, maxsize=queue_size,
+                    overflow=overflow, spill_file=spill_file, wrap=wrap)
+        else:
+            self.pipeline = None
+
+        # while the transfer is paused because the queue is full, the number
+        # of free slots needed to take the held chunk; otherwise False
+        self._paused = False
+
+        # reassembles network chunks into whole messages, which are typed and
+        # filtered by the classifier on their way to dataFunction (or to the
+        # queue, when running with worker threads)
+        if self.pipeline:
+            self._deliver = self.pipeline.put
+        else:
+            self._deliver = handler
+        self.classifier = Classifier(self._deliver, kinds=message_types, wrap=lazy_messages,
+                dedup=dedup, observers=observers)
+        self.framer = Framer(self.classifier, delimited=self.delimited)
+
         # form apiOpts dictionary for urlencoding and passing in html header
         self.apiOpts = {}
         if self.stall_warnings:
@@ -330,12 +496,23 @@ class Stream:
         self.apiOpts['filter_level'] = self.filter_level
         if self.language:
             self.apiOpts['language'] = self.language
-        self.apiOpts['track'] = self.searchTerms
+        if self.searchTerms:
+            self.apiOpts['track'] = self.searchTerms
+        if self.follow:
+            self.apiOpts['follow'] = self.follow
         if self.locations:
             self.apiOpts['locations'] = self.locations
+        if self.delimited:
+            self.apiOpts['delimited'] = self.delimited
+
+        # works out the wait before each reconnect
+        self.backoff = Backoff()
 
-        # set error timing data for reconnect backoff
-        self.errtime = int(time.time())
+        # runtime counters for snapshot(): connections made, reconnects by
+        # reason, and when the first connection was made
+        self.connections = 0
+        self.reconnects = {}
+        self.started = None
 
     def close(self):
         """
@@ -353,6 +530,9 @@ class Stream:
 
         # set up the connection
         self.connection = pycurl.Curl()
+        self.connections += 1
+        if self.started is None:
+            self.started = time.time()
 
         # set the URL of the connection endpoint
         self.connection.setopt(pycurl.URL, self.api_url)
@@ -379,8 +559,51 @@ class Stream:
         self.connection.setopt(pycurl.HTTPHEADER, ['Host: stream.twitter.com',
                 'Authorization: %s' % self.get_oauth_header()])
 
-        # point to the function that receives data from the stream
-        self.connection.setopt(pycurl.WRITEFUNCTION, self.dataFunction)
+        # point to the framer that receives data from the stream; any partial
+        # message from a previous connection is thrown away
+        self.framer.reset()
+        if self.pipeline and self.pipeline.overflow == 'block':
+            # pause the transfer while the queue is full; libcurl keeps calling
+            # the progress function while paused, which is where we resume
+            self._paused = False
+            self.connection.setopt(pycurl.WRITEFUNCTION, self._write)
+            self.connection.setopt(pycurl.NOPROGRESS, 0)
+            self.connection.setopt(pycurl.PROGRESSFUNCTION, self._progress)
+        else:
+            self.connection.setopt(pycurl.WRITEFUNCTION, self.framer.write)
+
+    def _write(self, chunk):
+        """
+        Write callback used with a blocking pipeline. If the queue hasn't room
+        for every message the chunk could complete, ask libcurl to hold on to
+        the chunk and pause the transfer, so that the put() into the queue
+        never blocks inside the callback.
+        """
+        # each message ends in a newline, and the framer may be holding the
+        # start of one more; a queue smaller than that has to block
+        needed = min(chunk.count('\n') + 1, self.pipeline.maxsize)
+        if self.pipeline.free() < needed:
+            self._paused = needed
+            return pycurl.WRITEFUNC_PAUSE
+        self.framer.write(chunk)
+
+    def _progress(self, download_t, download_d, upload_t, upload_d):
+        """
+        Progress callback used with a blocking pipeline. Resume a paused
+        transfer once the queue has drained to half its size and has room for
+        the held chunk.
+        """
+        if (self._paused and self.pipeline.depth() <= self.pipeline.maxsize / 2 and
+                self.pipeline.free() >= self._paused):
+            self._paused = False
+            self.connection.pause(pycurl.PAUSE_CONT)
+
+    def trackMatcher(self):
+        """
+        Returns a tweetwatch.match.TrackMatcher for this stream's searchTerms,
+        which tells which terms a delivered tweet matched.
+        """
+        return TrackMatcher(self.searchTerms)
 
     def get_oauth_header(self):
         """
@@ -398,96 +621,742 @@ class Stream:
                 oauth.Token(key=self.accessToken, secret=self.accessTokenSecret))
         return req.to_header()['Authorization'].encode('utf-8')
 
+    def _report(self, isFatal, errtype, action, **extra):
+        """
+        Pass a tweetwatch_error record down the message path (and print it to
+        stderr when it is fatal). Any extra keyword arguments are added to the
+        record.
+        """
+        errdict = {
+            'tweetwatch_error': {
+                'timestamp': int(time.time()),
+                'is_fatal': isFatal,
+                'type': errtype,
+                'action': action
+            }
+        }
+        errdict['tweetwatch_error'].update(extra)
+        self.classifier(json.dumps(errdict)+'\n')
+        if isFatal:
+            print >> sys.stderr, str(errdict)
+
+    def delivering(self):
+        """
+        Returns True once the current connection has been accepted by the
+        server and has delivered data.
+        """
+        return (self.connection is not None and
+                self.connection.getinfo(pycurl.HTTP_CODE) == 200 and
+                self.connection.getinfo(pycurl.SIZE_DOWNLOAD) > 0)
+
+    def _reconnectDelay(self, networkError, **extra):
+        """
+        Call after the connection has ended. Reports what went wrong and
+        returns the seconds to wait before reconnecting, following
+        self.backoff, or None if the server refused the connection for good
+        (HTTP 400, 401 or 403).
+        """
+        # a connection that got going clears the record of earlier failures
+        if self.delivering():
+            self.backoff.reset()
+
+        sc = self.connection.getinfo(pycurl.HTTP_CODE)
+        if sc in HTTP_ERRORS:
+            reason, delay = 'http_%d' % sc, None
+        elif networkError:
+            reason, delay = 'network', self.backoff.next('network')
+            self._report(False, 'network', 'waiting %g seconds' % delay, **extra)
+        elif sc == 420:
+            reason, delay = 'rate_limit', self.backoff.next('rate_limit')
+            self._report(True, 'HTTP 420 - http rate limit', 'waiting %g seconds' % delay, **extra)
+        elif sc != 200:
+            reason, delay = 'http_%d' % sc, self.backoff.next('http')
+            self._report(False, 'HTTP %d' % sc, 'waiting %g seconds' % delay, **extra)
+        else:
+            # the server ended a healthy stream; reconnect at once
+            reason, delay = 'closed', 0
+        self.reconnects[reason] = self.reconnects.get(reason, 0) + 1
+        return delay
+
+    def _timed(self, message):
+        """
+        Call dataFunction, recording how long it took.
+        """
+        t = time.time()
+        try:
+            self.dataFunction(message)
+        finally:
+            self.callbackTime.record(int((time.time() - t) * 1000000))
+
+    def snapshot(self):
+        """
+        Returns a dictionary of runtime statistics: bytes received, messages
+        by type (see tweetwatch.message.classify; 'unknown' counts messages
+        that aren't JSON objects), connections made, reconnects by reason
+        ('network', 'rate_limit', 'closed' or 'http_<status>'), seconds since
+        the last keep-alive, the state of the queue when running with worker
+        threads, and dataFunction timings in microseconds when stats is on.
+
+        Nothing here takes a lock, so it may be called from any thread (e.g.
+        tweetwatch.stats.StatsServer) while the stream runs; counters read
+        while being updated may be off by one.
+        """
+        now = time.time()
+        framer = self.framer
+        snapshot = {
+            'timestamp': now,
+            'uptime': self.started and now - self.started,
+            'bytes': framer.bytes,
+            'messages': dict(self.classifier.counts),
+            'decode_failures': self.classifier.counts.get('unknown', 0),
+            'connections': self.connections,
+            'reconnects': dict(self.reconnects),
+            'keepalive_age': framer.lastKeepalive and now - framer.lastKeepalive,
+            'queue': None,
+            'callback_us': None
+        }
+        if self.pipeline:
+            snapshot['queue'] = self.pipeline.stats()
+        if self.callbackTime is not None:
+            h = self.callbackTime
+            snapshot['callback_us'] = {
+                'bounds': h.bounds,
+                'counts': list(h.counts),
+                'count': h.count,
+                'sum': h.total,
+                'max': h.max,
+                'p50': h.percentile(50),
+                'p99': h.percentile(99)
+            }
+        return snapshot
+
     def start(self):
         """
-        Listen to the streaming endpoint.
+        Listen to the streaming endpoint, reconnecting after errors with the
+        delays of tweetwatch.backoff.
         """
+        if self.pipeline:
+            self.pipeline.start()
+
         while True:
             self.configure()
+            networkError = False
             try:
                 self.connection.perform()
             except:
                 # this should only happen when a network error occurs
-                if int(time.time()) - self.errtime < 10:
-                    errdict = {
-                        'tweetwatch_error': {
-                            'timestamp': int(time.time()),
-                            'is_fatal': False,
-                            'type': 'network',
-                            'action': 'multiple recent failures - waiting 10 seconds'
-                        }
-                    }
-                    self.dataFunction(json.dumps(errdict)+'\n')
-                    time.sleep(10)
-                else:
-                    errdict = {
-                        'tweetwatch_error': {
-                            'timestamp': int(time.time()),
-                            'is_fatal': False,
-                            'type': 'network',
-                            'action': 'waiting 1 second'
-                        }
-                    }
-                    self.dataFunction(json.dumps(errdict)+'\n')
-                    time.sleep(1)
-
-            self.errtime = int(time.time())
-
-            # get HTTP status code
-            sc = self.connection.getinfo(pycurl.HTTP_CODE)
-
-            if sc == 400:
-                errdict = {
-                    'tweetwatch_error': {
-                        'timestamp': int(time.time()),
-                        'is_fatal': True,
-                        'type': 'HTTP 400 - bad request',
-                        'action': 'process terminated'
-                    }
-                }
-                self.dataFunction(json.dumps(errdict)+'\n')
-                print >> sys.stderr, str(errdict)
-                self.close()
-                sys.exit(0)
+                networkError = True
 
-            elif sc == 401:
-                errdict = {
-                    'tweetwatch_error': {
-                        'timestamp': int(time.time()),
-                        'is_fatal': True,
-                        'type': 'HTTP 401 - unauthorized',
-                        'action': 'process terminated'
-                    }
-                }
-                self.dataFunction(json.dumps(errdict)+'\n')
-                print >> sys.stderr, str(errdict)
+            delay = self._reconnectDelay(networkError)
+            if delay is None:
+                sc = self.connection.getinfo(pycurl.HTTP_CODE)
+                self._report(True, HTTP_ERRORS[sc].errtype, 'process terminated')
                 self.close()
+                if self.pipeline:
+                    self.pipeline.stop()
                 sys.exit(0)
+            time.sleep(delay)
 
-            elif sc == 403:
-                errdict = {
-                    'tweetwatch_error': {
-                        'timestamp': int(time.time()),
-                        'is_fatal': True,
-                        'type': 'HTTP 403 - forbidden',
-                        'action': 'process terminated'
-                    }
-                }
-                self.dataFunction(json.dumps(errdict)+'\n')
-                print >> sys.stderr, str(errdict)
-                self.close()
-                sys.exit(0)
 
-            elif sc == 420:
-                errdict = {
-                    'tweetwatch_error': {
-                        'timestamp': int(time.time()),
-                        'is_fatal': True,
-                        'type': 'HTTP 420 - http rate limit',
-                        'action': 'waiting one minute'
-                    }
-                }
-                self.dataFunction(json.dumps(errdict)+'\n')
-                print >> sys.stderr, str(errdict)
-                time.sleep(60)
+###############################################################################
+# Sharded streams                                                             #
+# --------------------------------------------------------------------------- #
+# Several connections driven by one pycurl.CurlMulti loop in one thread       #
+###############################################################################
+
+# the most of each kind of predicate the filter endpoint takes per connection
+MAX_TRACK = 400
+MAX_FOLLOW = 5000
+MAX_LOCATIONS = 25
+
+
+def _split(s):
+    """
+    Returns the items of a comma-separated string, stripped, without blanks.
+    """
+    if not s:
+        return []
+    return [item.strip() for item in s.split(',') if item.strip()]
+
+
+def _boxes(locations):
+    """
+    Returns the bounding boxes of a locations string, each as a string of four
+    comma-separated coordinates.
+    """
+    coords = _split(locations)
+    if len(coords) % 4:
+        raise ValueError('tweetwatch.stream error: locations must hold four coordinates per box')
+    return [','.join(coords[i:i+4]) for i in range(0, len(coords), 4)]
+
+
+def assignTerms(items, shards, weights=None, capacity=None):
+    """
+    Spread items over a number of shards so that every shard carries about the
+    same total weight. The heaviest items are placed first, each on the
+    lightest shard that has room left (at most capacity items per shard; no
+    limit when capacity is None). Returns a list of item lists, one per shard.
+
+    weights (dictionary) - Maps an item to its weight, e.g. the tweets per
+        minute it is expected to bring in. Items not in weights weigh 1, which
+        balances shards by item count. The default value is None.
+
+    ***EXAMPLE***
+
+    assignTerms(['sochi', 'olympics', 'curling'], 2, weights={'sochi': 500})
+        --> [['sochi'], ['olympics', 'curling']]
+    """
+    weights = weights or {}
+    load = [0] * shards
+    assigned = [[] for i in range(shards)]
+    for item in sorted(items, key=lambda item: -weights.get(item, 1)):
+        room = [n for n in range(shards) if capacity is None or len(assigned[n]) < capacity]
+        if not room:
+            raise ValueError('tweetwatch.stream.assignTerms error: %d items do not fit in %d shards of %d'
+                    % (len(items), shards, capacity))
+        n = min(room, key=lambda n: (load[n], len(assigned[n])))
+        assigned[n].append(item)
+        load[n] += weights.get(item, 1)
+    return assigned
+
+
+class StreamGroup:
+    def __init__(self, apiTokens, searchTerms, dataFunction, shards=None, follow=None,
+            locations=None, weights=None, **options):
+        """
+        Split a set of search terms, user IDs and locations over several
+        connections to the streaming API (shards) and run them all from one
+        thread with a single pycurl.CurlMulti loop. Each shard is a Stream
+        with its own framer, so messages are always whole, and every shard
+        hands its messages to the same dataFunction.
 
+        REQUIRED INPUT:
+
+        apiTokens (dictionary or list) - An API token as for Stream, used by
+            every shard, or a list of tokens; shard i connects with
+            apiTokens[i % len(apiTokens)].
+
+        searchTerms (string or list) - A comma-separated string of search terms
+            to be spread over the shards automatically, or a list holding one
+            comma-separated string per shard to choose the split yourself.
+
+            ***EXAMPLE***
+
+            searchTerms = ['sochi, olympics', 'curling, #curling']
+
+        dataFunction (function) - As for Stream. It is called for the messages
+            of every shard, always from the thread running start(), so it
+            needs no locking of its own.
+
+        OPTIONAL INPUT:
+
+        shards (int) - The number of connections. The default of None uses as
+            few as the limits of the filter endpoint allow (MAX_TRACK terms,
+            MAX_FOLLOW user IDs and MAX_LOCATIONS bounding boxes per
+            connection). Ignored when searchTerms is a list.
+
+        follow (string) - A comma-separated string of user IDs, spread over
+            the shards like the search terms. The default value is None.
+
+        locations (string) - Bounding boxes as for Stream, spread over the
+            shards a whole box at a time. The default value is None.
+
+        weights (dictionary) - Expected volume of each search term (e.g. its
+            tweets per minute from an earlier run), so that busy terms are kept
+            apart; see assignTerms. The default of None balances shards by the
+            number of terms.
+
+        Any other keyword arguments (api_url, filter_level, language,
+        delimited, message_types, lazy_messages, dedup, observers, and so on)
+        are passed on to every Stream; a dedup or observer given here is shared
+        by all shards.
+        """
+        if isinstance(apiTokens, dict):
+            apiTokens = [apiTokens]
+        if not apiTokens:
+            raise ValueError('tweetwatch.stream.StreamGroup error: no API tokens given')
+
+        if isinstance(searchTerms, str):
+            terms = _split(searchTerms)
+            users = _split(follow)
+            boxes = _boxes(locations)
+            if shards is None:
+                shards = max(1, -(-len(terms) // MAX_TRACK), -(-len(users) // MAX_FOLLOW),
+                        -(-len(boxes) // MAX_LOCATIONS))
+            if not isinstance(shards, int) or shards <= 0:
+                raise ValueError('tweetwatch.stream.StreamGroup error: shards must be a positive integer')
+            track = assignTerms(terms, shards, weights=weights, capacity=MAX_TRACK)
+        elif isinstance(searchTerms, list):
+            track = [_split(t) for t in searchTerms]
+            users = _split(follow)
+            boxes = _boxes(locations)
+            shards = len(track)
+            for t in track:
+                if len(t) > MAX_TRACK:
+                    raise ValueError('tweetwatch.stream.StreamGroup error: more than %d terms in one shard'
+                            % MAX_TRACK)
+        else:
+            raise TypeError('tweetwatch.stream.StreamGroup error: searchTerms must be a string or a list')
+
+        follow = assignTerms(users, shards, capacity=MAX_FOLLOW)
+        locations = assignTerms(boxes, shards, capacity=MAX_LOCATIONS)
+
+        self.dataFunction = dataFunction
+        self._tokens = apiTokens
+        self._options = options
+        self.shards = []
+        for i in range(shards):
+            if not (track[i] or follow[i] or locations[i]):
+                # nothing left for this connection to ask for
+                continue
+            self.shards.append(self._makeStream(len(self.shards), track[i],
+                    ', '.join(follow[i]) or None, ','.join(locations[i]) or None))
+        # raise refusals from step() instead of only reporting them
+        self.raise_errors = False
+
+        self.multi = None
+        self._running = False
+        self._errors = []
+        # curl handle -> shard, for connections in the multi loop
+        self._handles = {}
+        # shard -> Unix time it should (re)connect at
+        self._due = {}
+        # new shard -> the shard it replaces once it is delivering
+        self._replacing = {}
+        # message counts of shards that have been replaced
+        self._retired = {}
+        self._assign()
+
+    def _makeStream(self, i, track, follow, locations):
+        """
+        Returns a Stream for shard i with the given terms, user IDs and boxes.
+        """
+        return Stream(self._tokens[i % len(self._tokens)], ', '.join(track), self.dataFunction,
+                follow=follow, locations=locations, **self._options)
+
+    def _assign(self):
+        """
+        Rebuild self.assignments, which maps each search term to the index of
+        the shard tracking it (or about to).
+        """
+        self.assignments = {}
+        for i in range(len(self.shards)):
+            for t in _split(self._target(i).searchTerms):
+                self.assignments[t] = i
+
+    def _target(self, i):
+        """
+        Returns the replacement waiting to take over shard i, or the shard.
+        """
+        for new, old in self._replacing.iteritems():
+            if old is self.shards[i]:
+                return new
+        return self.shards[i]
+
+    def _index(self, shard):
+        """
+        Returns the index of a shard, or of the shard a replacement is for.
+        """
+        return self.shards.index(self._replacing.get(shard, shard))
+
+    def counts(self):
+        """
+        Returns the number of messages received by type, over all shards.
+        """
+        counts = dict(self._retired)
+        for s in self.shards + self._replacing.keys():
+            for kind, n in s.classifier.counts.iteritems():
+                counts[kind] = counts.get(kind, 0) + n
+        return counts
+
+    def snapshot(self):
+        """
+        Returns the statistics of every shard (see Stream.snapshot) added up
+        into one dictionary, with the per-shard snapshots under 'shards'.
+        """
+        shards = [s.snapshot() for s in self.shards]
+        snapshot = mergeSnapshots(shards)
+        snapshot['messages'] = self.counts()
+        snapshot['shards'] = shards
+        return snapshot
+
+    def updateTerms(self, searchTerms, weights=None):
+        """
+        Change the search terms while running, without a gap in the data.
+
+        Terms that stay keep their shard and terms that go are dropped from
+        theirs; new terms are placed on the lightest shards with room (by
+        weights, as in assignTerms), with new shards added when all are full.
+        Each shard whose terms changed is replaced make-before-break: the new
+        connection is opened alongside the old one, which is closed only once
+        the new one is delivering data. Tweets matching both arrive twice
+        during the overlap; pass a tweetwatch.dedup.Dedup (dedup=...) to the
+        group to drop them. Shards that aren't connected at the time are
+        simply replaced.
+
+        Note that Twitter limits the connections per account, so shards that
+        share a token may see the older connection cut off early by the server
+        (which is harmless here) rather than closed by us.
+        """
+        terms = _split(searchTerms)
+        wanted = set(terms)
+        weights = weights or {}
+
+        tracks = [[t for t in _split(self._target(i).searchTerms) if t in wanted]
+                for i in range(len(self.shards))]
+        present = set(t for track in tracks for t in track)
+        load = [sum(weights.get(t, 1) for t in track) for track in tracks]
+        for t in sorted([t for t in terms if not t in present], key=lambda t: -weights.get(t, 1)):
+            room = [i for i in range(len(tracks)) if len(tracks[i]) < MAX_TRACK]
+            if not room:
+                tracks.append([])
+                load.append(0)
+                room = [len(tracks) - 1]
+            i = min(room, key=lambda i: (load[i], len(tracks[i])))
+            tracks[i].append(t)
+            load[i] += weights.get(t, 1)
+            present.add(t)
+
+        # replace from the end, so that dropping a shard doesn't move the rest
+        for i in reversed(range(len(tracks))):
+            if i >= len(self.shards):
+                continue
+            current = self._target(i)
+            if tracks[i] == _split(current.searchTerms):
+                continue
+            if not (tracks[i] or current.follow or current.locations):
+                self._drop(i)
+            else:
+                self._replace(i, self._makeStream(i, tracks[i], current.follow, current.locations))
+
+        for i in range(len(self.shards), len(tracks)):
+            shard = self._makeStream(i, tracks[i], None, None)
+            self.shards.append(shard)
+            if self.multi is not None:
+                if shard.pipeline:
+                    shard.pipeline.start()
+                self._due[shard] = 0
+
+        self._assign()
+
+    def _replace(self, i, new):
+        """
+        Put new in place of shard i: at once if shard i isn't connected,
+        otherwise once new is delivering (see _promote).
+        """
+        old = self.shards[i]
+        # a replacement that never got going is superseded
+        for n, o in self._replacing.items():
+            if o is old:
+                del self._replacing[n]
+                self._retire(n)
+
+        if self.multi is not None and new.pipeline:
+            new.pipeline.start()
+        if self.multi is None or not old.connection in self._handles:
+            # nothing to overlap with; keep to the old shard's schedule
+            new.backoff = old.backoff
+            if old in self._due:
+                self._due[new] = self._due.pop(old)
+            self.shards[i] = new
+            self._retire(old)
+        else:
+            self._replacing[new] = old
+            self._due[new] = 0
+
+    def _drop(self, i):
+        """
+        Close shard i (and any replacement for it) and remove it.
+        """
+        old = self.shards.pop(i)
+        for n, o in self._replacing.items():
+            if o is old:
+                del self._replacing[n]
+                self._retire(n)
+        self._retire(old)
+
+    def _retire(self, shard):
+        """
+        Close a shard that is no longer wanted, keeping its message counts.
+        """
+        if shard.connection in self._handles:
+            del self._handles[shard.connection]
+            self.multi.remove_handle(shard.connection)
+        if shard.connection is not None:
+            shard.close()
+        self._due.pop(shard, None)
+        if shard.pipeline and self.multi is not None:
+            shard.pipeline.stop()
+        for kind, n in shard.classifier.counts.iteritems():
+            self._retired[kind] = self._retired.get(kind, 0) + n
+
+    def _promote(self):
+        """
+        Swap in every replacement that is delivering and close the shard it
+        replaces.
+        """
+        for new, old in self._replacing.items():
+            if new.connection in self._handles and new.delivering():
+                del self._replacing[new]
+                self.shards[self.shards.index(old)] = new
+                self._retire(old)
+
+    def _connect(self, shard):
+        """
+        Open a new connection for a shard and add it to the multi loop.
+        """
+        shard.configure()
+        self.multi.add_handle(shard.connection)
+        self._handles[shard.connection] = shard
+
+    def _finished(self, connection, errmsg):
+        """
+        Handle a connection that has ended: take it out of the multi loop and
+        schedule its shard to reconnect after the shard's backoff delay. A
+        shard refused with HTTP 400, 401 or 403 is stopped for good (a refused
+        replacement is dropped and the shard it was for keeps running), and
+        the refusal is kept to be raised from step() when raise_errors is True.
+        """
+        shard = self._handles.pop(connection)
+        self.multi.remove_handle(connection)
+        index = self._index(shard)
+
+        delay = shard._reconnectDelay(errmsg is not None, shard=index)
+        if delay is None:
+            sc = connection.getinfo(pycurl.HTTP_CODE)
+            error = HTTP_ERRORS[sc](sc, index)
+            shard._report(True, error.errtype, 'shard stopped', shard=index)
+            if shard in self._replacing:
+                del self._replacing[shard]
+                self._retire(shard)
+                self._assign()
+            else:
+                shard.close()
+            if self.raise_errors:
+                self._errors.append(error)
+            return
+
+        self._due[shard] = time.time() + delay
+
+    def open(self):
+        """
+        Get ready to run: start any pipelines and schedule every shard to
+        connect on the next step(). start() calls this itself.
+        """
+        for s in self.shards:
+            if s.pipeline:
+                s.pipeline.start()
+
+        self.multi = pycurl.CurlMulti()
+        self._running = True
+        self._handles = {}
+        self._errors = []
+        self._due = dict((s, 0) for s in self.shards)
+
+    def active(self):
+        """
+        Returns True while there is anything left to do: stop() hasn't been
+        called and some shard is connected or waiting to reconnect.
+        """
+        return bool(self._running and (self._handles or self._due))
+
+    def step(self, timeout=1.0):
+        """
+        Run the loop once: open any connections that are due, let libcurl
+        move every transfer along (the framers, and so dataFunction, are
+        called from in here), handle connections that ended, and then wait up
+        to timeout seconds for more data. Use timeout=0 to return at once,
+        e.g. when select() on fdset() has already said there is data.
+        """
+        now = time.time()
+        for s, t in self._due.items():
+            if t <= now:
+                del self._due[s]
+                self._connect(s)
+
+        while True:
+            ret, active = self.multi.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+        while True:
+            queued, ok, failed = self.multi.info_read()
+            for c in ok:
+                self._finished(c, None)
+            for c, errno, errmsg in failed:
+                self._finished(c, errmsg or str(errno))
+            if not queued:
+                break
+
+        self._promote()
+        if self._errors:
+            raise self._errors.pop(0)
+
+        # wait for network activity, libcurl's next timeout, or the next
+        # scheduled reconnect
+        wait = min(timeout, self.timeout())
+        if wait > 0:
+            if not self._handles or self.multi.select(wait) == -1:
+                time.sleep(wait)
+
+    def timeout(self):
+        """
+        Returns the longest time in seconds that may pass before step() should
+        be called again, even if no socket becomes readable.
+        """
+        wait = 1.0
+        t = self.multi.timeout()
+        if t >= 0:
+            wait = min(wait, t / 1000.0)
+        if self._due:
+            wait = min(wait, min(self._due.values()) - time.time())
+        return max(0, wait)
+
+    def fdset(self):
+        """
+        Returns the (read, write, exceptional) lists of file descriptors of the
+        open connections, for waiting on with select.select in a loop of your
+        own before calling step(0).
+        """
+        return self.multi.fdset()
+
+    def start(self):
+        """
+        Connect every shard and listen until stop() is called or every shard
+        has been refused by the server.
+        """
+        self.open()
+        try:
+            while self.active():
+                self.step()
+        finally:
+            self.close()
+
+    def stop(self):
+        """
+        Ask start() to close every connection and return. May be called from
+        dataFunction or from another thread.
+        """
+        self._running = False
+
+    def close(self):
+        """
+        Close every connection and the multi handle, and stop any pipelines.
+        """
+        if self.multi is None:
+            return
+        self._running = False
+        # with nothing running there is no overlap to wait for
+        for new, old in self._replacing.items():
+            self.shards[self.shards.index(old)] = new
+            self._retire(old)
+        self._replacing = {}
+        for c, s in self._handles.items():
+            self.multi.remove_handle(c)
+            s.close()
+        self._handles = {}
+        self._due = {}
+        self.multi.close()
+        self.multi = None
+        for s in self.shards + self._replacing.keys():
+            if s.pipeline:
+                s.pipeline.stop()
+
+
+
+###############################################################################
+# Iterable stream                                                             #
+###############################################################################
+class AsyncStream(StreamGroup):
+    def __init__(self, apiTokens, searchTerms, **options):
+        """
+        A stream that doesn't take over the thread: iterate over it for its
+        messages, or call poll() from a loop of your own. Takes the same
+        arguments as StreamGroup, without dataFunction, so one AsyncStream may
+        also hold several shards.
+
+        Nothing blocks for longer than one step() (about a second at most),
+        the connections can be closed at any time with cancel(), and a shard
+        refused by the server raises a StreamHTTPError (BadRequest,
+        Unauthorized or Forbidden) instead of ending the process.
+
+        ***EXAMPLE***
+
+        stream = AsyncStream(apiToken, 'sochi, olympics', lazy_messages=True)
+        try:
+            for message in stream:
+                if message.kind == 'tweet':
+                    print message.text
+        except tweetwatch.stream.Unauthorized:
+            print 'check the API token'
+
+        ***EXAMPLE***
+
+        # several streams (and anything else with a file descriptor) in one
+        # select loop
+        for s in streams:
+            s.open()
+        while True:
+            r, w, x = [], [], []
+            for s in streams:
+                fds = s.fdset()
+                r += fds[0]; w += fds[1]; x += fds[2]
+            select.select(r, w, x, min(s.timeout() for s in streams))
+            for s in streams:
+                for message in s.poll():
+                    handle(message)
+        """
+        # messages framed by the shards, waiting to be taken
+        self._messages = deque()
+        StreamGroup.__init__(self, apiTokens, searchTerms, self._messages.append, **options)
+        self.raise_errors = True
+        self._iterating = False
+
+    def poll(self, timeout=0):
+        """
+        Run the loop once (see step()) and return the list of messages that
+        have arrived. Opens the connections on first use.
+        """
+        if self.multi is None:
+            self.open()
+        self.step(timeout)
+        messages = list(self._messages)
+        self._messages.clear()
+        return messages
+
+    def __iter__(self):
+        """
+        Yields messages as they arrive, until cancel() is called or every shard
+        has been refused. Leaving the loop early closes the connections.
+        """
+        if self.multi is None:
+            self.open()
+        self._iterating = True
+        error = None
+        try:
+            while True:
+                while self._messages:
+                    yield self._messages.popleft()
+                # hand out everything that arrived before a refusal first
+                if error is not None:
+                    raise error
+                if not self.active():
+                    return
+                try:
+                    self.step()
+                except StreamHTTPError as e:
+                    error = e
+        finally:
+            self._iterating = False
+            self.close()
+
+    def cancel(self):
+        """
+        Stop the stream. Outside of an iteration the connections are closed at
+        once. During one (cancel() may be called from another thread, or from
+        the loop body) the iteration hands out the messages already received
+        and then ends, closing the connections, within one step().
+        """
+        self._running = False
+        if not self._iterating:
+            self.close()